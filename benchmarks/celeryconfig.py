@@ -0,0 +1,5 @@
+# Benchmark only: tasks run in process, no broker or result backend required.
+broker_url = 'memory://'
+result_backend = 'cache+memory://'
+task_always_eager = True
+task_eager_propagates = True
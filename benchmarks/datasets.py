@@ -0,0 +1,164 @@
+"""
+Synthetic zip datasets for the benchmarks: polygon shapefiles and
+geographic GeoTIFFs with FGDC or MODS metadata.
+"""
+import os
+import random
+import struct
+import zipfile
+
+wgs84_prj = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,'
+             '298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+# Colorado
+extent = (-109.0, 37.0, -102.0, 41.0)
+
+fgdc_template = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata>
+  <idinfo>
+    <citation><citeinfo>
+      <origin>Benchmark Survey {index}</origin>
+      <pubdate>2019</pubdate>
+      <title>{title}</title>
+      <pubinfo><publish>University of Colorado Boulder</publish></pubinfo>
+    </citeinfo></citation>
+    <descript><abstract>{abstract}</abstract><purpose>Benchmark</purpose></descript>
+    <keywords>
+      <theme><themekt>None</themekt><themekey>benchmark</themekey><themekey>{kind}</themekey></theme>
+      <place><placekt>None</placekt><placekey>Colorado</placekey></place>
+    </keywords>
+  </idinfo>
+  <eainfo>{entities}</eainfo>
+</metadata>
+"""
+fgdc_entity = ("<detailed><enttyp><enttypl>layer</enttypl></enttyp><attr><attrlabl>FIELD{0}</attrlabl>"
+               "<attrdef>Synthetic attribute {0}</attrdef></attr></detailed>")
+
+mods_template = """<?xml version="1.0" encoding="UTF-8"?>
+<mods:mods xmlns:mods="http://www.loc.gov/mods/v3" version="3.5">
+  <mods:titleInfo><mods:title>{title}</mods:title></mods:titleInfo>
+  <mods:name><mods:namePart>Benchmark Survey {index}</mods:namePart></mods:name>
+  <mods:originInfo><mods:publisher>University of Colorado Boulder</mods:publisher>
+    <mods:dateIssued>2019</mods:dateIssued><mods:dateCreated>2018</mods:dateCreated></mods:originInfo>
+  <mods:abstract>{abstract}</mods:abstract>
+  <mods:subject><mods:topic>benchmark</mods:topic><mods:topic>{kind}</mods:topic>
+    <mods:geographic>Colorado</mods:geographic></mods:subject>
+</mods:mods>
+"""
+
+
+def randomBBox(rng, size=0.5):
+    x = rng.uniform(extent[0], extent[2] - size)
+    y = rng.uniform(extent[1], extent[3] - size)
+    return [x, y, x + size, y + size]
+
+
+def shapefileFiles(stem, bbox, polygons=1):
+    """
+    Polygon shapefile (.shp, .shx, .dbf, .prj) with square polygons inside bbox.
+    Returns:
+        dict: {filename: bytes}
+    """
+    xmin, ymin, xmax, ymax = bbox
+    step = (xmax - xmin) / polygons
+    records = []
+    for idx in range(polygons):
+        x0, x1 = xmin + idx * step, xmin + (idx + 1) * step
+        points = [(x0, ymin), (x0, ymax), (x1, ymax), (x1, ymin), (x0, ymin)]
+        content = struct.pack('<i4d2i', 5, x0, ymin, x1, ymax, 1, len(points))
+        content += struct.pack('<i', 0)
+        content += b''.join(struct.pack('<2d', *p) for p in points)
+        records.append(content)
+
+    def header(length):
+        return (struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length // 2) +
+                struct.pack('<2i', 1000, 5) + struct.pack('<8d', xmin, ymin, xmax, ymax, 0, 0, 0, 0))
+    shp, shx, offset = b'', b'', 100
+    for idx, content in enumerate(records):
+        shp += struct.pack('>2i', idx + 1, len(content) // 2) + content
+        shx += struct.pack('>2i', offset // 2, len(content) // 2)
+        offset += 8 + len(content)
+    shp = header(100 + len(shp)) + shp
+    shx = header(100 + len(shx)) + shx
+    # dBase III table with one numeric ID field
+    dbf = struct.pack('<B3BIHH20x', 3, 119, 1, 1, polygons, 65, 11)
+    dbf += struct.pack('<11sc4xBB14x', b'ID', b'N', 10, 0)
+    dbf += b'\r'
+    dbf += b''.join(b' ' + str(idx + 1).rjust(10).encode('ascii') for idx in range(polygons))
+    dbf += b'\x1a'
+    return {stem + '.shp': shp, stem + '.shx': shx, stem + '.dbf': dbf,
+            stem + '.prj': wgs84_prj.encode('ascii')}
+
+
+def geotiffFile(bbox, width=256, height=256):
+    """
+    Uncompressed 8 bit single strip GeoTIFF in EPSG:4326 covering bbox.
+    """
+    pixels = bytes(bytearray((x * y) % 256 for y in range(height) for x in range(width)))
+    scale = struct.pack('<3d', (bbox[2] - bbox[0]) / width, (bbox[3] - bbox[1]) / height, 0)
+    tiepoint = struct.pack('<6d', 0, 0, 0, bbox[0], bbox[3], 0)
+    geokeys = struct.pack('<16H', 1, 1, 0, 3, 1024, 0, 1, 2, 1025, 0, 1, 1, 2048, 0, 1, 4326)
+    tags = [(256, 3, 1, width), (257, 3, 1, height), (258, 3, 1, 8), (259, 3, 1, 1),
+            (262, 3, 1, 1), (273, 4, 1, None), (277, 3, 1, 1), (278, 3, 1, height),
+            (279, 4, 1, len(pixels)), (33550, 12, 3, scale), (33922, 12, 6, tiepoint),
+            (34735, 3, 16, geokeys)]
+    ifd_size = 2 + 12 * len(tags) + 4
+    extra_offset = 8 + ifd_size
+    extra = b''
+    entries = b''
+    for tag, type_, count, value in tags:
+        if isinstance(value, bytes):
+            entries += struct.pack('<HHII', tag, type_, count, extra_offset + len(extra))
+            extra += value
+        elif tag == 273:
+            entries += struct.pack('<HHII', tag, type_, count, 0)
+        elif type_ == 3:
+            entries += struct.pack('<HHIH2x', tag, type_, count, value)
+        else:
+            entries += struct.pack('<HHII', tag, type_, count, value)
+    data_offset = extra_offset + len(extra)
+    entries = entries.replace(struct.pack('<HHII', 273, 4, 1, 0),
+                              struct.pack('<HHII', 273, 4, 1, data_offset))
+    ifd = struct.pack('<H', len(tags)) + entries + struct.pack('<I', 0)
+    return b'II' + struct.pack('<HI', 42, 8) + ifd + extra + pixels
+
+
+def metadataFile(kind, index, title, standard='fgdc', attributes=10):
+    abstract = "Synthetic {0} dataset {1} generated for benchmarking. ".format(kind, index) * 5
+    if standard == 'mods':
+        return mods_template.format(index=index, title=title, abstract=abstract, kind=kind)
+    entities = ''.join(fgdc_entity.format(idx) for idx in range(attributes))
+    return fgdc_template.format(index=index, title=title, abstract=abstract, kind=kind,
+                                entities=entities)
+
+
+def generateDatasets(folder, shapefiles=10, rasters=2, metadata='mixed', seed=42,
+                     raster_size=256, attributes=10):
+    """
+    Write zip datasets to folder.
+    kwargs:
+        metadata (string): fgdc, mods or mixed (alternating)
+    Returns:
+        list: {"zip", "name", "kind", "bbox", "standard"} per dataset
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    datasets = []
+    kinds = ['shapefile'] * shapefiles + ['image'] * rasters
+    for index, kind in enumerate(kinds):
+        name = "bench_{0}_{1:04d}".format(kind, index)
+        standard = metadata if metadata != 'mixed' else ['fgdc', 'mods'][index % 2]
+        bbox = randomBBox(rng)
+        if kind == 'shapefile':
+            files = shapefileFiles(name, bbox, polygons=rng.randint(1, 20))
+        else:
+            files = {name + '.tif': geotiffFile(bbox, raster_size, raster_size)}
+        title = "Benchmark {0} {1}".format(kind, index)
+        files[name + '.xml'] = metadataFile(kind, index, title, standard,
+                                            attributes=attributes).encode('utf-8')
+        path = os.path.join(folder, name + '.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for filename, content in sorted(files.items()):
+                zip_ref.writestr(filename, content)
+        datasets.append({"zip": path, "name": name, "kind": kind, "bbox": bbox,
+                         "standard": standard})
+    return datasets
@@ -0,0 +1,270 @@
+"""
+End-to-end benchmark of the geoblacklightq tasks against local stand-ins.
+
+Runs the geoLibraryLoader stages on synthetic zip datasets, the batch
+crosswalk and the Solr streaming index / incremental sync, then reports
+per-stage latency and items/sec.
+
+    python benchmarks/run.py --shapefiles 20 --rasters 5 --latency 10
+    python benchmarks/run.py --save benchmarks/baselines/local.json
+    python benchmarks/run.py --compare benchmarks/baselines/local.json --tolerance 0.25
+
+The exit status is 1 when --compare finds a regression.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchdir))
+sys.path.insert(0, benchdir)
+
+from standins import startStandIns, standInEnvironment  # noqa: E402
+from datasets import generateDatasets  # noqa: E402
+
+services = ['geoserver', 'solr', 'ark', 'catalog', 'static']
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    idx = min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[idx]
+
+
+class StageTimer(object):
+    """
+    Collect latency samples and item counts per stage.
+    """
+
+    def __init__(self):
+        self.samples = {}
+
+    def run(self, stage, func, *args, **kwargs):
+        """
+        Time func. items (kwarg) is the number of items the call handles.
+        Returns (result, error)
+        """
+        items = kwargs.pop('items', 1)
+        record = self.samples.setdefault(stage, {"latency": [], "items": 0, "errors": []})
+        start = time.perf_counter()
+        try:
+            result, error = func(*args, **kwargs), None
+        except Exception as inst:
+            result, error = None, "{0}: {1}".format(type(inst).__name__, inst)
+            record["errors"].append(error)
+        record["latency"].append(time.perf_counter() - start)
+        if not error:
+            record["items"] = record["items"] + items
+        return result, error
+
+    def report(self):
+        stages = {}
+        for stage, record in self.samples.items():
+            latency = record["latency"]
+            total = sum(latency)
+            stages[stage] = {"calls": len(latency), "errors": len(record["errors"]),
+                             "items": record["items"], "total": total,
+                             "mean": total / len(latency), "p50": percentile(latency, 50),
+                             "p95": percentile(latency, 95), "max": max(latency),
+                             "items_per_sec": record["items"] / total if total else None,
+                             "first_error": record["errors"][0] if record["errors"] else None}
+        return stages
+
+
+def configureEnvironment(standins, workdir, items):
+    env = standInEnvironment(standins)
+    env.update({"TMPDIR": os.path.join(workdir, 'tmp'),
+                "DATASETS_DIR": os.path.join(workdir, 'datasets'),
+                "METADATA_DIR": os.path.join(workdir, 'metadata'),
+                "ARK_POOL_FILE": os.path.join(workdir, 'ark_pool.json'),
+                "GEOSERVER_LIMIT_FILE": os.path.join(workdir, 'geoserver_limit.json'),
+                "ARK_POOL_SIZE": str(items + 10), "ARK_POOL_LOW": "0",
+                "UNZIP_DISK_RESERVE": "0"})
+    for key in ['tmp', 'datasets', 'metadata', 'geo_tasks']:
+        os.makedirs(os.path.join(workdir, key), exist_ok=True)
+    os.environ.update(env)
+    return env
+
+
+def runLoader(timer, datasets, workdir):
+    """
+    geoLibraryLoader stages per zip file. Returns crosswalked items.
+    """
+    from geoblacklightq.tasks.geotransmeta import unzip, determineTypeBounds, optimizeRasters
+    from geoblacklightq.tasks.geotransmeta import configureGeoData, crossWalkGeoBlacklight
+    from geoblacklightq.tasks.geoservertasks import dataLoadGeoserver
+    loaded = []
+    for dataset in datasets:
+        resultDir = os.path.join(workdir, 'geo_tasks', dataset["name"])
+        os.makedirs(resultDir, exist_ok=True)
+        data, error = timer.run('unzip', unzip, dataset["zip"], selective=True)
+        steps = [('determine_type_bounds', lambda d: determineTypeBounds(d, resultDir)),
+                 ('optimize_rasters', lambda d: optimizeRasters(d, resultDir)),
+                 ('geoserver_load', dataLoadGeoserver),
+                 ('configure_geodata', lambda d: configureGeoData(d, resultDir)),
+                 ('crosswalk', crossWalkGeoBlacklight)]
+        for stage, func in steps:
+            if error:
+                break
+            data, error = timer.run(stage, func, data)
+        if not error:
+            loaded.append(data)
+    return loaded
+
+
+def crosswalkRecords(loaded):
+    records = []
+    for data in loaded:
+        gblight = data["geoblacklightschema"]
+        xml = [os.path.join(data["folder"], f) for f in data["xml"]["files"]] \
+            if isinstance(data.get("xml"), dict) and data["xml"].get("files") else []
+        if not xml:
+            continue
+        records.append({"filename": xml[0],
+                        "layername": os.path.splitext(os.path.basename(data["file"]))[0],
+                        "geoserver_layername": data["geoserverStoreName"],
+                        "resource_type": data["resource_type"], "zipurl": data["zipurl"],
+                        "mod_url": "", "ark": gblight["layer_slug_s"].replace('-', '/')})
+    return records
+
+
+def runBenchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='geoblacklightq_bench_')
+    latency = dict((name, args.latency / 1000.0) for name in services)
+    for override in args.service_latency or []:
+        name, value = override.split('=')
+        latency[name] = float(value) / 1000.0
+    standins = startStandIns(latency)
+    items = args.shapefiles + args.rasters
+    configureEnvironment(standins, workdir, items)
+    datasets = generateDatasets(os.path.join(workdir, 'zips'), shapefiles=args.shapefiles,
+                                rasters=args.rasters, metadata=args.metadata,
+                                raster_size=args.raster_size)
+    from geoblacklightq.tasks.arkpool import refillArkPool
+    from geoblacklightq.tasks.geotransmeta import crossWalkChunk
+    from geoblacklightq.tasks.workflow import solrStreamIndexItems, syncSolrIndex
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    timer.run('ark_refill', refillArkPool, items=items)
+    loaded = runLoader(timer, datasets, workdir)
+    records = crosswalkRecords(loaded)
+    if records:
+        timer.run('crosswalk_chunk', crossWalkChunk, records, items=len(records))
+    # catalog holds the crosswalked items repeated up to --catalog-records
+    catalog = standins['catalog']
+    base = [data["geoblacklightschema"] for data in loaded] or [{"dc_title_s": "empty"}]
+    for idx in range(args.catalog_records):
+        record = dict(base[idx % len(base)])
+        record["layer_slug_s"] = "bench-{0:06d}".format(idx)
+        record["status"] = "indexed"
+        catalog.records.append(record)
+    timer.run('solr_stream_index', solrStreamIndexItems, batch_size=args.solr_batch_size,
+              items=args.catalog_records)
+    for record in catalog.records[::10]:
+        record["dc_description_s"] = "changed"
+    del catalog.records[-max(args.catalog_records // 20, 1):]
+    timer.run('solr_sync', syncSolrIndex, batch_size=args.solr_batch_size,
+              items=args.catalog_records)
+    elapsed = time.perf_counter() - start
+    for standin in standins.values():
+        standin.stop()
+    return {"meta": {"datasets": items, "shapefiles": args.shapefiles, "rasters": args.rasters,
+                     "catalog_records": args.catalog_records, "latency_ms": args.latency,
+                     "service_latency": args.service_latency or [],
+                     "python": platform.python_version(), "platform": platform.platform(),
+                     "created": time.strftime('%Y-%m-%dT%H:%M:%S'), "elapsed": elapsed,
+                     "loaded": len(loaded), "workdir": workdir,
+                     "requests": dict((name, s.requests) for name, s in standins.items())},
+            "stages": timer.report()}
+
+
+def compareBaseline(result, baseline, tolerance, min_delta=0.001):
+    """
+    Stages slower (p50) or with lower throughput than baseline by more than tolerance.
+    p50 differences below min_delta seconds per call are treated as noise.
+    """
+    regressions = []
+    for stage, current in result["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if not previous:
+            continue
+        if previous["p50"] and current["p50"] > previous["p50"] * (1 + tolerance) and \
+                current["p50"] - previous["p50"] >= min_delta:
+            regressions.append({"stage": stage, "metric": "p50", "baseline": previous["p50"],
+                                "current": current["p50"]})
+        if previous["items_per_sec"] and (current["items_per_sec"] or 0) < \
+                previous["items_per_sec"] * (1 - tolerance):
+            regressions.append({"stage": stage, "metric": "items_per_sec",
+                                "baseline": previous["items_per_sec"],
+                                "current": current["items_per_sec"]})
+        if current["errors"] > previous["errors"]:
+            regressions.append({"stage": stage, "metric": "errors", "baseline": previous["errors"],
+                                "current": current["errors"]})
+    return regressions
+
+
+def printReport(result, regressions=None):
+    header = "{0:<22} {1:>6} {2:>6} {3:>10} {4:>10} {5:>10} {6:>12}".format(
+        "stage", "calls", "errors", "mean ms", "p50 ms", "p95 ms", "items/sec")
+    print(header)
+    print('-' * len(header))
+    for stage, s in result["stages"].items():
+        print("{0:<22} {1:>6} {2:>6} {3:>10.1f} {4:>10.1f} {5:>10.1f} {6:>12}".format(
+            stage, s["calls"], s["errors"], s["mean"] * 1000, s["p50"] * 1000, s["p95"] * 1000,
+            "{0:.1f}".format(s["items_per_sec"]) if s["items_per_sec"] else "-"))
+        if s["first_error"]:
+            print("    first error: {0}".format(s["first_error"][:200]))
+    print("\n{0} datasets loaded in {1:.1f}s".format(result["meta"]["loaded"],
+                                                    result["meta"]["elapsed"]))
+    for reg in regressions or []:
+        print("REGRESSION {stage} {metric}: baseline {baseline} current {current}".format(**reg))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shapefiles', type=int, default=10)
+    parser.add_argument('--rasters', type=int, default=2)
+    parser.add_argument('--metadata', choices=['fgdc', 'mods', 'mixed'], default='mixed')
+    parser.add_argument('--raster-size', type=int, default=256)
+    parser.add_argument('--catalog-records', type=int, default=2000)
+    parser.add_argument('--solr-batch-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=5.0,
+                        help='milliseconds added to every stand-in request')
+    parser.add_argument('--service-latency', action='append',
+                        help='per service latency in ms, e.g. geoserver=50')
+    parser.add_argument('--workdir')
+    parser.add_argument('--save', help='write results as a baseline JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-delta', type=float, default=1.0,
+                        help='ignore p50 differences below this many milliseconds')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    result = runBenchmark(args)
+    regressions = None
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compareBaseline(result, json.load(f), args.tolerance,
+                                          min_delta=args.min_delta / 1000.0)
+        result["regressions"] = regressions
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        printReport(result, regressions)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,567 @@
+"""
+Local HTTP stand-ins for the services used by the geoblacklightq tasks.
+GeoServer REST, Solr, ARK, the cybercom catalog API and the static file server
+are emulated in memory with a configurable latency per request.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import hashlib
+import io
+import json
+import re
+import struct
+import threading
+import time
+import uuid
+import zipfile
+
+atom = 'xmlns:atom="http://www.w3.org/2005/Atom"'
+shape_bindings = {1: "Point", 3: "MultiLineString", 5: "MultiPolygon", 8: "MultiPoint"}
+default_bbox = [-109.276, 36.933, -101.916, 41.037]
+blank_mods = ('<?xml version="1.0" encoding="UTF-8"?>'
+              '<mods:mods xmlns:mods="http://www.loc.gov/mods/v3"></mods:mods>')
+
+
+class StandIn(object):
+    """
+    Base stand-in. Subclasses implement handle(method, path, query, body)
+    and return (status, content_type, body).
+    etag: GET responses carry an ETag and answer If-None-Match with 304.
+    """
+    name = None
+    etag = False
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.server = None
+        self.base_url = None
+
+    def respond(self, handler, method):
+        with self.lock:
+            self.requests = self.requests + 1
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(handler.path)
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        try:
+            status, content_type, payload = self.handle(method, url.path, query, body)
+        except Exception as inst:
+            status, content_type, payload = 500, 'text/plain', "{0}: {1}".format(
+                type(inst).__name__, inst)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        etag = None
+        if self.etag and method == 'GET' and status == 200:
+            etag = '"{0}"'.format(hashlib.md5(payload).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                status, payload = 304, b''
+        handler.send_response(status)
+        if etag:
+            handler.send_header('ETag', etag)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def handle(self, method, path, query, body):
+        return 404, 'text/plain', 'Not found'
+
+    def start(self, host='127.0.0.1', port=0):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                standin.respond(self, 'GET')
+
+            def do_POST(self):
+                standin.respond(self, 'POST')
+
+            def do_PUT(self):
+                standin.respond(self, 'PUT')
+
+            def do_DELETE(self):
+                standin.respond(self, 'DELETE')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = "http://{0}:{1}".format(host, self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class GeoServerStandIn(StandIn):
+    """
+    GeoServer REST catalog (workspaces, data/coverage stores, feature types,
+    coverages, layers and styles) as used by gsconfig and geoservertasks.
+    Shapefile uploads read geometry type and bounds from the .shp header.
+    WFS/WCS GetCapabilities of a workspace are answered with an ETag.
+    """
+    name = 'geoserver'
+    etag = True
+    styles = ['polygon', 'line', 'point', 'raster', 'generic']
+
+    def __init__(self, latency=0.0, workspaces=('geocolorado',)):
+        super(GeoServerStandIn, self).__init__(latency)
+        self.workspaces = dict((ws, {"datastores": {}, "coveragestores": {}}) for ws in workspaces)
+        self.layers = {}
+
+    @property
+    def rest(self):
+        return "{0}/geoserver/rest".format(self.base_url)
+
+    def link(self, path):
+        return '<atom:link {0} rel="alternate" href="{1}/{2}" type="application/xml"/>'.format(
+            atom, self.rest, path)
+
+    def addLayer(self, ws, store, name, kind, bbox, binding=None):
+        resource = {"name": name, "store": store, "kind": kind, "bbox": bbox, "binding": binding}
+        key = 'featuretypes' if kind == 'featureType' else 'coverages'
+        self.workspaces[ws]['datastores' if kind == 'featureType' else 'coveragestores'][
+            store][key][name] = resource
+        style = {'MultiPolygon': 'polygon', 'MultiLineString': 'line', 'Point': 'point',
+                 'MultiPoint': 'point'}.get(binding, 'raster')
+        self.layers[name] = {"ws": ws, "resource": resource, "style": style}
+
+    def findResource(self, ws, name):
+        for kind, key in [('datastores', 'featuretypes'), ('coveragestores', 'coverages')]:
+            for store in self.workspaces.get(ws, {}).get(kind, {}).values():
+                if name in store[key]:
+                    return store[key][name]
+        return None
+
+    def storeXml(self, ws, kind, store):
+        tag = 'dataStore' if kind == 'datastores' else 'coverageStore'
+        child = 'featureTypes' if kind == 'datastores' else 'coverages'
+        url = '<url>{0}</url>'.format(escape(store.get('url', ''))) if store.get('url') else ''
+        return ('<{0}><name>{1}</name><type>{2}</type><enabled>true</enabled>{3}'
+                '<workspace><name>{4}</name></workspace><{5}>{6}</{5}></{0}>').format(
+            tag, store['name'], store['type'], url, ws, child,
+            self.link("workspaces/{0}/{1}/{2}/{3}.xml".format(ws, kind, store['name'], child.lower())))
+
+    def resourceXml(self, ws, resource):
+        tag = resource['kind']
+        bbox = resource['bbox']
+        envelope = ('<minx>{0}</minx><maxx>{2}</maxx><miny>{1}</miny><maxy>{3}</maxy>'
+                    '<crs>EPSG:4326</crs>').format(*bbox)
+        kind = 'datastores' if tag == 'featureType' else 'coveragestores'
+        store_tag = 'dataStore' if tag == 'featureType' else 'coverageStore'
+        return ('<{0}><name>{1}</name><nativeName>{1}</nativeName><title>{1}</title>'
+                '<namespace><name>{2}</name></namespace><srs>EPSG:4326</srs>'
+                '<nativeBoundingBox>{3}</nativeBoundingBox><latLonBoundingBox>{3}</latLonBoundingBox>'
+                '<projectionPolicy>REPROJECT_TO_DECLARED</projectionPolicy><enabled>true</enabled>'
+                '<store class="{4}"><name>{2}:{5}</name>{6}</store></{0}>').format(
+            tag, resource['name'], ws, envelope, store_tag, resource['store'],
+            self.link("workspaces/{0}/{1}/{2}.xml".format(ws, kind, resource['store'])))
+
+    def resourceJson(self, ws, resource):
+        bbox = resource['bbox']
+        envelope = {"minx": bbox[0], "miny": bbox[1], "maxx": bbox[2], "maxy": bbox[3],
+                    "crs": "EPSG:4326"}
+        data = {"name": resource['name'], "nativeName": resource['name'],
+                "srs": "EPSG:4326", "nativeBoundingBox": envelope, "latLonBoundingBox": envelope}
+        if resource['kind'] == 'featureType':
+            data["attributes"] = {"attribute": [
+                {"name": "the_geom", "binding": "org.locationtech.jts.geom.{0}".format(
+                    resource['binding'] or 'Geometry')},
+                {"name": "ID", "binding": "java.lang.Long"}]}
+        return {resource['kind']: data}
+
+    def createFromShapefileZip(self, ws, store, body):
+        with zipfile.ZipFile(io.BytesIO(body)) as zip_ref:
+            shp = [n for n in zip_ref.namelist() if n.lower().endswith('.shp')]
+            if not shp:
+                return 400, 'text/plain', 'No shapefile in upload'
+            header = zip_ref.read(shp[0])[:100]
+        shape_type, = struct.unpack('<i', header[32:36])
+        bbox = list(struct.unpack('<4d', header[36:68]))
+        stores = self.workspaces[ws]['datastores']
+        if store in stores:
+            return 500, 'text/plain', 'Store {0} already exists'.format(store)
+        stores[store] = {"name": store, "type": "Shapefile", "featuretypes": {}}
+        self.addLayer(ws, store, store, 'featureType', bbox,
+                      binding=shape_bindings.get(shape_type, 'Geometry'))
+        return 201, 'text/plain', ''
+
+    def handle(self, method, path, query, body):
+        match = re.match(r'^/geoserver/rest/(.*?)(\.(xml|json))?$', path)
+        if not match:
+            match = re.match(r'^/geoserver/([^/]+)/(ows|wfs)$', path)
+            if match and method == 'GET':
+                if query.get('SERVICE', '').upper() == 'WCS':
+                    return self.coverageCapabilities(match.group(1))
+                return self.capabilities(match.group(1))
+            return 404, 'text/plain', 'Not found'
+        parts = [p for p in match.group(1).split('/') if p]
+        fmt = match.group(3) or 'xml'
+        with self.lock:
+            return self.route(method, parts, fmt, query, body)
+
+    def route(self, method, parts, fmt, query, body):
+        if parts == ['workspaces']:
+            items = ''.join('<workspace><name>{0}</name>{1}</workspace>'.format(
+                ws, self.link("workspaces/{0}.xml".format(ws))) for ws in self.workspaces)
+            return 200, 'application/xml', '<workspaces>{0}</workspaces>'.format(items)
+        if parts == ['styles']:
+            if fmt == 'json':
+                return 200, 'application/json', {"styles": {"style": [
+                    {"name": s, "href": "{0}/styles/{1}.json".format(self.rest, s)} for s in self.styles]}}
+            items = ''.join('<style><name>{0}</name></style>'.format(s) for s in self.styles)
+            return 200, 'application/xml', '<styles>{0}</styles>'.format(items)
+        if parts == ['layers']:
+            items = ''.join('<layer><name>{0}</name></layer>'.format(l) for l in self.layers)
+            return 200, 'application/xml', '<layers>{0}</layers>'.format(items)
+        if len(parts) == 2 and parts[0] == 'layers':
+            name = parts[1].split(':')[-1]
+            layer = self.layers.get(name)
+            if not layer:
+                return 404, 'text/plain', 'No such layer: {0}'.format(name)
+            if method == 'PUT':
+                data = json.loads(body.decode('utf-8'))
+                style = data.get("layer", {}).get("defaultStyle")
+                layer["style"] = style["name"] if isinstance(style, dict) else style
+                return 200, 'text/plain', ''
+            kind = layer['resource']['kind']
+            return 200, 'application/json', {"layer": {
+                "name": name, "type": "VECTOR" if kind == 'featureType' else "RASTER",
+                "defaultStyle": {"name": layer["style"]},
+                "resource": {"@class": kind, "name": "{0}:{1}".format(layer["ws"], name)}}}
+        if not parts or parts[0] != 'workspaces' or len(parts) < 2:
+            return 404, 'text/plain', 'Not found'
+        ws = parts[1]
+        if ws not in self.workspaces:
+            return 404, 'text/plain', 'No such workspace: {0}'.format(ws)
+        workspace = self.workspaces[ws]
+        if len(parts) == 2:
+            return 200, 'application/xml', '<workspace><name>{0}</name></workspace>'.format(ws)
+        kind = parts[2]
+        if kind == 'featuretypes' and len(parts) == 4:
+            resource = self.findResource(ws, parts[3])
+            if not resource:
+                return 404, 'text/plain', 'No such feature type: {0}'.format(parts[3])
+            return 200, 'application/json', self.resourceJson(ws, resource)
+        if kind == 'styles' and len(parts) == 3:
+            # GeoServer answers an empty list as an empty string
+            return 200, 'application/json', {"styles": ""}
+        if kind not in ['datastores', 'coveragestores', 'wmsstores', 'wmtsstores']:
+            return 404, 'text/plain', 'Not found'
+        stores = workspace.get(kind, {})
+        tag = {'datastores': 'dataStore', 'coveragestores': 'coverageStore'}.get(kind, 'wmsStore')
+        if len(parts) == 3:
+            if method == 'POST':
+                node = ElementTree.fromstring(body)
+                name = node.findtext('name')
+                stores[name] = {"name": name, "type": node.findtext('type') or "GeoTIFF",
+                                "url": node.findtext('url'), "coverages": {}}
+                return 201, 'text/plain', name
+            items = ''.join('<{0}><name>{1}</name>{2}</{0}>'.format(
+                tag, s, self.link("workspaces/{0}/{1}/{2}.xml".format(ws, kind, s))) for s in stores)
+            return 200, 'application/xml', '<{0}s>{1}</{0}s>'.format(tag, items)
+        store_name = parts[3]
+        if len(parts) == 5 and parts[4].startswith('file') and method == 'PUT':
+            return self.createFromShapefileZip(ws, store_name, body)
+        store = stores.get(store_name)
+        if store is None:
+            if method in ['PUT', 'POST'] and kind == 'coveragestores' and len(parts) == 4:
+                stores[store_name] = {"name": store_name, "type": "GeoTIFF", "coverages": {}}
+                return 201, 'text/plain', store_name
+            return 404, 'text/plain', 'No such store: {0}'.format(store_name)
+        if len(parts) == 4:
+            if method == 'DELETE':
+                child = 'featuretypes' if kind == 'datastores' else 'coverages'
+                for name in store.get(child, {}):
+                    self.layers.pop(name, None)
+                del stores[store_name]
+                return 200, 'text/plain', ''
+            if method == 'PUT':
+                node = ElementTree.fromstring(body)
+                for field in ['type', 'url']:
+                    if node.findtext(field):
+                        store[field] = node.findtext(field)
+                return 200, 'text/plain', ''
+            return 200, 'application/xml', self.storeXml(ws, kind, store)
+        child = parts[4]
+        resources = store.setdefault(child, {})
+        if len(parts) == 5:
+            if method == 'POST':
+                data = json.loads(body.decode('utf-8'))["coverage"]
+                self.addLayer(ws, store_name, data["name"], 'coverage', list(default_bbox))
+                return 201, 'text/plain', data["name"]
+            item = 'featureType' if child == 'featuretypes' else 'coverage'
+            items = ''.join('<{0}><name>{1}</name>{2}</{0}>'.format(
+                item, r, self.link("workspaces/{0}/{1}/{2}/{3}/{4}.xml".format(
+                    ws, kind, store_name, child, r))) for r in resources)
+            return 200, 'application/xml', '<{0}s>{1}</{0}s>'.format(item, items)
+        resource = resources.get(parts[5]) or (list(resources.values())[0] if resources else None)
+        if resource is None:
+            return 404, 'text/plain', 'No such resource: {0}'.format(parts[5])
+        if method in ['PUT', 'POST']:
+            return 200, 'text/plain', ''
+        if fmt == 'json':
+            return 200, 'application/json', self.resourceJson(ws, resource)
+        return 200, 'application/xml', self.resourceXml(ws, resource)
+
+    def capabilities(self, ws):
+        items = []
+        for store in self.workspaces.get(ws, {}).get('datastores', {}).values():
+            for resource in store['featuretypes'].values():
+                bbox = resource['bbox']
+                items.append(
+                    '<FeatureType><Name>{0}:{1}</Name><Title>{1}</Title><DefaultCRS>'
+                    'urn:ogc:def:crs:EPSG::4326</DefaultCRS><ows:WGS84BoundingBox>'
+                    '<ows:LowerCorner>{2} {3}</ows:LowerCorner><ows:UpperCorner>{4} {5}'
+                    '</ows:UpperCorner></ows:WGS84BoundingBox></FeatureType>'.format(
+                        ws, resource['name'], *bbox))
+        return 200, 'application/xml', (
+            '<wfs:WFS_Capabilities xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+            'xmlns:ows="http://www.opengis.net/ows/1.1"><FeatureTypeList>{0}'
+            '</FeatureTypeList></wfs:WFS_Capabilities>').format(''.join(items))
+
+    def coverageCapabilities(self, ws):
+        items = []
+        for store in self.workspaces.get(ws, {}).get('coveragestores', {}).values():
+            for resource in store['coverages'].values():
+                bbox = resource['bbox']
+                items.append(
+                    '<wcs:CoverageSummary><ows:Title>{1}</ows:Title><ows:WGS84BoundingBox>'
+                    '<ows:LowerCorner>{2} {3}</ows:LowerCorner><ows:UpperCorner>{4} {5}'
+                    '</ows:UpperCorner></ows:WGS84BoundingBox><wcs:Identifier>{0}:{1}'
+                    '</wcs:Identifier><wcs:SupportedCRS>urn:ogc:def:crs:EPSG::4326'
+                    '</wcs:SupportedCRS></wcs:CoverageSummary>'.format(ws, resource['name'], *bbox))
+        return 200, 'application/xml', (
+            '<wcs:Capabilities xmlns:wcs="http://www.opengis.net/wcs/1.1.1" '
+            'xmlns:ows="http://www.opengis.net/ows/1.1"><wcs:Contents>{0}'
+            '</wcs:Contents></wcs:Capabilities>').format(''.join(items))
+
+
+class SolrStandIn(StandIn):
+    """
+    Solr update and select handlers (JSON and XML delete-by-query, cursorMark
+    paging) plus CoreAdmin STATUS/CREATE/SWAP/UNLOAD.
+    """
+    name = 'solr'
+
+    def __init__(self, latency=0.0, cores=('geoblacklight',), unique_key='layer_slug_s'):
+        super(SolrStandIn, self).__init__(latency)
+        self.unique_key = unique_key
+        self.cores = dict((core, {}) for core in cores)
+
+    def handle(self, method, path, query, body):
+        parts = [p for p in path.split('/') if p]
+        if parts[:3] == ['solr', 'admin', 'cores']:
+            return self.coreAdmin(query)
+        if len(parts) < 3 or parts[0] != 'solr':
+            return 404, 'text/plain', 'Not found'
+        core, handler = parts[1], parts[2]
+        with self.lock:
+            if core not in self.cores:
+                return 404, 'text/plain', 'No such core: {0}'.format(core)
+            if handler == 'update':
+                return self.update(self.cores[core], body)
+            if handler == 'select':
+                return self.select(self.cores[core], query)
+        return 404, 'text/plain', 'Not found'
+
+    def ok(self, **extra):
+        data = {"responseHeader": {"status": 0, "QTime": 0}}
+        data.update(extra)
+        return 200, 'application/json', data
+
+    def update(self, docs, body):
+        text = body.decode('utf-8').strip()
+        if text.startswith('<'):
+            if '<query>*:*</query>' in text:
+                docs.clear()
+            return self.ok()
+        data = json.loads(text) if text else {}
+        if isinstance(data, list):
+            for doc in data:
+                docs[doc[self.unique_key]] = doc
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                if key == 'add':
+                    doc = value.get('doc', value)
+                    docs[doc[self.unique_key]] = doc
+                elif key == 'delete':
+                    if isinstance(value, dict) and value.get('query') == '*:*':
+                        docs.clear()
+                    else:
+                        for doc_id in value if isinstance(value, list) else [value]:
+                            docs.pop(doc_id, None)
+        return self.ok()
+
+    def select(self, docs, query):
+        q = query.get('q', '*:*')
+        rows = int(query.get('rows', 10))
+        matched = [docs[key] for key in sorted(docs)]
+        if q != '*:*' and ':' in q:
+            field, value = q.split(':', 1)
+            value = value.strip('"')
+            matched = [doc for doc in matched if str(doc.get(field)) == value]
+        cursor = query.get('cursorMark')
+        if cursor:
+            if cursor != '*':
+                matched = [doc for doc in matched if doc[self.unique_key] > cursor]
+            page = matched[:rows]
+            next_cursor = page[-1][self.unique_key] if page else cursor
+        else:
+            start = int(query.get('start', 0))
+            page = matched[start:start + rows]
+            next_cursor = None
+        if query.get('fl'):
+            fields = query['fl'].split(',')
+            page = [dict((f, doc[f]) for f in fields if f in doc) for doc in page]
+        result = {"response": {"numFound": len(docs if q == '*:*' else matched), "start": 0,
+                               "docs": page}}
+        if cursor:
+            result["nextCursorMark"] = next_cursor
+        return self.ok(**result)
+
+    def coreAdmin(self, query):
+        action = query.get('action', 'STATUS').upper()
+        with self.lock:
+            if action == 'STATUS':
+                core = query.get('core')
+                status = dict((name, {"name": name, "instanceDir": "/var/solr/data/{0}".format(name),
+                                      "index": {"numDocs": len(docs)}})
+                              for name, docs in self.cores.items() if not core or name == core)
+                return self.ok(status=status)
+            if action == 'CREATE':
+                # Solr refuses a second core in an instanceDir holding core.properties
+                instanceDir = query.get('instanceDir', query['name']).rstrip('/').split('/')[-1]
+                if instanceDir in self.cores:
+                    return 500, 'application/json', {"responseHeader": {"status": 500}, "error": {
+                        "msg": "Core with name '{0}' already exists or another core is already "
+                               "defined there".format(instanceDir)}}
+                self.cores[query['name']] = {}
+            elif action == 'SWAP':
+                core, other = query['core'], query['other']
+                self.cores[core], self.cores[other] = self.cores[other], self.cores[core]
+            elif action == 'UNLOAD':
+                self.cores.pop(query['core'], None)
+        return self.ok()
+
+
+class ArkStandIn(StandIn):
+    """
+    ARK service: POST mints an ARK, PUT updates its record.
+    """
+    name = 'ark'
+
+    def __init__(self, latency=0.0, naan='47540'):
+        super(ArkStandIn, self).__init__(latency)
+        self.naan = naan
+        self.records = {}
+
+    def handle(self, method, path, query, body):
+        with self.lock:
+            if method == 'POST':
+                ark = "{0}/b{1:06d}".format(self.naan, len(self.records) + 1)
+                record = json.loads(body.decode('utf-8')) if body else {}
+                record["ark"] = ark
+                record["ark-detail"] = "{0}/ark:/detail/{1}/?format=json".format(self.base_url, ark)
+                self.records[ark] = dict(record)
+                return 201, 'application/json', {"results": [record]}
+            if method == 'PUT':
+                match = re.search(r'/detail/(.+?)/?$', path)
+                if not match or match.group(1) not in self.records:
+                    return 404, 'application/json', {"detail": "Not found."}
+                self.records[match.group(1)].update(json.loads(body.decode('utf-8')))
+                return 200, 'application/json', self.records[match.group(1)]
+        return 404, 'text/plain', 'Not found'
+
+
+class CatalogStandIn(StandIn):
+    """
+    cybercom catalog API collection geoportal: paged GET with query
+    filter/projection and POST of new records.
+    """
+    name = 'catalog'
+
+    def __init__(self, latency=0.0, records=None):
+        super(CatalogStandIn, self).__init__(latency)
+        self.records = list(records or [])
+
+    def handle(self, method, path, query, body):
+        if not path.startswith('/api/catalog/data/catalog/geoportal'):
+            return 404, 'text/plain', 'Not found'
+        with self.lock:
+            if method == 'POST':
+                record = json.loads(body.decode('utf-8'))
+                record['_id'] = uuid.uuid4().hex
+                self.records.append(record)
+                return 201, 'application/json', {"_id": record['_id']}
+            if method == 'PUT':
+                record_id = path.rstrip('/').split('/')[-1]
+                for record in self.records:
+                    if record.get('_id') == record_id:
+                        record.clear()
+                        record.update(json.loads(body.decode('utf-8')), _id=record_id)
+                        return 200, 'application/json', record
+                return 404, 'application/json', {"detail": "Not found."}
+            spec = json.loads(query.get('query', '{}'))
+            records = [r for r in self.records
+                       if all(r.get(k) == v for k, v in spec.get('filter', {}).items())]
+        page = int(query.get('page', 1))
+        page_size = int(query.get('page_size', 50))
+        results = records[(page - 1) * page_size:page * page_size]
+        hidden = [key for key, value in spec.get('projection', {}).items() if not value]
+        results = [dict((k, v) for k, v in r.items() if k not in hidden) for r in results]
+        return 200, 'application/json', {"count": len(records), "next": None, "results": results}
+
+
+class StaticStandIn(StandIn):
+    """
+    Static file server. Every metadata request returns a blank MODS record.
+    """
+    name = 'static'
+
+    def handle(self, method, path, query, body):
+        return 200, 'application/xml', blank_mods
+
+
+standin_classes = [GeoServerStandIn, SolrStandIn, ArkStandIn, CatalogStandIn, StaticStandIn]
+
+
+def startStandIns(latency=None):
+    """
+    Start every stand-in on a free local port.
+    latency (dict): seconds per request by service name
+    Returns:
+        dict: {name: StandIn}
+    """
+    latency = latency or {}
+    return dict((cls.name, cls(latency=latency.get(cls.name, 0.0)).start())
+                for cls in standin_classes)
+
+
+def standInEnvironment(standins):
+    """
+    Environment variables pointing the geoblacklightq tasks at the stand-ins.
+    """
+    return {"GEOSERVER_CONNECTION": "{0}/geoserver".format(standins['geoserver'].base_url),
+            "GEOSVR_USER": "admin", "GEOSRV_PASS": "geoserver",
+            "GEO_SOLR_URL": "{0}/solr".format(standins['solr'].base_url),
+            "ARK_URL": "{0}/ark:/".format(standins['ark'].base_url),
+            "CYBERCOM_API_URL": "{0}/api".format(standins['catalog'].base_url),
+            "ZIP_URL": "{0}/apps/geolibrary/datasets".format(standins['static'].base_url),
+            "RESULT_URL": "{0}/apps/geo_tasks/".format(standins['static'].base_url)}
@@ -2,3 +2,6 @@ from .tasks import *
 from .geotransmeta import *
 from .workflow import *
 from .geoservertasks import *
+from .arkpool import *
+from .ingestindex import *
+from .storagegc import *
@@ -0,0 +1,205 @@
+from celery import Celery
+import celeryconfig
+from contextlib import contextmanager
+from .clients import getSession
+from .routing import queueOptions
+import fcntl
+import json
+import os
+import time
+import uuid
+
+app = Celery()
+app.config_from_object(celeryconfig)
+
+arkurl = os.getenv('ARK_URL', "https://test-ark.colorado.edu/ark:/")
+arktoken = os.getenv('ARK_TOKEN', '')
+resulturl = os.getenv('RESULT_URL', "https://geo.colorado.edu/apps/geo_tasks/")
+# Pool of pre-minted ARKs shared by all workers on this host
+ark_pool_file = os.getenv('ARK_POOL_FILE', "/data/static/geo_tasks/ark_pool.json")
+ark_pool_size = int(os.getenv('ARK_POOL_SIZE', 100))
+ark_pool_low = int(os.getenv('ARK_POOL_LOW', 20))
+# Pending ARK updates are sent in batches after a short delay
+ark_finalize_delay = int(os.getenv('ARK_FINALIZE_DELAY', 30))
+ark_finalize_attempts = int(os.getenv('ARK_FINALIZE_ATTEMPTS', 5))
+# Seconds before a refill request is considered lost and may be sent again
+ark_refill_timeout = int(os.getenv('ARK_REFILL_TIMEOUT', 600))
+# Seconds past ARK_FINALIZE_DELAY before a finalize request is considered lost; also
+# the lease of updates being sent by a finalizeArks run
+ark_finalize_grace = int(os.getenv('ARK_FINALIZE_GRACE', 300))
+
+
+def arkHeaders():
+    return {"Content-Type": "application/json",
+            "Authorization": "Token {0}".format(arktoken)}
+
+
+@contextmanager
+def arkPool():
+    """
+    Exclusive access to the ARK pool file. Yields the pool state and saves it on exit.
+    state: available (minted ARK records), pending (updates to send),
+        failed (updates that ran out of attempts), refill_requested and
+        finalize_requested (timestamps)
+    """
+    os.makedirs(os.path.dirname(ark_pool_file), exist_ok=True)
+    with open("{0}.lock".format(ark_pool_file), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = {"available": [], "pending": [], "failed": [], "refill_requested": 0,
+                     "finalize_requested": 0}
+            if os.path.exists(ark_pool_file):
+                with open(ark_pool_file) as f:
+                    state.update(json.load(f))
+            yield state
+            tmp = "{0}.{1}.tmp".format(ark_pool_file, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, ark_pool_file)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def mintArk():
+    """
+    Mint one inactive ARK. Title, identifier and resolve_url are set when it is used.
+    """
+    resolve_url = resulturl.replace('apps/geo_tasks/', 'catalog/')
+    data = {"resolve_url": resolve_url, "generated_by": "geoBlacklightQ", "status": "inactive",
+            "metadata": {"mods": {"titleInfo": [{"title": ""}],
+                                  "typeOfResource": "", "identifier": "", "accessCondition": ""}}}
+    req = getSession('ark').post("{0}?format=json".format(
+        arkurl), data=json.dumps(data), headers=arkHeaders())
+    if req.status_code >= 400:
+        raise Exception(req.text)
+    return req.json()["results"][0]
+
+
+@app.task()
+def refillArkPool(size=ark_pool_size):
+    """
+    Mint ARKs until the pool holds size ARKs.
+    """
+    with arkPool() as state:
+        needed = size - len(state["available"])
+    minted = []
+    try:
+        for idx in range(max(needed, 0)):
+            minted.append(mintArk())
+    finally:
+        with arkPool() as state:
+            state["available"].extend(minted)
+            state["refill_requested"] = 0
+            available = len(state["available"])
+    return {"minted": len(minted), "available": available}
+
+
+def finalizeDue(state, now):
+    """
+    True when pending updates not leased to a running finalizeArks need a run:
+    none was requested or the request is older than ARK_FINALIZE_DELAY +
+    ARK_FINALIZE_GRACE (message lost). Marks the request in state.
+    """
+    if not any(itm.get("lease", 0) < now for itm in state["pending"]) or \
+            now - state["finalize_requested"] <= ark_finalize_delay + ark_finalize_grace:
+        return False
+    state["finalize_requested"] = now
+    return True
+
+
+def takeArk():
+    """
+    Take a pre-minted ARK record from the pool. Returns None if the pool is empty.
+    Requests a refill when the pool runs low and a finalize run when the last request was lost.
+    """
+    refill = False
+    with arkPool() as state:
+        record = state["available"].pop(0) if state["available"] else None
+        if len(state["available"]) < ark_pool_low and \
+                time.time() - state["refill_requested"] > ark_refill_timeout:
+            state["refill_requested"] = time.time()
+            refill = True
+        finalize = finalizeDue(state, time.time())
+    if refill:
+        refillArkPool.apply_async(**queueOptions(refillArkPool))
+    if finalize:
+        finalizeArks.apply_async(countdown=ark_finalize_delay, **queueOptions(finalizeArks))
+    return record
+
+
+def queueArkUpdate(url, data):
+    """
+    Queue the ARK record update (PUT to url). finalizeArks sends pending updates in a batch.
+    """
+    with arkPool() as state:
+        state["pending"].append({"id": uuid.uuid4().hex, "url": url, "data": data,
+                                 "attempts": 0, "lease": 0})
+        finalize = finalizeDue(state, time.time())
+    if finalize:
+        finalizeArks.apply_async(countdown=ark_finalize_delay, **queueOptions(finalizeArks))
+
+
+def settleArkUpdate(itm, error=None):
+    """
+    Remove a sent update from the pool file, or record the failed attempt
+    (moved to failed after ARK_FINALIZE_ATTEMPTS).
+    """
+    with arkPool() as state:
+        pending = [entry for entry in state["pending"] if entry.get("id") != itm["id"]]
+        if error is not None:
+            itm = dict(itm, attempts=itm["attempts"] + 1, error=error[:500], lease=0)
+            if itm["attempts"] >= ark_finalize_attempts:
+                state["failed"].append(itm)
+            else:
+                pending.append(itm)
+        state["pending"] = pending
+
+
+@app.task()
+def finalizeArks():
+    """
+    Send every pending ARK update. Updates stay in the pool file, leased to this
+    run, until their PUT succeeded, so a crash loses none. Failed updates are
+    retried on the next run up to ARK_FINALIZE_ATTEMPTS times.
+    """
+    now = time.time()
+    with arkPool() as state:
+        batch = []
+        for itm in state["pending"]:
+            itm.setdefault("id", uuid.uuid4().hex)
+            if itm.get("lease", 0) < now:
+                itm["lease"] = now + ark_finalize_grace
+                batch.append(dict(itm))
+    done, retry, failed = 0, 0, 0
+    for itm in batch:
+        try:
+            req = getSession('ark').put(itm["url"], data=json.dumps(itm["data"]),
+                                        headers=arkHeaders())
+            error = None if req.status_code < 400 else req.text
+        except Exception as inst:
+            error = str(inst)
+        settleArkUpdate(itm, error)
+        if error is None:
+            done = done + 1
+        elif itm["attempts"] + 1 >= ark_finalize_attempts:
+            failed = failed + 1
+        else:
+            retry = retry + 1
+    with arkPool() as state:
+        # updates queued during this run or to retry
+        state["finalize_requested"] = 0
+        finalize = finalizeDue(state, time.time())
+        if not finalize and state["pending"]:
+            # leased to another run: checked again once its lease expired
+            state["finalize_requested"] = time.time()
+    if finalize:
+        finalizeArks.apply_async(countdown=ark_finalize_delay, **queueOptions(finalizeArks))
+    return {"updated": done, "retry": retry, "failed": failed}
+
+
+@app.task()
+def arkPoolStatus():
+    with arkPool() as state:
+        return {"available": len(state["available"]), "pending": len(state["pending"]),
+                "failed": len(state["failed"]), "refill_requested": state["refill_requested"],
+                "finalize_requested": state["finalize_requested"]}
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+
+# Values smaller than this stay inline in the chain message
+artifact_min_bytes = int(os.getenv('ARTIFACT_MIN_BYTES', 4096))
+
+
+def isArtifact(value):
+    return isinstance(value, dict) and '$artifact' in value
+
+
+def saveArtifact(root, value, url=None):
+    """
+    Write value as JSON to <root>/artifacts/<sha256>.json once (content addressed).
+    Returns:
+        reference dict: {"$artifact": "sha256:<hex>", "path", "bytes", "url"}
+    """
+    body = json.dumps(value, sort_keys=True).encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()
+    folder = os.path.join(root, 'artifacts')
+    path = os.path.join(folder, "{0}.json".format(digest))
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, path)
+    ref = {"$artifact": "sha256:{0}".format(digest), "path": path, "bytes": len(body)}
+    if url:
+        ref["url"] = "{0}/artifacts/{1}.json".format(url.rstrip('/'), digest)
+    return ref
+
+
+def loadArtifact(ref):
+    with open(ref["path"], 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def offloadArtifacts(data, keys, root, url=None, min_bytes=artifact_min_bytes):
+    """
+    Replace large values in data with artifact references (in place).
+    keys (list): dot notation keys e.g. ['manifest', 'xml.fgdc']
+    """
+    for key in keys:
+        parts = key.split('.')
+        parent = data
+        for part in parts[:-1]:
+            parent = parent.get(part) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict) or parts[-1] not in parent:
+            continue
+        value = parent[parts[-1]]
+        if isArtifact(value) or len(json.dumps(value)) < min_bytes:
+            continue
+        parent[parts[-1]] = saveArtifact(root, value, url=url)
+    return data
+
+
+class LazyArtifacts(dict):
+    """
+    Task data dict that loads artifact references on first access.
+    dehydrate() returns a plain dict with loaded values swapped back to
+    their references so the next chain message stays small.
+    """
+
+    def __init__(self, data):
+        super(LazyArtifacts, self).__init__(data)
+        self._refs = {}
+
+    def __getitem__(self, key):
+        value = super(LazyArtifacts, self).__getitem__(key)
+        if isArtifact(value):
+            self._refs[key] = value
+            value = loadArtifact(value)
+            super(LazyArtifacts, self).__setitem__(key, value)
+        if isinstance(value, dict) and not isinstance(value, LazyArtifacts):
+            value = LazyArtifacts(value)
+            super(LazyArtifacts, self).__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        self._refs.pop(key, None)
+        super(LazyArtifacts, self).__setitem__(key, value)
+
+    def dehydrate(self):
+        result = {}
+        for key, value in dict.items(self):
+            if key in self._refs:
+                result[key] = self._refs[key]
+            elif isinstance(value, LazyArtifacts):
+                result[key] = value.dehydrate()
+            else:
+                result[key] = value
+        return result
+
+
+def lazyArtifacts(data):
+    if isinstance(data, LazyArtifacts):
+        return data
+    return LazyArtifacts(data)
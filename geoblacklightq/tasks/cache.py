@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from threading import RLock
+import time
+
+_missing = object()
+
+
+class TTLCache(object):
+    """
+    Thread safe in-process cache with time to live and LRU eviction.
+    Keys are tuples; the first element is the kind of item cached
+    (e.g. ('store', 'geocolorado', 'roads')) so a kind or a single key can
+    be invalidated. Keeps hit and miss counts per kind.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _missing)
+            if item is not _missing and item[0] > time.time():
+                self._data.move_to_end(key)
+                self.hits[key[0]] = self.hits.get(key[0], 0) + 1
+                return item[1]
+            if item is not _missing:
+                del self._data[key]
+            self.misses[key[0]] = self.misses.get(key[0], 0) + 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def cached(self, key, func, *args, **kwargs):
+        """
+        Return cached value for key or call func(*args, **kwargs) and cache it.
+        None results are not cached.
+        """
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = func(*args, **kwargs)
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, *prefix):
+        """
+        Remove every key starting with prefix. No prefix clears the cache.
+        """
+        with self._lock:
+            for key in [k for k in self._data if k[:len(prefix)] == prefix]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            kinds = set(self.hits) | set(self.misses)
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": sum(self.hits.values()), "misses": sum(self.misses.values()),
+                    "kinds": dict((kind, {"hits": self.hits.get(kind, 0),
+                                          "misses": self.misses.get(kind, 0)}) for kind in kinds)}
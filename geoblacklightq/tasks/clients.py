@@ -0,0 +1,151 @@
+from celery.signals import worker_process_init
+from geoserver.catalog import Catalog
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .limiter import getLimiter
+import requests
+import os
+import time
+
+geoserver_connection = os.getenv(
+    'GEOSERVER_CONNECTION', "https://geo.colorado.edu/geoserver")
+geoserver_username = os.getenv('GEOSVR_USER', "admin")
+geoserver_password = os.getenv('GEOSRV_PASS')
+
+# Connection pool defaults. Override per upstream with <UPSTREAM>_POOL_MAXSIZE,
+# <UPSTREAM>_CONNECT_TIMEOUT and <UPSTREAM>_READ_TIMEOUT (e.g. SOLR_READ_TIMEOUT).
+upstreams = ['geoserver', 'solr', 'ark', 'catalog', 'static']
+pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', 300))
+# Request bodies that are data files rather than catalog documents
+upload_content_types = ['application/zip', 'application/octet-stream', 'image/']
+
+_sessions = {}
+_catalog = None
+_limiter = []
+
+
+class PooledSession(requests.Session):
+    """
+    requests Session with keep-alive connection pool and default timeout.
+    Every request is recorded in the upstream latency metrics.
+    limiter (AdaptiveLimiter): requests wait for a shared slot (GeoServer)
+    """
+
+    def __init__(self, maxsize=pool_maxsize, timeout=(connect_timeout, read_timeout), upstream='other',
+                 limiter=None):
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+        self.upstream = upstream
+        self.limiter = limiter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if self.limiter is None or method.upper() not in self.limiter.methods:
+            return self._request(method, url, **kwargs)
+        with self.limiter.slot() as outcome:
+            metrics.registry.observe("geoblacklightq_geoserver_slot_wait_seconds", outcome["wait"],
+                                     stage=metrics.currentStage())
+            outcome["upload"] = isUpload(kwargs)
+            response = self._request(method, url, **kwargs)
+            outcome["error"] = response.status_code >= 500
+            return response
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.time()
+        status = 'error'
+        request_bytes = response_bytes = 0
+        try:
+            response = super(PooledSession, self).request(method, url, **kwargs)
+            status = response.status_code
+            request_bytes = metrics.bodySize(response.request.body)
+            if kwargs.get('stream'):
+                response_bytes = int(response.headers.get('Content-Length') or 0)
+            else:
+                response_bytes = len(response.content)
+            return response
+        finally:
+            metrics.recordHttp(self.upstream, method.upper(), status, time.time() - start,
+                               request_bytes, response_bytes)
+
+
+def isUpload(kwargs):
+    """
+    True when a request sends a data file (open file, zip or image body).
+    """
+    data = kwargs.get('data')
+    if data is None:
+        return False
+    if hasattr(data, 'read'):
+        return True
+    headers = dict((key.lower(), value) for key, value in (kwargs.get('headers') or {}).items())
+    content_type = headers.get('content-type', '').lower()
+    return any(content_type.startswith(itm) for itm in upload_content_types)
+
+
+def upstreamSetting(upstream, name, default):
+    return os.getenv('{0}_{1}'.format(upstream.upper(), name), default)
+
+
+def getSession(upstream):
+    """
+    Return the per worker process Session for an upstream service.
+    upstream (string): geoserver, solr, ark, catalog or static
+    GeoServer sessions are authenticated with the GeoServer credentials.
+    """
+    if upstream not in _sessions:
+        maxsize = int(upstreamSetting(upstream, 'POOL_MAXSIZE', pool_maxsize))
+        timeout = (float(upstreamSetting(upstream, 'CONNECT_TIMEOUT', connect_timeout)),
+                   float(upstreamSetting(upstream, 'READ_TIMEOUT', read_timeout)))
+        session = PooledSession(maxsize=maxsize, timeout=timeout, upstream=upstream)
+        if upstream == 'geoserver':
+            session.auth = (geoserver_username, geoserver_password)
+            session.limiter = geoserverLimiter()
+        _sessions[upstream] = session
+    return _sessions[upstream]
+
+
+def geoserverLimiter():
+    """
+    Per worker process adaptive limiter of GeoServer requests (see limiter).
+    """
+    if not _limiter:
+        _limiter.append(getLimiter())
+    return _limiter[0]
+
+
+def getCatalog():
+    """
+    Return the per worker process authenticated GeoServer Catalog.
+    gsconfig requests go through the GeoServer session (pool, timeouts,
+    metrics and the shared request limiter).
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog("{0}/rest/".format(geoserver_connection),
+                           geoserver_username, geoserver_password)
+        if isinstance(getattr(_catalog, '_session', None), requests.Session):
+            _catalog._session = getSession('geoserver')
+        else:
+            session = getattr(_catalog, 'session', None)
+            if isinstance(session, requests.Session):
+                session.hooks['response'].append(metrics.responseHook('geoserver'))
+    return _catalog
+
+
+@worker_process_init.connect
+def resetClients(**kwargs):
+    """
+    Sockets must not be shared between prefork worker processes.
+    Drop anything inherited from the parent process.
+    """
+    global _catalog
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+    _catalog = None
+    del _limiter[:]
@@ -0,0 +1,139 @@
+import re
+
+# Metadata (FGDC, ESRI-ISO, ISO-19139, MODS) to GeoBlacklight rule table.
+# Each field lists dot notation paths in order of preference. The first path
+# found in the document wins; the remaining paths are never evaluated.
+# A path may be paired with a function applied to the value it returns.
+
+
+def stripTags(value):
+    if isinstance(value, str):
+        return re.sub('<[^<]+>', "", value)
+    return value
+
+
+crosswalk_rules = {
+    "title": ["mods:mods.mods:titleInfo.mods:title",
+              "metadata.idinfo.citation.citeinfo.title",
+              "metadata.dataIdInfo.idCitation.resTitle",
+              "gmi:MI_Metadata.gmd:parentIdentifier.gco:CharacterString"],
+    "description": ["mods:mods.mods:abstract",
+                    "metadata.idinfo.descript.abstract",
+                    ("metadata.dataIdInfo.idAbs", stripTags),
+                    ("gmi:MI_Metadata.gmd:identificationInfo.gmd:MD_DataIdentification.gmd:abstract.gco:CharacterString", stripTags)],
+    "issued": ["mods:mods.mods:originInfo.mods:dateIssued",
+               "metadata.idinfo.citation.citeinfo.pubdate",
+               "metadata.mdDateSt"],
+    "created": ["mods:mods.mods:originInfo.mods:dateCreated",
+                "metadata.idinfo.citation.citeinfo.pubdate",
+                "metadata.mdDateSt"],
+    "subject": ["metadata.idinfo.keywords.theme",
+                "metadata.dataIdInfo.searchKeys"],
+    "creator": ["metadata.idinfo.citation.citeinfo.origin",
+                "metadata.idinfo.citation.citeinfo.pubinfo.publish",
+                "metadata.dataIdInfo.idCitation.citResParty.rpOrgName"],
+    "publisher": ["metadata.idinfo.citation.citeinfo.pubinfo.publish",
+                  "metadata.idinfo.citation.citeinfo.origin",
+                  "metadata.dataIdInfo.idCitation.citResParty.rpOrgName"],
+    "place": ["metadata.idinfo.keywords.place.placekey"],
+}
+# MODS elements searched anywhere in the document
+mods_keys = ['mods:topic', 'mods:name', 'mods:publisher', 'mods:geographic']
+
+_missing = object()
+
+
+def compileRules(rules):
+    """
+    Compile rule table paths into key tuples: {field: [(keys, function)]}
+    """
+    compiled = {}
+    for field, paths in rules.items():
+        compiled[field] = []
+        for path in paths:
+            func = None
+            if isinstance(path, tuple):
+                path, func = path
+            compiled[field].append((tuple(path.split('.')), func))
+    return compiled
+
+
+compiled_rules = compileRules(crosswalk_rules)
+
+
+def ruleSubtrees(rules=compiled_rules):
+    """
+    Children of each document root used by the rule table:
+    {root: set(child names)}. MODS documents are searched anywhere
+    and map to None (keep everything).
+    """
+    subtrees = {'mods:mods': None}
+    for paths in rules.values():
+        for keys, func in paths:
+            if keys[0] in subtrees and subtrees[keys[0]] is None:
+                continue
+            subtrees.setdefault(keys[0], set()).add(keys[1])
+    return subtrees
+
+
+def resolve(doc, keys):
+    """
+    Follow keys through nested dicts. Returns _missing if any key is absent.
+    A present key holding None returns None, the same as deep_get.
+    """
+    for key in keys:
+        if not isinstance(doc, dict) or key not in doc:
+            return _missing
+        doc = doc[key]
+    return doc
+
+
+def collectKeys(document, keys):
+    """
+    Single traversal equivalent of calling nested_lookup once per key.
+    Returns {key: [values in document order]}
+    """
+    found = dict((key, []) for key in keys)
+
+    def _walk(doc):
+        if isinstance(doc, list):
+            for itm in doc:
+                _walk(itm)
+        elif isinstance(doc, dict):
+            for key, value in doc.items():
+                if key in found:
+                    found[key].append(value)
+                if isinstance(value, (dict, list)):
+                    _walk(value)
+    _walk(document)
+    return found
+
+
+class MetadataDocument(object):
+    """
+    Parsed metadata document with compiled rule lookups.
+    MODS element lookups share one lazily built traversal.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc or {}
+        self.is_mods = 'mods:mods' in self.doc
+        self._mods = None
+
+    def first(self, field, default=None):
+        for keys, func in compiled_rules[field]:
+            value = resolve(self.doc, keys)
+            if value is not _missing:
+                return func(value) if func else value
+        return default
+
+    def mods(self, key):
+        if self._mods is None:
+            self._mods = collectKeys(self.doc, mods_keys)
+        return self._mods[key]
+
+
+def metadataDocument(dataJsonObj):
+    if isinstance(dataJsonObj, MetadataDocument):
+        return dataJsonObj
+    return MetadataDocument(dataJsonObj)
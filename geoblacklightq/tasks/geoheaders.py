@@ -0,0 +1,271 @@
+import mmap
+import os
+import re
+import struct
+
+# Shapefile shape types mapped to the geometry binding GeoServer reports
+shape_types = {0: None, 1: "Point", 3: "MultiLineString", 5: "MultiPolygon", 8: "MultiPoint",
+               11: "Point", 13: "MultiLineString", 15: "MultiPolygon", 18: "MultiPoint",
+               21: "Point", 23: "MultiLineString", 25: "MultiPolygon", 28: "MultiPoint",
+               31: "MultiPatch"}
+# Geographic CRS codes treated as longitude/latitude bounds
+geographic_epsg = [4326, 4269, 4267, 4258, 4283, 4617]
+
+# TIFF field types: struct format and byte size
+tiff_types = {1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1),
+              7: ('B', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8),
+              13: ('I', 4), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+# ModelPixelScale, ModelTiepoint, ModelTransformation and GeoKeyDirectory georeference a TIFF
+geotiff_tags = [33550, 33922, 34264, 34735]
+# Offset/byte count arrays can hold millions of entries. Only their length is kept.
+tiff_count_only = [273, 279, 324, 325]
+# TIFF compression codes
+tiff_compression = {1: 'none', 2: 'ccitt', 5: 'lzw', 6: 'ojpeg', 7: 'jpeg', 8: 'deflate',
+                    32773: 'packbits', 32946: 'deflate', 34887: 'lerc', 34925: 'lzma',
+                    50000: 'zstd', 50001: 'webp'}
+
+
+def readShapefileHeader(filename):
+    """
+    Read the 100 byte shapefile main file header.
+    Returns:
+        dict: shape_type (int), geometry (string), bbox [xmin, ymin, xmax, ymax], length (bytes)
+    """
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 100, access=mmap.ACCESS_READ) as mm:
+            code, = struct.unpack('>i', mm[0:4])
+            if code != 9994:
+                raise ValueError("Not a shapefile: {0}".format(filename))
+            length, = struct.unpack('>i', mm[24:28])
+            version, shape_type = struct.unpack('<ii', mm[28:36])
+            bbox = list(struct.unpack('<4d', mm[36:68]))
+    return {"shape_type": shape_type, "geometry": shape_types.get(shape_type),
+            "bbox": bbox, "length": length * 2}
+
+
+def findSidecar(filename, extension):
+    """
+    Case insensitive lookup of a file with the same name and another extension.
+    """
+    folder = os.path.dirname(filename) or '.'
+    stem = os.path.splitext(os.path.basename(filename))[0].lower()
+    for name in os.listdir(folder):
+        if name.lower() == stem + extension:
+            return os.path.join(folder, name)
+    return None
+
+
+def readPrj(filename):
+    """
+    Detect coordinate reference system from a WKT .prj file.
+    Returns:
+        dict: name, geographic (boolean), epsg (int or None)
+    """
+    with open(filename, errors='replace') as f:
+        wkt = f.read().strip()
+    name = re.match(r'^\s*\w+\[\s*"([^"]*)"', wkt)
+    # The outer most AUTHORITY is the last one in WKT1
+    epsg = re.findall(r'AUTHORITY\[\s*"EPSG"\s*,\s*"?(\d+)"?\s*\]', wkt, re.IGNORECASE)
+    epsg = int(epsg[-1]) if epsg else None
+    geographic = wkt.upper().startswith(('GEOGCS', 'GEOGCRS'))
+    return {"name": name.group(1) if name else None, "geographic": geographic, "epsg": epsg}
+
+
+def readTiffIFDs(filename, max_ifds=None):
+    """
+    Read TIFF/BigTIFF image file directories without reading image data.
+    Returns:
+        list of dicts {tag: value}. Values are tuples, strings for ASCII tags,
+        and the entry count for strip/tile offset and byte count tags.
+    """
+    ifds = []
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            order = {b'II': '<', b'MM': '>'}.get(mm[0:2])
+            if not order:
+                raise ValueError("Not a TIFF file: {0}".format(filename))
+            magic, = struct.unpack(order + 'H', mm[2:4])
+            if magic == 42:
+                offset, = struct.unpack(order + 'I', mm[4:8])
+                count_fmt, entry_fmt, entry_size, inline, next_fmt = 'H', 'HHI', 12, 4, 'I'
+            elif magic == 43:
+                offset, = struct.unpack(order + 'Q', mm[8:16])
+                count_fmt, entry_fmt, entry_size, inline, next_fmt = 'Q', 'HHQ', 20, 8, 'Q'
+            else:
+                raise ValueError("Not a TIFF file: {0}".format(filename))
+            seen = set()
+            while offset and offset not in seen and (max_ifds is None or len(ifds) < max_ifds):
+                seen.add(offset)
+                count, = struct.unpack_from(order + count_fmt, mm, offset)
+                pos = offset + struct.calcsize(order + count_fmt)
+                tags = {}
+                for idx in range(count):
+                    entry = pos + idx * entry_size
+                    tag, ftype, n = struct.unpack_from(order + entry_fmt, mm, entry)
+                    if ftype not in tiff_types:
+                        continue
+                    if tag in tiff_count_only:
+                        tags[tag] = n
+                        continue
+                    fmt, size = tiff_types[ftype]
+                    value_pos = entry + struct.calcsize(order + entry_fmt)
+                    if size * n > inline:
+                        value_pos, = struct.unpack_from(
+                            order + next_fmt, mm, value_pos)
+                    if ftype == 2:
+                        tags[tag] = mm[value_pos:value_pos + n].split(b'\0')[0].decode(
+                            'latin-1')
+                    else:
+                        tags[tag] = struct.unpack_from(
+                            order + fmt * n, mm, value_pos)
+                ifds.append(tags)
+                offset, = struct.unpack_from(
+                    order + next_fmt, mm, pos + count * entry_size)
+    return ifds
+
+
+def firstIfdTags(f):
+    """
+    Tag numbers of the first IFD of an open (seekable) TIFF/BigTIFF file,
+    e.g. a zip member, without reading image data.
+    """
+    header = f.read(16)
+    order = {b'II': '<', b'MM': '>'}.get(header[0:2])
+    if not order or len(header) < 8:
+        raise ValueError("Not a TIFF file")
+    magic, = struct.unpack(order + 'H', header[2:4])
+    if magic == 42:
+        offset, = struct.unpack(order + 'I', header[4:8])
+        count_fmt, entry_size = 'H', 12
+    elif magic == 43 and len(header) == 16:
+        offset, = struct.unpack(order + 'Q', header[8:16])
+        count_fmt, entry_size = 'Q', 20
+    else:
+        raise ValueError("Not a TIFF file")
+    f.seek(offset)
+    count, = struct.unpack(order + count_fmt, f.read(struct.calcsize(count_fmt)))
+    entries = f.read(count * entry_size)
+    return [struct.unpack_from(order + 'H', entries, idx * entry_size)[0]
+            for idx in range(len(entries) // entry_size)]
+
+
+def isGeoTiff(f):
+    """
+    True when the first IFD of an open TIFF file carries GeoTIFF tags.
+    """
+    try:
+        return any(tag in geotiff_tags for tag in firstIfdTags(f))
+    except (ValueError, struct.error):
+        return False
+
+
+def readTiffProfile(filename):
+    """
+    Storage layout of a TIFF from its IFDs: dimensions, tiling, compression,
+    band layout and internal/external (.ovr) overviews.
+    """
+    ifds = readTiffIFDs(filename)
+    # NewSubfileType bit 0 marks reduced resolution images (overviews)
+    images = [ifd for ifd in ifds if not ifd.get(254, (0,))[0] & 1]
+    main = images[0] if images else ifds[0]
+    overviews = len([ifd for ifd in ifds if ifd.get(254, (0,))[0] & 1])
+    external = findSidecar(filename, os.path.splitext(filename)[1].lower() + '.ovr')
+    if external:
+        overviews = overviews + len(readTiffIFDs(external))
+    bits = main.get(258, (1,))
+    profile = {"width": main[256][0], "height": main[257][0], "bands": main.get(277, (1,))[0],
+               "bits": bits[0], "planar": 'separate' if main.get(284, (1,))[0] == 2 else 'chunky',
+               "compression": tiff_compression.get(main.get(259, (1,))[0], 'other'),
+               "tiled": 322 in main, "tile": None, "rows_per_strip": None,
+               "overviews": overviews, "external_overviews": bool(external),
+               "size": os.path.getsize(filename), "images": len(images)}
+    if profile["tiled"]:
+        profile["tile"] = [main[322][0], main.get(323, main[322])[0]]
+    else:
+        profile["rows_per_strip"] = main.get(278, (profile["height"],))[0]
+    return profile
+
+
+def readGeoKeys(ifd):
+    """
+    Decode the GeoKeyDirectory (tag 34735) of a TIFF IFD into {key: value}.
+    """
+    directory = ifd.get(34735)
+    if not directory:
+        return {}
+    doubles = ifd.get(34736, ())
+    ascii_params = ifd.get(34737, '')
+    keys = {}
+    for idx in range(directory[3]):
+        key, location, count, value = directory[4 + idx * 4:8 + idx * 4]
+        if location == 0:
+            keys[key] = value
+        elif location == 34736:
+            keys[key] = doubles[value:value + count]
+        elif location == 34737:
+            keys[key] = ascii_params[value:value + count].rstrip('|')
+    return keys
+
+
+def readGeoTiffHeader(filename):
+    """
+    Bounds and CRS of a GeoTIFF from its first IFD.
+    Returns:
+        dict: width, height, bbox [xmin, ymin, xmax, ymax] (None if not georeferenced),
+            geographic (boolean), epsg (int or None)
+    """
+    ifd = readTiffIFDs(filename, max_ifds=1)[0]
+    width, height = ifd[256][0], ifd[257][0]
+    keys = readGeoKeys(ifd)
+    corners = None
+    if 34264 in ifd:
+        t = ifd[34264]
+        corners = [(t[0] * i + t[1] * j + t[3], t[4] * i + t[5] * j + t[7])
+                   for i, j in [(0, 0), (width, 0), (0, height), (width, height)]]
+    elif 33922 in ifd and 33550 in ifd:
+        i, j, k, x, y, z = ifd[33922][:6]
+        sx, sy = ifd[33550][:2]
+        x0, y0 = x - i * sx, y + j * sy
+        corners = [(x0, y0), (x0 + width * sx, y0 - height * sy)]
+    bbox = None
+    if corners:
+        xs, ys = [c[0] for c in corners], [c[1] for c in corners]
+        bbox = [min(xs), min(ys), max(xs), max(ys)]
+    epsg = keys.get(3072) or keys.get(2048)
+    if epsg == 32767:
+        epsg = None
+    return {"width": width, "height": height, "bbox": bbox, "epsg": epsg,
+            "geographic": keys.get(1024) == 2 or epsg in geographic_epsg}
+
+
+def solrEnvelope(bbox):
+    return 'ENVELOPE({0},{1},{2},{3})'.format(bbox[0], bbox[2], bbox[3], bbox[1])
+
+
+def datasetHeader(filename, format="shapefile"):
+    """
+    Local bounds, CRS and geometry type of a shapefile or raster read from file headers only.
+    Returns:
+        dict: geometry, native_bbox, crs, bounds (Solr ENVELOPE when the
+            CRS is geographic, otherwise None)
+    """
+    result = {"geometry": None, "native_bbox": None, "crs": None, "bounds": None}
+    if format == "shapefile":
+        header = readShapefileHeader(filename)
+        result["geometry"] = header["geometry"]
+        result["native_bbox"] = header["bbox"]
+        prj = findSidecar(filename, '.prj')
+        if prj:
+            result["crs"] = readPrj(prj)
+    else:
+        result["geometry"] = "Raster"
+        if os.path.splitext(filename)[1].lower() in ['.tif', '.tiff']:
+            header = readGeoTiffHeader(filename)
+            result["native_bbox"] = header["bbox"]
+            result["crs"] = {"name": None, "geographic": header["geographic"],
+                             "epsg": header["epsg"]}
+    crs, bbox = result["crs"], result["native_bbox"]
+    if crs and bbox and (crs["geographic"] or crs["epsg"] in geographic_epsg):
+        if -180 <= bbox[0] <= bbox[2] <= 180 and -90 <= bbox[1] <= bbox[3] <= 90:
+            result["bounds"] = solrEnvelope(bbox)
+    return result
@@ -5,19 +5,79 @@ from geoserver.catalog import Catalog, ConflictingDataError, FailedRequestError
 from geoserver.util import shapefile_and_friends
 from requests.auth import HTTPBasicAuth
 import requests
+from .clients import getSession, getCatalog, geoserverLimiter
+from .clients import geoserver_connection, geoserver_username, geoserver_password
+from .cache import TTLCache
+from .metrics import inContext, timed, timedCall
+from .ingestindex import forgetIngest
+from .rasteropt import rasterPreflight, optimizeRaster
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
 import os
 import json
-import xmltodict
+import time
 
 app = Celery()
 app.config_from_object(celeryconfig)
 
 workspace = os.getenv('WRKSPACE', "geocolorado")
-geoserver_connection = os.getenv(
-    'GEOSERVER_CONNECTION', "https://geo.colorado.edu/geoserver")
 #geoserver_connection = "https://geo.colorado.edu/geoserver"
-geoserver_username = os.getenv('GEOSVR_USER', "admin")
-geoserver_password = os.getenv('GEOSRV_PASS')
+feature_geometries = ["Polygon", "Line", "Point",
+                      "MultiPolygon", "MultiLineString", "MultiPoint"]
+# Per worker process cache of GeoServer catalog lookups
+catalog_cache = TTLCache(maxsize=int(os.getenv('GEOSERVER_CACHE_SIZE', 1024)),
+                         ttl=int(os.getenv('GEOSERVER_CACHE_TTL', 300)))
+# Bulk style assignment: concurrent layer updates
+style_workers = int(os.getenv('STYLE_WORKERS', 8))
+# Parsed GetCapabilities with their ETag/Last-Modified for conditional requests.
+# Within GEOSERVER_CAPABILITIES_MAX_AGE seconds the result is reused without a request.
+capabilities_cache = TTLCache(maxsize=64, ttl=86400)
+capabilities_max_age = int(os.getenv('GEOSERVER_CAPABILITIES_MAX_AGE', 30))
+# GetCapabilities per service: version, layer element, name and crs elements
+capabilities_services = {
+    "WFS": {"version": "2.0.0", "item": "FeatureType", "name": "Name", "crs": ["DefaultCRS", "SRS"],
+            "type": "feature"},
+    "WCS": {"version": "1.1.1", "item": "CoverageSummary", "name": "Identifier", "crs": ["SupportedCRS"],
+            "type": "coverage"},
+}
+
+
+def getWorkspace(cat, name=workspace):
+    return catalog_cache.cached(('workspace', name), timedCall, 'get_workspace',
+                                cat.get_workspace, name)
+
+
+def getStore(cat, name, ws):
+    return catalog_cache.cached(('store', ws.name, name), timedCall, 'get_store',
+                                cat.get_store, name, workspace=ws)
+
+
+def storeExists(name, ws_name=workspace):
+    """
+    Uncached check that a store of ws_name still exists.
+    """
+    cat = getCatalog()
+    try:
+        return timedCall('get_store', cat.get_store, name, workspace=getWorkspace(cat, ws_name)) \
+            is not None
+    except FailedRequestError:
+        return False
+
+
+def getResource(cat, name, ws):
+    return catalog_cache.cached(('resource', ws.name, name), timedCall, 'get_resource',
+                                cat.get_resource, name, workspace=ws)
+
+
+def invalidateLayer(name, ws_name=workspace):
+    """
+    Drop every cached lookup of a store/layer after our tasks changed it.
+    """
+    for kind in ['store', 'resource']:
+        catalog_cache.invalidate(kind, ws_name, name)
+    for kind in ['bbox', 'geometry', 'style']:
+        catalog_cache.invalidate(kind, name)
+    capabilities_cache.invalidate('capabilities', ws_name)
 
 
 def getBoundingBox(owsBBox):
@@ -27,12 +87,16 @@ def getBoundingBox(owsBBox):
     return solr_geom.format(lc[0], uc[0], uc[1], lc[1])
 
 
-def determineFeatureGeometry(layername):
-    url = "{0}/rest/workspaces/geocolorado/featuretypes/{1}.json".format(
-        geoserver_connection, layername)
+def determineFeatureGeometry(layername, ws_name=workspace):
+    return catalog_cache.cached(('geometry', layername, ws_name), _determineFeatureGeometry,
+                                layername, ws_name)
+
+
+def _determineFeatureGeometry(layername, ws_name=workspace):
+    url = "{0}/rest/workspaces/{1}/featuretypes/{2}.json".format(
+        geoserver_connection, ws_name, layername)
     headers = {"Content-Type": "application/json"}
-    req = requests.get(url, headers=headers, auth=(
-        geoserver_username, geoserver_password))
+    req = getSession('geoserver').get(url, headers=headers)
     data = req.json()
     geom = ''
     try:
@@ -42,57 +106,138 @@ def determineFeatureGeometry(layername):
                 break
     except:
         pass
-    if geom in ["Polygon", "Line", "Point", "MultiPolygon", "MultiLineString", "MultiPoint"]:
+    if geom in feature_geometries:
         return geom
     else:
         return "UNDETERMINED"
 
 
+def localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def capabilityItem(elem, service):
+    """
+    name, title, crs and boundbox of a FeatureType or CoverageSummary element.
+    """
+    values = {}
+    boundbox = None
+    for child in elem:
+        tag = localName(child.tag)
+        if tag == 'WGS84BoundingBox':
+            corners = dict((localName(itm.tag), itm.text) for itm in child)
+            boundbox = getBoundingBox({"ows:LowerCorner": corners['LowerCorner'],
+                                       "ows:UpperCorner": corners['UpperCorner']})
+        elif child.text and tag not in values:
+            values[tag] = child.text.strip()
+    crs = [values[tag] for tag in service["crs"] if tag in values]
+    return {"name": values.get(service["name"]), "title": values.get('Title'),
+            "crs": crs[0] if crs else None, "boundbox": boundbox, "type": service["type"]}
+
+
+def parseCapabilities(stream, service):
+    """
+    Incremental parse of a GetCapabilities document. Layer elements are
+    dropped once read so memory does not grow with the number of layers.
+    """
+    results = []
+    for event, elem in ElementTree.iterparse(stream, events=('end',)):
+        if localName(elem.tag) == service["item"]:
+            results.append(capabilityItem(elem, service))
+            elem.clear()
+    return results
+
+
+def workspaceCapabilities(workspace, name):
+    """
+    Layers of one OGC service (WFS or WCS) of workspace. Conditional request
+    with the ETag/Last-Modified of the cached result; 304 reuses it.
+    """
+    service = capabilities_services[name]
+    key = ('capabilities', workspace, name)
+    cached = capabilities_cache.get(key)
+    if cached and time.time() - cached["checked"] < capabilities_max_age:
+        return cached["results"]
+    headers = {}
+    if cached and cached["etag"]:
+        headers['If-None-Match'] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers['If-Modified-Since'] = cached["last_modified"]
+    url = "{0}/{1}/ows".format(geoserver_connection, workspace)
+    params = {"SERVICE": name, "VERSION": service["version"], "REQUEST": "GetCapabilities"}
+    r = getSession('geoserver').get(url, params=params, headers=headers, stream=True)
+    try:
+        if r.status_code == 304 and cached:
+            entry = dict(cached)
+        else:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            entry = {"etag": None, "last_modified": None,
+                     "results": parseCapabilities(r.raw, service)}
+        entry["etag"] = r.headers.get('ETag') or entry["etag"]
+        entry["last_modified"] = r.headers.get('Last-Modified') or entry["last_modified"]
+        entry["checked"] = time.time()
+        capabilities_cache.set(key, entry)
+    finally:
+        r.close()
+    return entry["results"]
+
+
 @app.task()
-def geoserverGetWorkspaceMetadata(workspace=workspace):
+def geoserverGetWorkspaceMetadata(workspace=workspace, coverages=True):
     """
     Task returns a list of all layers within workspace
     args:
         None
     Kwargs:
         workspace(string): default 'geocolorado'
+        coverages(boolean): include WCS coverages (type 'coverage')
     Return:
         List of objects:
-            name,title,crs,boundbox
-    """
-    url = "{0}/{1}/ows?SERVICE=WFS&REQUEST=GetCapabilities".format(
-        geoserver_connection, workspace)
-    r = requests.get(url)
-    doc = xmltodict.parse(r.text)
-    ftdata = json.loads(json.dumps(
-        doc['wfs:WFS_Capabilities']['FeatureTypeList']["FeatureType"]))
-    results = []
-    for itm in ftdata:
-        data = {"name": itm['Name']}
-        data["title"] = itm['Title']
-        data['crs'] = itm['DefaultCRS']
-        data['boundbox'] = getBoundingBox(itm['ows:WGS84BoundingBox'])
-        results.append(data)
+            name,title,crs,boundbox,type
+    """
+    results = workspaceCapabilities(workspace, "WFS")
+    if coverages:
+        results = results + workspaceCapabilities(workspace, "WCS")
     return results
 
 
+def layerStoreName(folder, layername=None):
+    """
+    GeoServer store name of a dataset folder. Layers of a multi-layer
+    dataset are published as <folder>_<layername>.
+    """
+    name = folder.rstrip('/').split('/')[-1]
+    if layername:
+        name = "{0}_{1}".format(name, layername)
+    return name.lower().replace(' ', '_').replace('(', '').replace(')', '')
+
+
 @app.task()
 def dataLoadGeoserver(data):
-    geoserverStoreName = data["folder"].split(
-        '/')[-1].lower().replace(' ', '_').replace('(', '').replace(')', '')
+    """
+    Publish the dataset file to GeoServer. Layers of a multi-layer dataset
+    arrive with their geoserverStoreName set.
+    """
+    geoserverStoreName = data.get('geoserverStoreName') or layerStoreName(data["folder"])
     if data['type'] == 'shapefile':
-        shapefileName = os.path.splitext(os.path.basename(data['file']))[0]
-        filename = "{0}/{1}".format(data['folder'], shapefileName)
+        filename = os.path.splitext(data['file'])[0]
         bbox = createDataStore(
             geoserverStoreName, filename, format=data['type'])
         data["msg"] = "{0} {1}".format(data["msg"], bbox["msg"])
         data["bounds"] = bbox["solr_geom"]
         data["resource_type"] = bbox["resource_type"]
     elif data['type'] == 'image':
-        fileUrl = "file:{0}".format(data['file'][1:].replace(
+        # Preflight (determineTypeBounds) decides if the raster is rewritten before publishing
+        raster = data.get('raster') or rasterPreflight(data['file'])
+        if 'publish' not in raster:
+            # not done in its own stage (optimizeRasters)
+            raster = optimizeRaster(data['file'], raster)
+        data['raster'] = raster
+        fileUrl = "file:{0}".format(raster['publish'][1:].replace(
             'geoserver-data', 'geoportal_data', 1))
         bbox = createDataStore(
-            geoserverStoreName, fileUrl, format=data['type'])
+            geoserverStoreName, fileUrl, format=data['type'], store_type=raster['store_type'])
         data["msg"] = "{0} {1}".format(data["msg"], bbox["msg"])
         data["bounds"] = bbox["solr_geom"]
         data["resource_type"] = bbox["resource_type"]
@@ -105,10 +250,14 @@ def dataLoadGeoserver(data):
 
 @app.task()
 def getGeoServerBoundingBox(geoserver_layername):
-    cat = Catalog("{0}/rest/".format(geoserver_connection),
-                  geoserver_username, geoserver_password)
-    ws = cat.get_workspace(workspace)
-    resource = cat.get_resource(geoserver_layername, workspace=ws)
+    return catalog_cache.cached(('bbox', geoserver_layername), _getGeoServerBoundingBox,
+                                geoserver_layername)
+
+
+def _getGeoServerBoundingBox(geoserver_layername):
+    cat = getCatalog()
+    ws = getWorkspace(cat)
+    resource = getResource(cat, geoserver_layername, ws)
     bbox = resource.latlon_bbox[:4]
     solr_geom = 'ENVELOPE({0},{1},{2},{3})'.format(
         bbox[0], bbox[1], bbox[3], bbox[2])
@@ -116,56 +265,69 @@ def getGeoServerBoundingBox(geoserver_layername):
 
 
 @app.task()
-def createDataStore(name, filename, format="shapefile"):
-    cat = Catalog("{0}/rest/".format(geoserver_connection),
-                  geoserver_username, geoserver_password)
-    ws = cat.get_workspace(workspace)
+def createDataStore(name, filename, format="shapefile", store_type="GeoTIFF"):
+    cat = getCatalog()
+    ws = getWorkspace(cat)
+    invalidateLayer(name)
     msg = ""
     if format == "shapefile":
         shapefile = shapefile_and_friends(filename)
         try:
-            cat.create_featurestore(name, shapefile, workspace)
+            with timed('create_featurestore'):
+                cat.create_featurestore(name, shapefile, workspace)
         except ConflictingDataError as inst:
             msg = str(inst)
         except:
             raise
-        resource = cat.get_resource(name, workspace=ws)
+        with timed('get_resource'):
+            resource = cat.get_resource(name, workspace=ws)
         resource.projection = 'EPSG:4326'
-        cat.save(resource)
+        with timed('save'):
+            cat.save(resource)
         resource.projection_policy = 'REPROJECT_TO_DECLARED'
-        cat.save(resource)
-        resource.refresh()
+        with timed('save'):
+            cat.save(resource)
+        with timed('refresh'):
+            resource.refresh()
+        invalidateLayer(name)
         bbox = resource.latlon_bbox[:4]
         solr_geom = 'ENVELOPE({0},{1},{2},{3})'.format(
             bbox[0], bbox[1], bbox[3], bbox[2])
         return {"solr_geom": solr_geom, "msg": msg, "resource_type": resource.resource_type}
     elif format == "image":
-        if cat.get_store(name):
-            newcs = cat.get_store(name, workspace=ws)
+        try:
+            newcs = getStore(cat, name, ws)
+        except FailedRequestError:
+            # gsconfig raises instead of returning None for a missing store
+            newcs = None
+        if newcs:
             msg = "Geoserver datastore already existed. Update existing datastore."
         else:
-            newcs = cat.create_coveragestore2(name, ws)
-        newcs.type = "GeoTIFF"
+            with timed('create_coveragestore'):
+                newcs = cat.create_coveragestore2(name, ws)
+        newcs.type = store_type
         newcs.url = filename
-        cat.save(newcs)
+        with timed('save'):
+            cat.save(newcs)
         # add coverage
         url = "{0}/rest/workspaces/{1}/coveragestores/{2}/coverages.json"
         url = url.format(geoserver_connection, ws.name, name)
         headers = {"Content-Type": "application/json"}
         coverageName = os.path.splitext(os.path.basename(filename))[0]
-        postdata = {"coverage": {"nativeCoverageName": coverageName, "name": coverageName,
+        # Coverage (layer) is named after the store: resources are looked up by store name
+        postdata = {"coverage": {"nativeCoverageName": coverageName, "name": name,
                                  'projectionPolicy': 'REPROJECT_TO_DECLARED', 'srs': 'EPSG:4326'}}
-        requests.post(url, json.dumps(postdata), headers=headers,
-                      auth=(geoserver_username, geoserver_password))
+        getSession('geoserver').post(url, json.dumps(postdata), headers=headers)
         # Reproject
-        resource = cat.get_resource(name, workspace=ws)
+        with timed('get_resource'):
+            resource = cat.get_resource(name, workspace=ws)
         url = "{0}/rest/workspaces/{1}/coveragestores/{2}/coverages/{2}?{3}"
         parameters = "recalculate=nativebbox,latlonbbox"
         url = url.format(geoserver_connection, ws.name, name, parameters)
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        requests.post(url, headers=headers, auth=(
-            geoserver_username, geoserver_password))
+        getSession('geoserver').post(url, headers=headers)
         # resource.refresh()
+        invalidateLayer(name)
         bbox = resource.latlon_bbox[:4]
         solr_geom = 'ENVELOPE({0},{1},{2},{3})'.format(
             bbox[0], bbox[1], bbox[3], bbox[2])
@@ -174,17 +336,149 @@ def createDataStore(name, filename, format="shapefile"):
 
 
 @app.task()
-def getstyles():
+def getstyles(refresh=False):
     """
     Returns a list of available Geoserver Styles
+    kwargs:
+        refresh (boolean): reload the cached style inventory
     """
+    if refresh:
+        catalog_cache.invalidate('styles')
+    return catalog_cache.cached(('styles', 'global'), _getstyles)
+
+
+def _getstyles(ws_name=None):
     url = "{0}/rest/styles.json"
+    if ws_name:
+        url = "{0}/rest/workspaces/{1}/styles.json".format('{0}', ws_name)
     url = url.format(geoserver_connection)
     headers = {"Content-Type": "application/json"}
-    result = requests.get(url, headers=headers, auth=(
-        geoserver_username, geoserver_password))
+    result = getSession('geoserver').get(url, headers=headers)
     data = result.json()
-    return data['styles']['style']
+    # GeoServer returns "" instead of an empty list
+    styles = data['styles']['style'] if data.get('styles') else []
+    return styles if isinstance(styles, list) else [styles]
+
+
+def styleInventory(ws_name=workspace):
+    """
+    Names of the global styles and of the workspace styles (prefixed ws:name).
+    """
+    names = set(itm['name'] for itm in getstyles())
+    try:
+        styles = catalog_cache.cached(('styles', ws_name), _getstyles, ws_name)
+    except (ValueError, KeyError):
+        styles = []
+    names.update("{0}:{1}".format(ws_name, itm['name']) for itm in styles)
+    return names
+
+
+def layerGeometry(layername, resource_type=None, ws_name=workspace):
+    """
+    Geometry type used by style rules: Raster for coverages, the feature
+    geometry (Polygon, MultiLineString ...) or UNDETERMINED.
+    Layer names prefixed with a workspace (ws:name) are looked up there, others in ws_name.
+    """
+    if resource_type is None:
+        url = "{0}/rest/layers/{1}.json".format(geoserver_connection, layername)
+        headers = {"Content-Type": "application/json"}
+        try:
+            layer = getSession('geoserver').get(url, headers=headers).json()['layer']
+            resource_type = 'coverage' if layer.get('type') == 'RASTER' else 'feature'
+        except (ValueError, KeyError):
+            pass
+    if resource_type == 'coverage':
+        return "Raster"
+    if ':' in layername:
+        ws_name, layername = layername.split(':', 1)
+    try:
+        return determineFeatureGeometry(layername, ws_name)
+    except (ValueError, KeyError):
+        return "UNDETERMINED"
+
+
+def applyLayerStyle(layername, stylename):
+    """
+    Set the default style of one layer unless it already has it.
+    The current style is read from GeoServer, not from the catalog cache.
+    """
+    result = {"layer": layername, "style": stylename, "previous": None}
+    try:
+        result["previous"] = _getLayerDefaultStyle(layername)
+        if result["previous"] == stylename.split(':')[-1] or result["previous"] == stylename:
+            result.update({"status": "UNCHANGED", "msg": "Default style already set"})
+            return result
+        req = setLayerDefaultStyle(layername, stylename)
+        result.update({"status": "FAILURE" if req["status_code"] >= 400 else "SUCCESS",
+                       "msg": req["msg"]})
+    except ValueError:
+        # GeoServer answers a missing layer with a plain text 404
+        result.update({"status": "FAILURE", "msg": "Layer not found: {0}".format(layername)})
+    except Exception as inst:
+        result.update({"status": "FAILURE", "msg": str(inst)})
+    return result
+
+
+@app.task()
+def setLayerStyles(styles=None, rule=None, layers=None, workspace=workspace,
+                   workers=style_workers, dry_run=False):
+    """
+    Set the default style of many layers.
+    kwargs:
+        styles (dict): layer name -> style name
+        rule (dict): geometry type (Polygon, MultiLineString, Raster ...) -> style name,
+            "*" for every other layer. Applied to layers (list) or to every
+            layer of workspace.
+        workers (int): concurrent GeoServer updates
+        dry_run (boolean): validate and report without changing layers
+    return:
+        dict: counts by status, layers (layer, style, previous, status, msg)
+            status: SUCCESS, UNCHANGED, FAILURE, INVALID (unknown style),
+            SKIPPED (no rule for the geometry) or PLANNED (dry_run)
+    """
+    inventory = styleInventory(workspace)
+    plan = []
+    if styles:
+        plan = [{"layer": name, "style": style} for name, style in styles.items()]
+    if rule:
+        if layers is None:
+            items = geoserverGetWorkspaceMetadata(workspace)
+            layers = [(itm["name"], itm["type"]) for itm in items]
+        else:
+            layers = [(name, None) for name in layers]
+        for name, resource_type in layers:
+            geometry = layerGeometry(name, resource_type, workspace)
+            plan.append({"layer": name, "geometry": geometry,
+                         "style": rule.get(geometry, rule.get("*"))})
+    if any(itm["style"] and itm["style"] not in inventory for itm in plan):
+        # styles added since the inventory was cached
+        getstyles(refresh=True)
+        inventory = styleInventory(workspace)
+    results = []
+    pending = []
+    for itm in plan:
+        if not itm["style"]:
+            itm.update({"status": "SKIPPED", "msg": "No style rule for {0}".format(
+                itm.get("geometry"))})
+        elif itm["style"] not in inventory:
+            itm.update({"status": "INVALID", "msg": "Style not found: {0}".format(itm["style"])})
+        elif dry_run:
+            itm.update({"status": "PLANNED", "msg": ""})
+        else:
+            pending.append(itm)
+            continue
+        results.append(itm)
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            applied = pool.map(inContext(lambda itm: applyLayerStyle(itm["layer"], itm["style"])),
+                               pending)
+            for itm, result in zip(pending, applied):
+                itm.update(result)
+                results.append(itm)
+    counts = {}
+    for itm in results:
+        counts[itm["status"]] = counts.get(itm["status"], 0) + 1
+    return {"counts": counts, "layers": results}
 
 
 @app.task()
@@ -196,10 +490,13 @@ def getLayerDefaultStyle(layername):
     return:
         style name (string)
     """
+    return catalog_cache.cached(('style', layername), _getLayerDefaultStyle, layername)
+
+
+def _getLayerDefaultStyle(layername):
     url = "{0}/rest/layers/{1}.json".format(geoserver_connection, layername)
     headers = {"Content-Type": "application/json"}
-    result = requests.get(url, headers=headers, auth=(
-        geoserver_username, geoserver_password))
+    result = getSession('geoserver').get(url, headers=headers)
     data = result.json()
     return data['layer']['defaultStyle']['name']
 
@@ -216,8 +513,8 @@ def setLayerDefaultStyle(layername, stylename):
     url = url.format(geoserver_connection, layername)
     headers = {"Content-Type": "application/json"}
     data = {"layer": {"defaultStyle": stylename}}
-    result = requests.put(url, data=json.dumps(data), headers=headers, auth=(
-        geoserver_username, geoserver_password))
+    result = getSession('geoserver').put(url, data=json.dumps(data), headers=headers)
+    catalog_cache.invalidate('style', layername)
     if not result.text:
         msg = "Geoserver Accepted Default Style"
     else:
@@ -237,10 +534,35 @@ def deleteGeoserverStore(storeName, workspace=workspace, purge=None, recurse=Tru
         recurse (True) - Store and all metadata items will be deleted.
     """
 
-    cat = Catalog("{0}/rest/".format(geoserver_connection),
-                  geoserver_username, geoserver_password)
-    ws = cat.get_workspace(workspace)
-    ds = cat.get_store(storeName, workspace=ws)
-    cat.delete(ds, purge=purge, recurse=recurse)
+    cat = getCatalog()
+    ws = getWorkspace(cat, workspace)
+    ds = getStore(cat, storeName, ws)
+    with timed('delete'):
+        cat.delete(ds, purge=purge, recurse=recurse)
+    invalidateLayer(storeName, workspace)
+    forgetIngest(store=storeName)
     msg = "metadata and data files removed." if purge else "only metadata items removed."
     return "DataStore: {0} deleted from geoServer with {1}".format(storeName, msg)
+
+
+@app.task()
+def geoserverCacheStats(clear=False):
+    """
+    Return hit and miss counts of the GeoServer catalog cache for this worker process.
+    kwargs:
+        clear (boolean): empty the cache after reporting
+    """
+    stats = catalog_cache.stats()
+    if clear:
+        catalog_cache.invalidate()
+    return stats
+
+
+@app.task()
+def geoserverLimiterStatus():
+    """
+    Current limit, requests in flight and error/slow counts of the shared
+    GeoServer request limiter. None when GEOSERVER_LIMITER is off.
+    """
+    limiter = geoserverLimiter()
+    return limiter.status() if limiter else None
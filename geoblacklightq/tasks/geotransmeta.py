@@ -4,21 +4,31 @@ from subprocess import call, STDOUT
 from requests import exceptions
 from glob import iglob
 from .geoservertasks import determineFeatureGeometry, getGeoServerBoundingBox, getLayerDefaultStyle
+from .geoservertasks import feature_geometries, layerStoreName
+from .clients import getSession
+from .manifest import scanDataset, layerCount, layerRasters, matchMetadata
+from .geoheaders import datasetHeader
+from .rasteropt import rasterPreflight, optimizeRaster
+from .xmlparse import parseMetadataFile, parseMetadataFiles
+from .artifacts import offloadArtifacts, lazyArtifacts
+from .arkpool import takeArk, queueArkUpdate
+from .metrics import inContext
 from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
 import re
 import fnmatch
 import jinja2
 import json
 import ast
-import requests
 import zipfile
 # import fiona
 import shutil
 import os
+import struct
 import tempfile
 # import rasterio
 import xmltodict
-from nested_lookup import nested_lookup
+from .crosswalk import metadataDocument, collectKeys
 
 app = Celery()
 app.config_from_object(celeryconfig)
@@ -32,6 +42,22 @@ arkurl = os.getenv('ARK_URL', "https://test-ark.colorado.edu/ark:/")
 geoserver_url = os.getenv('GEOSERVER_CONNECTION',
                           "https://geo.colorado.edu/geoserver")
 arktoken = os.getenv('ARK_TOKEN', '')
+datasetsdir = os.getenv('DATASETS_DIR', "/data/static/geolibrary/datasets")
+metadatadir = os.getenv('METADATA_DIR', "/data/static/geolibrary/metadata/")
+# Read/write buffer used when streaming zip members to disk
+unzip_buffer = int(os.getenv('UNZIP_BUFFER_SIZE', 1024 * 1024))
+# Free space left untouched on the extraction filesystem
+unzip_reserve = int(os.getenv('UNZIP_DISK_RESERVE', 512 * 1024 * 1024))
+# Files the pipeline reads. Shapefile and image sidecars are matched by name.
+data_extensions = ['.shp', '.jpg', '.tif', '.tiff', '.png']
+metadata_extensions = ['.xml']
+# Batch crosswalk: concurrent GeoServer lookups per chunk
+crosswalk_prefetch_workers = int(os.getenv('CROSSWALK_PREFETCH_WORKERS', 8))
+# singleCrossWalkGeoBlacklight arguments in order (batch records may be lists)
+crosswalk_fields = ['filename', 'layername', 'geoserver_layername', 'resource_type',
+                    'zipurl', 'mod_url', 'ark']
+# default with entire colorado
+default_bounds = "ENVELOPE(-109.27619724342406,-101.91572412775933,41.036591647196474,36.93298568144766)"
 
 
 def findfiles(patterns, where='.'):
@@ -65,8 +91,8 @@ def deep_get(_dict, keys, default=None):
 
 
 @app.task()
-def setModsXML(url, filename, basefolder='/data/static/geolibrary/metadata/'):
-    req = requests.get(url)
+def setModsXML(url, filename, basefolder=metadatadir):
+    req = getSession('static').get(url)
     with open(os.path.join(basefolder, filename), 'w') as f1:
         f1.write(req.text)
     url = zipurl.replace('/datasets', '')
@@ -74,8 +100,84 @@ def setModsXML(url, filename, basefolder='/data/static/geolibrary/metadata/'):
     return url
 
 
+def archiveMembers(zip_ref, selective=False):
+    """
+    List zip members to extract. Directories are skipped.
+    selective (boolean): only data files, files sharing their name
+        (shapefile sidecars, world files, .prj ...), sidecars named after
+        the full data file name (.tif.ovr overviews, .tif.msk) and xml metadata.
+    """
+    members = [m for m in zip_ref.infolist() if not m.filename.endswith('/')]
+    if not selective:
+        return members
+    stems = set()
+    for m in members:
+        stem, ext = os.path.splitext(m.filename.lower())
+        if ext in data_extensions:
+            stems.add(stem)
+            stems.add(m.filename.lower())
+    selected = []
+    for m in members:
+        stem, ext = os.path.splitext(m.filename.lower())
+        if ext in metadata_extensions or stem in stems:
+            selected.append(m)
+    return selected
+
+
+def checkDiskSpace(path, required):
+    """
+    Raise exception if filesystem holding path has less than required bytes free.
+    """
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    free = shutil.disk_usage(path).free
+    if required + unzip_reserve > free:
+        raise Exception("Not enough disk space in {0}: {1} bytes required, {2} bytes free.".format(
+            path, required + unzip_reserve, free))
+
+
+def sameFilesystem(path1, path2):
+    devices = []
+    for path in [path1, path2]:
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        devices.append(os.stat(path).st_dev)
+    return devices[0] == devices[1]
+
+
+def extractMembers(zip_ref, members, destination, bufsize=unzip_buffer):
+    """
+    Stream zip members to destination with a bounded buffer.
+    Member paths are kept inside destination.
+    """
+    destination = os.path.abspath(destination)
+    for member in members:
+        target = os.path.normpath(os.path.join(
+            destination, member.filename.replace('\\', '/').lstrip('/')))
+        if not target.startswith(destination + os.sep):
+            raise Exception(
+                "Zip member outside of destination: {0}".format(member.filename))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with zip_ref.open(member) as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, bufsize)
+
+
+def storeArchive(filename, zipname):
+    """
+    Move zip archive into the datasets directory. Rename when on the same
+    filesystem, otherwise copy and remove the upload.
+    """
+    target = os.path.join(datasetsdir, zipname)
+    if sameFilesystem(filename, datasetsdir):
+        os.replace(filename, target)
+    else:
+        shutil.copy(filename, target)
+        os.remove(filename)
+    return target
+
+
 @app.task()
-def unzip(filename, destination=None, force=True):
+def unzip(filename, destination=None, force=True, selective=False):
     """
     This task unzips content into directory.
 
@@ -85,38 +187,52 @@ def unzip(filename, destination=None, force=True):
         filename (string): location of zipfile
     kwargs
         destination (string): directory name - default assigns the zipfile name.
-            Do not include path with the destination name.
+            Do not include path with the destination name. The archive is
+            stored in DATASETS_DIR under the same name.
+        selective (boolean): extract only the members the pipeline uses
+            (data files with their sidecars and xml metadata).
     Returns:
         (string): path to the unziped directory
     """
     if not destination:
         destination = os.path.splitext(os.path.basename(filename))[0]
+    # archive is stored under the destination name so folder, archive and store match
+    zipname = destination + os.path.splitext(filename)[1]
     destination = os.path.join(tmpdir, destination)
+    zip_url = "{0}/{1}".format(zipurl, zipname)
     if os.path.exists(destination):
         if force:
             shutil.rmtree(destination)
         else:
-            zipname = filename.split('/')[-1]
-            zip_url = "{0}/{1}".format(zipurl, zipname)
-            if not os.path.isfile("/data/static/geolibrary/datasets/{0}".format(zipname)):
-                shutil.copy(
-                    filename, "/data/static/geolibrary/datasets/{0}".format(zipname))
-            os.remove(filename)
+            if not os.path.isfile(os.path.join(datasetsdir, zipname)):
+                storeArchive(filename, zipname)
+            else:
+                os.remove(filename)
             return {"folder": destination, "zipdata": False, "zipurl": zip_url}
-    zip_ref = zipfile.ZipFile(filename, 'r')
-    zip_ref.extractall(destination)
-    zipname = filename.split('/')[-1]
-    shutil.copy(
-        filename, "/data/static/geolibrary/datasets/{0}".format(zipname))
-    zip_url = "{0}/{1}".format(zipurl, zipname)
-    os.remove(filename)
+    with zipfile.ZipFile(filename, 'r') as zip_ref:
+        members = archiveMembers(zip_ref, selective=selective)
+        required = sum(m.file_size for m in members)
+        if sameFilesystem(filename, datasetsdir):
+            checkDiskSpace(destination, required)
+        elif sameFilesystem(destination, datasetsdir):
+            checkDiskSpace(destination, required + os.path.getsize(filename))
+        else:
+            checkDiskSpace(destination, required)
+            checkDiskSpace(datasetsdir, os.path.getsize(filename))
+        extractMembers(zip_ref, members, destination)
+    storeArchive(filename, zipname)
     return {"folder": destination, "zipdata": True, "zipurl": zip_url}
 
 
 @app.task()
-def determineTypeBounds(data):
+def determineTypeBounds(data, resultDir=None):
     """
     Determine if a shapefile, image, or non georeferenced iiif. Then determines bounds within original projection.
+    Datasets with several shapefiles/georeferenced rasters also return layers (see datasetLayers);
+    the top level values describe the first layer.
+    kwargs:
+        resultDir (string): task result directory. Large values (dataset manifest)
+            are written there as artifacts and passed on by reference.
     """
     folder = data["folder"]
     msg = "Initial upload"
@@ -125,18 +241,23 @@ def determineTypeBounds(data):
     type = None
     file = None
     bounds = None
-    shapefiles = findfiles(['*.shp'], where=folder)
+    header = {}
+    raster = None
+    manifest = scanDataset(folder)
+    shapefiles = manifest["shapefiles"]
     if shapefiles:
         type = "shapefile"
-        file = os.path.join(folder, shapefiles[0])
-        bounds = geoBoundsMetadata(file)
+        file = os.path.join(folder, shapefiles[0]["file"])
+        header = readHeaderMetadata(file)
+        bounds = header.get("bounds") or default_bounds
     else:
         try:
-            imgfiles = findfiles(
-                ['*.jpg', '*.tif', '*.tiff', '*.png'], where=folder)
+            imgfiles = manifest["rasters"]
             if imgfiles:
-                file = os.path.join(folder, imgfiles[0])
-                bounds = geoBoundsMetadata(file, format="image")
+                file = os.path.join(folder, imgfiles[0]["file"])
+                header = readHeaderMetadata(file, format="image")
+                bounds = header.get("bounds") or default_bounds
+                raster = rasterPreflight(file)
                 type = "image"
             else:
                 raise Exception(
@@ -144,37 +265,117 @@ def determineTypeBounds(data):
         except:
             type = "iiif"
             bounds = None
-    return {"file": file, "folder": folder, "bounds": bounds, "type": type, "msg": msg, "zipurl": data["zipurl"]}
+    result = {"file": file, "folder": folder, "bounds": bounds, "type": type, "msg": msg, "zipurl": data["zipurl"],
+              "manifest": manifest, "geometry": header.get("geometry"),
+              "native_bbox": header.get("native_bbox"), "crs": header.get("crs"),
+              "raster": raster}
+    if layerCount(manifest) > 1:
+        result["layers"] = datasetLayers(folder, manifest)
+    if resultDir:
+        offloadArtifacts(result, ['manifest', 'layers'], resultDir, url=resultDirUrl(resultDir))
+    return result
 
 
 @app.task()
-def configureGeoData(data, resultDir):
+def optimizeRasters(data, resultDir=None):
     """
-    Finds all xml files within upload dataset. Reads, parses, and converts to python dictionary.
+    Apply the raster preflight route (tile, compress, overviews or pyramid)
+    of an image dataset or of every image layer before it is published.
+    Runs as a CPU stage; dataLoadGeoserver publishes data['raster']['publish'].
     """
-    xmlfiles = findfiles(['*.xml'], where=data["folder"])
+    if data.get("layers"):
+        layers = lazyArtifacts(data)["layers"]
+        for layer in layers:
+            if layer["type"] == "image":
+                layer["raster"] = optimizeRaster(layer["file"], layer.get("raster") or
+                                                 rasterPreflight(layer["file"]))
+        data = dict(data)
+        data["layers"] = layers
+        if resultDir:
+            offloadArtifacts(data, ['layers'], resultDir, url=resultDirUrl(resultDir))
+    elif data.get("type") == "image":
+        data["raster"] = optimizeRaster(data["file"], data.get("raster") or
+                                        rasterPreflight(data["file"]))
+    return data
+
+
+def datasetLayers(folder, manifest):
+    """
+    Every shapefile and georeferenced raster of a multi-layer dataset with its header values,
+    a unique GeoServer store name and the xml metadata matched by basename.
+    Returns:
+        list: {layer, file, type, bounds, geometry, native_bbox, crs, raster,
+            geoserverStoreName, xmlfiles}
+    """
+    entries = [("shapefile", itm) for itm in manifest["shapefiles"]] + \
+        [("image", itm) for itm in layerRasters(manifest)]
+    xmlfiles = matchMetadata([itm["file"] for _, itm in entries],
+                             [itm["path"] for itm in manifest["xml"] if not itm["aux"]])
+    layers = []
+    stores = set()
+    for (type, itm), xml in zip(entries, xmlfiles):
+        file = os.path.join(folder, itm["file"])
+        header = readHeaderMetadata(file, format=type)
+        store = layerStoreName(folder, itm["name"])
+        count = 1
+        while store in stores:
+            count = count + 1
+            store = "{0}_{1}".format(layerStoreName(folder, itm["name"]), count)
+        stores.add(store)
+        layers.append({"layer": itm["name"], "file": file, "type": type,
+                       "bounds": header.get("bounds") or default_bounds,
+                       "geometry": header.get("geometry"), "native_bbox": header.get("native_bbox"),
+                       "crs": header.get("crs"),
+                       "raster": rasterPreflight(file) if type == "image" else None,
+                       "geoserverStoreName": store, "xmlfiles": xml})
+    return layers
+
+
+def resultDirUrl(resultDir):
+    return os.path.join(resulturl, resultDir.split('/')[-1])
+
+
+@app.task()
+def configureGeoData(data, resultDir, full=False):
+    """
+    Finds all xml metadata files within upload dataset. Parses the elements
+    used by the crosswalk into python dictionaries. Non metadata xml
+    (e.g. .aux.xml sidecars) is skipped. Parsed documents are written to
+    resultDir as artifacts and passed on by reference.
+    kwargs:
+        full (boolean): keep complete documents (up to XML_FULL_MAX_BYTES)
+    """
+    data = lazyArtifacts(data)
+    if "xmlfiles" in data:
+        # layer of a multi-layer dataset: xml matched in determineTypeBounds
+        candidates = data["xmlfiles"]
+    else:
+        manifest = data.get("manifest") or scanDataset(data["folder"])
+        candidates = [itm["path"] for itm in manifest["xml"] if not itm["aux"]]
+    parsed = parseMetadataFiles(
+        [os.path.join(data['folder'], xml) for xml in candidates], full=full)
+    xmlfiles = []
     xmlurls = []
     fgdclist = []
-    # xmlselect=[]
-    for xml in xmlfiles:
-        shutil.copy(os.path.join(data['folder'], xml), resultDir)
-        xmlurls.append(os.path.join(resulturl, resultDir.split('/')[-1], xml))
-        # import xmltodict
-        localfilename = os.path.join(data['folder'], xml)
-        # xmlselect.append({"file":localfilename,"url":os.path.join(resulturl,resultDir.split('/')[-1],xml)})
-        with open(os.path.join(data['folder'], xml)) as fd:
-            stringxml = fd.read()
-            # if 'FGDC' in stringxml.upper():
-            fgdc = {}
-            fgdc['url'] = os.path.join(
-                resulturl, resultDir.split('/')[-1], xml)
-            doc = xmltodict.parse(
-                stringxml, cdata_key='text', attr_prefix='', dict_constructor=dict)
-            fgdc['data'] = doc
-            fgdc['file'] = localfilename
-            fgdclist.append(fgdc)
+    skipped = []
+    for xml, result in zip(candidates, parsed):
+        if not result["standard"]:
+            skipped.append({"file": xml, "error": result["error"]})
+            continue
+        os.makedirs(os.path.join(resultDir, os.path.dirname(xml)), exist_ok=True)
+        shutil.copy(os.path.join(data['folder'], xml),
+                    os.path.join(resultDir, xml))
+        url = os.path.join(resultDirUrl(resultDir), xml)
+        xmlfiles.append(xml)
+        xmlurls.append(url)
+        fgdclist.append({"url": url, "data": result["data"], "file": result["file"],
+                         "standard": result["standard"], "full": result["full"]})
     data['xmlurls'] = xmlurls
-    data['xml'] = {"urls": xmlurls, "fgdc": fgdclist, "files": xmlfiles}
+    data['xml'] = {"urls": xmlurls, "fgdc": fgdclist,
+                   "files": xmlfiles, "skipped": skipped}
+    data = data.dehydrate()
+    offloadArtifacts(data, ['manifest', 'xml.fgdc'], resultDir,
+                     url=resultDirUrl(resultDir))
     return data
 
 
@@ -198,11 +399,17 @@ def singleCrossWalkGeoBlacklight(filename, layername, geoserver_layername, resou
     Single XML file crosswalk to GeoBlacklight schema
 
     """
-    doc = {}
-    with open(filename) as fd:
-        stringxml = fd.read()
-        doc = xmltodict.parse(stringxml, cdata_key='text',
-                              attr_prefix='', dict_constructor=dict)
+    metadata = parseMetadataFile(filename)
+    if metadata["error"]:
+        raise ValueError("{0}: {1}".format(filename, metadata["error"]))
+    doc = metadata["data"] or {}
+    return crossWalkDocument(doc, layername, geoserver_layername, resource_type, zipurl, mod_url, ark)
+
+
+def crossWalkDocument(doc, layername, geoserver_layername, resource_type, zipurl, mod_url, ark):
+    """
+    Crosswalk a parsed metadata document to GeoBlacklight schema
+    """
     gblight = assignMetaDataComponents(
         doc, layername, geoserver_layername, resource_type, ark=ark)
     gblight['solr_geom'] = getGeoServerBoundingBox(geoserver_layername)
@@ -213,12 +420,78 @@ def singleCrossWalkGeoBlacklight(filename, layername, geoserver_layername, resou
     return gblight
 
 
+def crossWalkRecord(record):
+    """
+    singleCrossWalkGeoBlacklight arguments as a dict. Lists are taken in argument order.
+    """
+    if isinstance(record, (list, tuple)):
+        record = dict(zip(crosswalk_fields, record))
+    record = dict(record)
+    record.setdefault('ark', None)
+    return record
+
+
+def prefetchGeoServer(records, workers=crosswalk_prefetch_workers):
+    """
+    Load bounds, style and geometry of each layer into the GeoServer cache
+    with concurrent requests. Lookup errors are left for the crosswalk to report.
+    """
+    def _fetch(record):
+        lookups = [getGeoServerBoundingBox, getLayerDefaultStyle]
+        if record['resource_type'] != 'coverage':
+            lookups.append(determineFeatureGeometry)
+        for lookup in lookups:
+            try:
+                lookup(record['geoserver_layername'])
+            except Exception:
+                pass
+    layers = dict((record['geoserver_layername'], record) for record in records)
+    if not layers:
+        return
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(layers)), 1)) as executor:
+        list(executor.map(inContext(_fetch), layers.values()))
+
+
 @app.task()
-def crossWalkGeoBlacklight(data):
+def crossWalkChunk(records, offset=0, workers=crosswalk_prefetch_workers):
     """
-    Workflow Crosswalk to GeoBlacklight schema
+    Crosswalk a chunk of batchCrossWalkGeoBlacklight records.
+    XML files are parsed and GeoServer lookups prefetched (concurrently)
+    before the records are crosswalked.
+    Args:
+        records (list): singleCrossWalkGeoBlacklight arguments (dict or list)
+    kwargs:
+        offset (int): position of the first record in the batch
+    Returns:
+        list: {"index", "gblight"} or {"index", "record", "error"} per record
     """
+    records = [crossWalkRecord(record) for record in records]
+    parsed = parseMetadataFiles([record['filename'] for record in records])
+    prefetchGeoServer(records, workers=workers)
+    results = []
+    for idx, (record, metadata) in enumerate(zip(records, parsed)):
+        result = {"index": offset + idx}
+        try:
+            if metadata["error"]:
+                raise ValueError("{0}: {1}".format(record['filename'], metadata["error"]))
+            args = dict((key, record[key]) for key in crosswalk_fields[1:])
+            result["gblight"] = crossWalkDocument(metadata["data"] or {}, **args)
+        except Exception as inst:
+            result["record"] = record
+            result["error"] = "{0}: {1}".format(type(inst).__name__, inst)
+        results.append(result)
+    return results
 
+
+@app.task()
+def crossWalkGeoBlacklight(data, ark=None):
+    """
+    Workflow Crosswalk to GeoBlacklight schema
+    kwargs:
+        ark (string): ARK of a previous ingest of the dataset. A new ARK is
+            taken from the pool when not provided.
+    """
+    data = lazyArtifacts(data)
     dataJsonObj = deep_get(data, "xml.fgdc", [])
     if len(dataJsonObj) > 0:
         dataJsonObj = deep_get(dataJsonObj[0], "data", {})
@@ -227,7 +500,8 @@ def crossWalkGeoBlacklight(data):
     layername = os.path.splitext(os.path.basename(data['file']))[0]
     geoserver_layername = data['geoserverStoreName']
     gblight = assignMetaDataComponents(
-        dataJsonObj, layername, geoserver_layername, data["resource_type"])
+        dataJsonObj, layername, geoserver_layername, data["resource_type"], ark=ark,
+        geom_type=data.get("geometry"))
     gblight['solr_geom'] = data['bounds']
     # Set dct_references
     mod_url = zipurl.replace('/datasets', '')
@@ -239,15 +513,15 @@ def crossWalkGeoBlacklight(data):
                                               "http://www.loc.gov/mods/v3": mod_url})
 
     data['geoblacklightschema'] = gblight
-    return data
+    return data.dehydrate()
 
 
 def findSubject(dataJsonObj):
-    if 'mods:mods' in dataJsonObj:
-        return nested_lookup(key='mods:topic', document=dataJsonObj)
+    doc = metadataDocument(dataJsonObj)
+    if doc.is_mods:
+        return doc.mods('mods:topic')
     else:
-        subjects = deep_get(dataJsonObj, "metadata.idinfo.keywords.theme",
-                            deep_get(dataJsonObj, "metadata.dataIdInfo.searchKeys", []))
+        subjects = doc.first("subject", [])
         subs = []
         try:
             for keyword in ["themekey", "themekey"]:
@@ -262,10 +536,7 @@ def findSubject(dataJsonObj):
 
 
 def findTitle(dataJsonObj):
-    title = deep_get(dataJsonObj, "mods:mods.mods:titleInfo.mods:title",
-                     deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.title",
-                              deep_get(dataJsonObj, "metadata.dataIdInfo.idCitation.resTitle",
-                                       deep_get(dataJsonObj, "gmi:MI_Metadata.gmd:parentIdentifier.gco:CharacterString", ""))))
+    title = metadataDocument(dataJsonObj).first("title", "")
     if type(title) == dict:
         try:
             title = title['text']
@@ -275,9 +546,7 @@ def findTitle(dataJsonObj):
 
 
 def findDataIssued(dataJsonObj):
-    pubdate = deep_get(dataJsonObj, "mods:mods.mods:originInfo.mods:dateIssued",
-                       deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.pubdate",
-                                deep_get(dataJsonObj, "metadata.mdDateSt", None)))
+    pubdate = metadataDocument(dataJsonObj).first("issued", None)
     if type(pubdate) == dict:
         try:
             pubdate = pubdate['text']
@@ -287,9 +556,7 @@ def findDataIssued(dataJsonObj):
 
 
 def findDataCreated(dataJsonObj):
-    createDate = deep_get(dataJsonObj, "mods:mods.mods:originInfo.mods:dateCreated",
-                          deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.pubdate",
-                                   deep_get(dataJsonObj, "metadata.mdDateSt", None)))
+    createDate = metadataDocument(dataJsonObj).first("created", None)
     if type(createDate) == dict:
         try:
             createDate = createDate['text']
@@ -299,16 +566,17 @@ def findDataCreated(dataJsonObj):
 
 def findcreatorParts(name_tag):
     creators = []
-    roleterms = nested_lookup(key='mods:roleTerm', document=name_tag)
+    roleterms = collectKeys(name_tag, ['mods:roleTerm'])['mods:roleTerm']
     for roleterm in roleterms:
         if roleterm['type'] == 'text' and roleterm['text'] == 'creator':
             creators.append(name_tag['mods:namePart'])
     return creators
 
 def findCreators(dataJsonObj):
-    if 'mods:mods' in dataJsonObj:
+    doc = metadataDocument(dataJsonObj)
+    if doc.is_mods:
         creators = []
-        name_tags = nested_lookup(key='mods:name', document=dataJsonObj)
+        name_tags = doc.mods('mods:name')
         for name_tag in name_tags:
             if type(name_tag) is list:
                 for itm in name_tag:
@@ -317,57 +585,72 @@ def findCreators(dataJsonObj):
                 creators = creators + findcreatorParts(name_tag)
         return cleanBlanksFromList(creators)
     else:
-        creator = deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.origin",
-                           deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.pubinfo.publish",
-                                    deep_get(dataJsonObj, "metadata.dataIdInfo.idCitation.citResParty.rpOrgName", [])))
-        print("creator:", creator)
+        creator = doc.first("creator", [])
         if type(creator) == str:
             creator = [u"{0}".format(creator)]
-        print("creator:", creator)
         return cleanBlanksFromList(creator)
 
 
 def findPublishers(dataJsonObj):
-    if 'mods:mods' in dataJsonObj:
-        publishers = nested_lookup(
-            key='mods:publisher', document=dataJsonObj)
+    doc = metadataDocument(dataJsonObj)
+    if doc.is_mods:
+        publishers = doc.mods('mods:publisher')
         return ";".join(publishers)
     else:
-        publishers = deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.pubinfo.publish",
-                              deep_get(dataJsonObj, "metadata.idinfo.citation.citeinfo.origin",
-                                       deep_get(dataJsonObj, "metadata.dataIdInfo.idCitation.citResParty.rpOrgName", "")))
+        publishers = doc.first("publisher", "")
         return u'{0}'.format(publishers)
 
 
 def findPlaces(dataJsonObj):
-    if 'mods:mods' in dataJsonObj:
+    doc = metadataDocument(dataJsonObj)
+    if doc.is_mods:
         try:
-            place = nested_lookup(key='text',document=nested_lookup(key='mods:geographic', document=dataJsonObj)) 
+            geographic = doc.mods('mods:geographic')
+            place = collectKeys(geographic, ['text'])['text']
             if not place:
-                place = nested_lookup(key='mods:geographic', document=dataJsonObj)
+                place = geographic
         except:
             place =[]
         #list(set(nested_lookup(key='mods:placeTerm', document=nested_lookup(key='mods:geographic', document=dataJsonObj)))
         #return nested_lookup(key='mods:geographic', document=dataJsonObj)
     else:
-        place = deep_get(
-            dataJsonObj, "metadata.idinfo.keywords.place.placekey", [])
+        place = doc.first("place", [])
         if not isinstance(place, list):
             place = [place]
     return place
 
 
 def setARKSlug(gblight, ark, ark_url=arkurl, naan='47540'):
+    """
+    Set uuid, identifier and slug from ark. Without an ark one is taken from the
+    pre-minted pool and its record update is queued (see arkpool). The ARK is
+    minted inline only when the pool is empty.
+    """
 
     # double check that arkurl ends with /
     ark_url = ark_url.strip()
     if not ark_url.endswith('/'):
         ark_url = ark_url + '/'
 
+    reserved = None if ark else takeArk()
     if ark:
         gblight['uuid'] = "{0}{1}".format(arkurl, ark)
         gblight['dc_identifier_s'] = "{0}{1}".format(arkurl, ark)
         gblight['layer_slug_s'] = ark.replace('/', '-')
+    elif reserved:
+        data = reserved
+        url = data.pop("ark-detail")
+        ark = data["ark"]
+        resolve_url = resulturl.replace('apps/geo_tasks/', 'catalog/')
+        gblight['uuid'] = "{0}{1}".format(arkurl, ark)
+        gblight['dc_identifier_s'] = "{0}{1}".format(arkurl, ark)
+        gblight['layer_slug_s'] = ark.replace('/', '-')
+        data["resolve_url"] = "{0}{1}".format(
+            resolve_url, gblight['layer_slug_s'])
+        mods = data.setdefault("metadata", {}).setdefault("mods", {})
+        mods["titleInfo"] = [{"title": gblight['dc_title_s']}]
+        mods["identifier"] = "{0}{1}".format(arkurl, ark)
+        queueArkUpdate(url, data)
     else:
         headers = {"Content-Type": "application/json",
                    "Authorization": "Token {0}".format(arktoken)}
@@ -375,7 +658,7 @@ def setARKSlug(gblight, ark, ark_url=arkurl, naan='47540'):
         data = {"resolve_url": resolve_url, "generated_by": "geoBlacklightQ", "status": "inactive",
                 "metadata": {"mods": {"titleInfo": [{"title": gblight['dc_title_s']}],
                                       "typeOfResource": "", "identifier": "", "accessCondition": ""}}}
-        req = requests.post("{0}?format=json".format(
+        req = getSession('ark').post("{0}?format=json".format(
             arkurl), data=json.dumps(data), headers=headers)
         data = req.json()["results"][0]
         url = data["ark-detail"]
@@ -389,24 +672,25 @@ def setARKSlug(gblight, ark, ark_url=arkurl, naan='47540'):
         data["resolve_url"] = "{0}{1}".format(
             resolve_url, gblight['layer_slug_s'])
         data["metadata"]["mods"]["identifier"] = "{0}{1}".format(arkurl, ark)
-        req = requests.put(url, data=json.dumps(data), headers=headers)
+        req = getSession('ark').put(url, data=json.dumps(data), headers=headers)
         if req.status_code >= 400:
             raise Exception(req.text)
     return gblight
 
 
-def assignMetaDataComponents(dataJsonObj, layername, geoserver_layername, resource_type, ark=None):
+def assignMetaDataComponents(dataJsonObj, layername, geoserver_layername, resource_type, ark=None,
+                             geom_type=None):
     """
     Geoblacklight crosswalk for metadata
+    geom_type: geometry type read locally from the shapefile header.
+        GeoServer is only asked when not provided.
     """
     gblight = {}
+    dataJsonObj = metadataDocument(dataJsonObj)
     gblight['dc_title_s'] = findTitle(dataJsonObj)
     # Set Arks
     gblight = setARKSlug(gblight, ark)
-    gblight['dc_description_s'] = deep_get(dataJsonObj, "mods:mods.mods:abstract",
-                                           deep_get(dataJsonObj, "metadata.idinfo.descript.abstract",
-                                                    re.sub('<[^<]+>', "", deep_get(dataJsonObj, "metadata.dataIdInfo.idAbs",
-                                                                                   deep_get(dataJsonObj, "gmi:MI_Metadata.gmd:identificationInfo.gmd:MD_DataIdentification.gmd:abstract.gco:CharacterString", "")))))
+    gblight['dc_description_s'] = dataJsonObj.first("description", "")
     gblight['dc_rights_s'] = "Public"
     cub_rights_metadata_s = "The organization that has made the Item available believes that the Item is in the Public Domain under the laws of the United States."
     gblight['cub_rights_metadata_s'] = cub_rights_metadata_s
@@ -418,8 +702,11 @@ def assignMetaDataComponents(dataJsonObj, layername, geoserver_layername, resour
         gblight['layer_geom_type_s'] = "Raster"
         gblight['dc_format_s'] = "GeoTiff"
     else:
-        gblight['layer_geom_type_s'] = determineFeatureGeometry(
-            geoserver_layername)
+        if geom_type in feature_geometries:
+            gblight['layer_geom_type_s'] = geom_type
+        else:
+            gblight['layer_geom_type_s'] = determineFeatureGeometry(
+                geoserver_layername)
         gblight['dc_format_s'] = "Shapefile"
     gblight['dc_language_s'] = "English"
     gblight['dc_type_s'] = "Dataset"
@@ -444,13 +731,24 @@ def cleanBlanksFromList(datalist):
     return [x for x in datalist if x]
 
 
-@app.task()
-def geoBoundsMetadata(filename, format="shapefile"):
+def readHeaderMetadata(filename, format="shapefile"):
     """
-    **** Removing getting Bounds - Done later in work workflow with GeoServer. 
+    Bounds, CRS and geometry type from the shapefile or GeoTIFF header.
+    Never raises; unreadable headers return an error message instead.
+    """
+    try:
+        return datasetHeader(filename, format=format)
+    except (OSError, ValueError, KeyError, IndexError, struct.error) as inst:
+        return {"error": str(inst)}
 
 
+@app.task()
+def geoBoundsMetadata(filename, format="shapefile"):
+    """
     This task finds bounding box of georeferenced shapefile or raster.
+    Bounds are read from the .shp header or GeoTIFF tags. Projected data
+    (not longitude/latitude) returns the default bounds and is set later
+    in the workflow by GeoServer.
 
     Signature:
         geoBoundsMetadata(filename,format="shapfile")
@@ -463,5 +761,4 @@ def geoBoundsMetadata(filename, format="shapefile"):
         (string): with bounding box.
             path to the unziped directory
     """
-    # default with entire colorado
-    return "ENVELOPE(-109.27619724342406,-101.91572412775933,41.036591647196474,36.93298568144766)"
+    return readHeaderMetadata(filename, format=format).get("bounds") or default_bounds
@@ -0,0 +1,224 @@
+from celery import Celery
+import celeryconfig
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import time
+import zipfile
+
+app = Celery()
+app.config_from_object(celeryconfig)
+
+# Content hash index of ingested zip files shared by all workers on this host
+# (one <zipname>.json entry per archive)
+ingest_index_dir = os.getenv('INGEST_INDEX_DIR', "/data/static/geo_tasks/ingest_index")
+ingest_dedup = os.getenv('INGEST_DEDUP', 'true').lower() in ['true', '1', 'yes']
+arkurl = os.getenv('ARK_URL', "https://test-ark.colorado.edu/ark:/")
+datasetsdir = os.getenv('DATASETS_DIR', "/data/static/geolibrary/datasets")
+# Members matching these are metadata; everything else (including .aux.xml) is data
+metadata_extensions = ['.xml']
+# Workflow values kept in the index and returned for an identical re-upload
+result_keys = ['file', 'folder', 'bounds', 'type', 'msg', 'zipurl', 'geometry', 'crs',
+               'geoserverStoreName', 'resource_type', 'xmlurls', 'geoblacklightschema', 'layers']
+
+
+@contextmanager
+def ingestIndexLock(exclusive=False):
+    """
+    Shared (lookups) or exclusive (updates) lock of the ingest index.
+    """
+    os.makedirs(ingest_index_dir, exist_ok=True)
+    with open(os.path.join(ingest_index_dir, ".lock"), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def entryPath(zipname):
+    return os.path.join(ingest_index_dir, "{0}.json".format(os.path.basename(zipname)))
+
+
+def loadEntry(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def readEntry(zipname):
+    """
+    Index entry of zipname or None.
+    """
+    with ingestIndexLock():
+        return loadEntry(entryPath(zipname))
+
+
+def writeEntry(entry):
+    """
+    Store the entry of entry["zipname"], replacing the previous one.
+    """
+    path = entryPath(entry["zipname"])
+    with ingestIndexLock(exclusive=True):
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+
+def ingestEntries():
+    """
+    All index entries.
+    """
+    with ingestIndexLock():
+        names = [name for name in os.listdir(ingest_index_dir) if name.endswith('.json')]
+        entries = [loadEntry(os.path.join(ingest_index_dir, name)) for name in sorted(names)]
+    return [entry for entry in entries if entry]
+
+
+def isMetadataMember(name):
+    name = name.lower()
+    return os.path.splitext(name)[1] in metadata_extensions and not name.endswith('.aux.xml')
+
+
+def archiveDigest(filename, bufsize=1024 * 1024):
+    """
+    sha256 of the zip file and CRC32/size of every member (from the central directory).
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(bufsize), b''):
+            sha.update(chunk)
+    with zipfile.ZipFile(filename) as zip_ref:
+        members = dict((m.filename, {"crc": m.CRC, "size": m.file_size})
+                       for m in zip_ref.infolist() if not m.filename.endswith('/'))
+    return {"zipname": os.path.basename(filename), "sha256": sha.hexdigest(),
+            "size": os.path.getsize(filename), "members": members}
+
+
+def changedMembers(old, new):
+    names = set(old) | set(new)
+    return sorted(name for name in names if old.get(name) != new.get(name))
+
+
+def planIngest(filename):
+    """
+    Compare an upload with the index entry of the same zip name.
+    Returns:
+        dict: action (new, data, metadata or identical), digest, entry, changed (members)
+            new: not ingested before
+            data: data members changed - publish again, keep the ARK
+            metadata: only xml metadata changed - reuse the GeoServer stores and ARKs
+            identical: same archive - reuse the stored result
+    """
+    digest = archiveDigest(filename)
+    entry = readEntry(digest["zipname"])
+    if not entry:
+        return {"action": "new", "digest": digest, "entry": None, "changed": []}
+    changed = changedMembers(entry["members"], digest["members"])
+    if (entry["sha256"] == digest["sha256"] or not changed) and entry.get("result"):
+        action = "identical"
+    elif (entry.get("store") or entry.get("stores")) and \
+            all(isMetadataMember(name) for name in changed):
+        action = "metadata"
+    else:
+        action = "data"
+    return {"action": action, "digest": digest, "entry": entry, "changed": changed}
+
+
+def arkFromRecord(gblight):
+    identifier = gblight.get('dc_identifier_s') or ''
+    if identifier.startswith(arkurl):
+        return identifier[len(arkurl):]
+    return None
+
+
+@app.task()
+def recordIngest(data, digest, resultDir=None):
+    """
+    Last step of the loader: store the archive digest with its GeoServer store,
+    ARK and result. Returns data unchanged.
+    Multi-layer datasets keep their stores and ARKs per layer (stores, arks).
+    """
+    gblight = data.get('geoblacklightschema') or {}
+    layers = data.get('layers') or []
+    entry = dict(digest)
+    entry.update({"store": data.get('geoserverStoreName'), "type": data.get('type'),
+                  "stores": [itm.get('geoserverStoreName') for itm in layers],
+                  "arks": dict((itm['geoserverStoreName'],
+                                arkFromRecord(itm.get('geoblacklightschema') or {}))
+                               for itm in layers),
+                  "resource_type": data.get('resource_type'), "bounds": data.get('bounds'),
+                  "ark": arkFromRecord(gblight), "resultDir": resultDir,
+                  "ingested": time.time(),
+                  "result": dict((key, data[key]) for key in result_keys if key in data)})
+    writeEntry(entry)
+    return data
+
+
+@app.task()
+def reuseGeoserverStore(data, entry):
+    """
+    Replaces dataLoadGeoserver when only metadata changed: the existing
+    store, bounds and resource type are used without publishing again.
+    """
+    data['geoserverStoreName'] = entry['store']
+    data['resource_type'] = entry['resource_type']
+    data['bounds'] = entry['bounds'] or data.get('bounds')
+    data['msg'] = "{0} {1}".format(data.get('msg', ''),
+                                   "Data unchanged. Existing GeoServer store reused.").strip()
+    return data
+
+
+@app.task()
+def reuseIngest(local_file, entry):
+    """
+    Identical re-upload: return the stored result of the previous ingest.
+    The uploaded copy is removed; the archive is already in the datasets folder.
+    """
+    result = dict(entry['result'])
+    result['msg'] = "Identical archive ingested previously. Existing store and record reused."
+    result['reused'] = True
+    stored = os.path.join(datasetsdir, entry['zipname'])
+    if os.path.isfile(local_file) and os.path.abspath(local_file) != os.path.abspath(stored):
+        os.remove(local_file)
+    return result
+
+
+def forgetIngest(store=None, zipname=None):
+    """
+    Drop index entries of a deleted GeoServer store or zip file.
+    """
+    with ingestIndexLock(exclusive=True):
+        names = []
+        for name in os.listdir(ingest_index_dir):
+            if not name.endswith('.json'):
+                continue
+            name = name[:-len('.json')]
+            if name != zipname and store:
+                entry = loadEntry(entryPath(name)) or {}
+                if store not in [entry.get('store')] + entry.get('stores', []):
+                    continue
+            elif name != zipname:
+                continue
+            os.remove(entryPath(name))
+            names.append(name)
+    return names
+
+
+@app.task()
+def ingestIndexStatus(zipname=None):
+    """
+    Index entry of zipname (without member list) or number of indexed archives.
+    """
+    if zipname:
+        entry = readEntry(zipname) or {}
+        entry.pop('members', None)
+        return entry
+    with ingestIndexLock():
+        return {"archives": len([name for name in os.listdir(ingest_index_dir)
+                                 if name.endswith('.json')])}
@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import random
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Concurrent GeoServer requests of all workers. The limit adapts (AIMD): it grows by
+# one per limit successful requests and is halved when a request fails with a 5xx or
+# connection error, or takes longer than GEOSERVER_LATENCY_TARGET seconds. Uploads
+# (shapefile zip, GeoTIFF bodies) take as long as their size needs and are never slow.
+# GEOSERVER_LIMITER: file (workers of this host, GEOSERVER_LIMIT_FILE),
+#     redis (all hosts, GEOSERVER_LIMIT_REDIS_URL) or off
+limiter_backend = os.getenv('GEOSERVER_LIMITER', 'file').lower()
+limit_file = os.getenv('GEOSERVER_LIMIT_FILE', "/data/static/geo_tasks/geoserver_limit.json")
+limit_redis_url = os.getenv('GEOSERVER_LIMIT_REDIS_URL', '')
+limit_min = float(os.getenv('GEOSERVER_LIMIT_MIN', 1))
+limit_max = float(os.getenv('GEOSERVER_LIMIT_MAX', 16))
+limit_initial = float(os.getenv('GEOSERVER_LIMIT_INITIAL', 4))
+latency_target = float(os.getenv('GEOSERVER_LATENCY_TARGET', 5))
+# Seconds to wait for a slot before the request fails
+limit_wait = float(os.getenv('GEOSERVER_LIMIT_WAIT', 900))
+# Requests that take a slot. Catalog writes are what GeoServer serializes.
+limit_methods = [itm.strip().upper() for itm in
+                 os.getenv('GEOSERVER_LIMIT_METHODS', 'POST,PUT,DELETE').split(',') if itm.strip()]
+# Slots of crashed workers are reclaimed after this many seconds
+lease_ttl = float(os.getenv('GEOSERVER_LIMIT_LEASE', 600))
+decrease_factor = 0.5
+poll_interval = 0.05
+
+
+def initialState():
+    return {"limit": limit_initial, "inflight": {}, "last_decrease": 0.0,
+            "requests": 0, "errors": 0, "slow": 0, "decreases": 0}
+
+
+def adjustLimit(state, seconds, error, now, upload=False):
+    """
+    AIMD step after a request. A burst of failures of requests started
+    together halves the limit only once (one decrease per latency target).
+    upload (boolean): file body request, its latency is not compared with the target
+    """
+    slow = not upload and seconds > latency_target
+    state["requests"] = state["requests"] + 1
+    state["errors"] = state["errors"] + (1 if error else 0)
+    state["slow"] = state["slow"] + (1 if slow else 0)
+    if error or slow:
+        if now - state["last_decrease"] >= latency_target:
+            state["limit"] = max(limit_min, state["limit"] * decrease_factor)
+            state["last_decrease"] = now
+            state["decreases"] = state["decreases"] + 1
+    else:
+        state["limit"] = min(limit_max, state["limit"] + 1.0 / state["limit"])
+    return state
+
+
+class FileBackend(object):
+    """
+    Limiter state in a JSON file under an fcntl lock (workers of one host).
+    """
+
+    def __init__(self, path=limit_file):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open("{0}.lock".format(self.path), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = initialState()
+                if os.path.exists(self.path):
+                    with open(self.path) as f:
+                        state.update(json.load(f))
+                yield state
+                tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, token, now):
+        with self.locked() as state:
+            inflight = dict((key, expires) for key, expires in state["inflight"].items()
+                            if expires > now)
+            acquired = len(inflight) < int(state["limit"])
+            if acquired:
+                inflight[token] = now + lease_ttl
+            state["inflight"] = inflight
+            return acquired
+
+    def release(self, token, seconds, error, now, upload=False):
+        with self.locked() as state:
+            state["inflight"].pop(token, None)
+            adjustLimit(state, seconds, error, now, upload)
+
+    def status(self):
+        with self.locked() as state:
+            return dict(state, inflight=len(state["inflight"]))
+
+
+class RedisBackend(object):
+    """
+    Limiter state in Redis (workers of every host): leases in a sorted set
+    scored by expiry, AIMD values in a hash. Updates use WATCH/MULTI.
+    """
+
+    def __init__(self, url=limit_redis_url, prefix='geoblacklightq:geoserver_limit'):
+        self.client = redis.Redis.from_url(url)
+        self.leases = "{0}:leases".format(prefix)
+        self.key = "{0}:state".format(prefix)
+
+    def state(self, pipe):
+        state = initialState()
+        for key, value in pipe.hgetall(self.key).items():
+            state[key.decode('utf-8')] = float(value)
+        del state["inflight"]
+        return state
+
+    def transaction(self, func):
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.leases, self.key)
+                    result = func(pipe)
+                    pipe.execute()
+                    return result
+                except redis.WatchError:
+                    continue
+
+    def acquire(self, token, now):
+        def _acquire(pipe):
+            # watched keys are only written after multi()
+            acquired = pipe.zcount(self.leases, now, '+inf') < int(self.state(pipe)["limit"])
+            pipe.multi()
+            pipe.zremrangebyscore(self.leases, '-inf', now)
+            if acquired:
+                pipe.zadd(self.leases, {token: now + lease_ttl})
+            return acquired
+        return self.transaction(_acquire)
+
+    def release(self, token, seconds, error, now, upload=False):
+        def _release(pipe):
+            state = adjustLimit(self.state(pipe), seconds, error, now, upload)
+            pipe.multi()
+            pipe.zrem(self.leases, token)
+            pipe.hset(self.key, mapping=state)
+        self.transaction(_release)
+
+    def status(self):
+        state = self.state(self.client)
+        state["inflight"] = self.client.zcount(self.leases, time.time(), '+inf')
+        return state
+
+
+class AdaptiveLimiter(object):
+    """
+    Shared semaphore whose size follows GeoServer latency and error rate.
+    outcome holds the seconds waited for the slot.
+        with limiter.slot() as outcome:
+            outcome["upload"] = True  # file body: never counted as slow
+            response = session.request(...)
+            outcome["error"] = response.status_code >= 500
+    """
+
+    def __init__(self, backend, wait=limit_wait, methods=limit_methods):
+        self.backend = backend
+        self.wait = wait
+        self.methods = methods
+
+    def acquire(self):
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait
+        delay = poll_interval
+        while not self.backend.acquire(token, time.time()):
+            if time.time() > deadline:
+                raise Exception("No GeoServer request slot within {0} seconds (limit {1})".format(
+                    self.wait, self.backend.status()["limit"]))
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 1.0)
+        return token
+
+    @contextmanager
+    def slot(self):
+        start = time.time()
+        token = self.acquire()
+        outcome = {"error": False, "upload": False, "wait": time.time() - start}
+        start = time.time()
+        try:
+            yield outcome
+        except Exception:
+            outcome["error"] = True
+            raise
+        finally:
+            self.backend.release(token, time.time() - start, outcome["error"], time.time(),
+                                 outcome["upload"])
+
+    def status(self):
+        return self.backend.status()
+
+
+def getLimiter():
+    """
+    Limiter configured by GEOSERVER_LIMITER or None when disabled.
+    """
+    if limiter_backend == 'redis' and limit_redis_url:
+        if redis is None:
+            raise ImportError("GEOSERVER_LIMITER=redis requires the redis package")
+        return AdaptiveLimiter(RedisBackend(limit_redis_url))
+    if limiter_backend == 'file':
+        return AdaptiveLimiter(FileBackend(limit_file))
+    return None
@@ -0,0 +1,159 @@
+from .geoheaders import isGeoTiff
+import os
+import zipfile
+
+# Extensions in order of preference when picking the dataset file
+shapefile_extensions = ['.shp']
+raster_extensions = ['.tif', '.tiff', '.jpg', '.png']
+xml_extensions = ['.xml']
+# Rasters published as layers when georeferenced by GeoTIFF tags or a world file.
+# Other images (.jpg, .png) are scanned images or attachments.
+layer_raster_extensions = ['.tif', '.tiff']
+world_file_extensions = ['.tfw', '.tifw', '.tiffw', '.wld']
+
+
+def scanFiles(folder):
+    """
+    Recursive os.scandir of folder.
+    Returns list of (relative path, size, mtime). Symlinks are not followed.
+    """
+    files = []
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((os.path.relpath(entry.path, folder),
+                                  stat.st_size, stat.st_mtime))
+    return files
+
+
+def _sortkey(path):
+    # Prefer top level files, then alphabetical
+    return (path.count(os.sep), path.lower())
+
+
+def scanDataset(folder):
+    """
+    Build a typed manifest of an extracted dataset in a single directory scan.
+
+    Returns:
+        dict:
+            folder: dataset folder
+            shapefiles: [{name, file, sidecars, size}]  .shp with same name files
+            rasters: [{name, file, sidecars, size, georeferenced}]  images with world
+                files, overviews ... georeferenced: GeoTIFF tags or a world file
+            xml: [{path, size, mtime, aux}]  aux is True for .aux.xml sidecars
+            other: [{path, size, mtime}]
+            size: total bytes
+    All paths are relative to folder.
+    """
+    def georeferenced(path):
+        with open(os.path.join(folder, path), 'rb') as f:
+            return isGeoTiff(f)
+    return buildManifest(folder, scanFiles(folder), georeferenced)
+
+
+def archiveManifest(filename):
+    """
+    Manifest of a zip file from its member list, without extracting it.
+    TIFF members are opened only to check their first IFD for GeoTIFF tags.
+    """
+    with zipfile.ZipFile(filename) as zip_ref:
+        files = [(m.filename, m.file_size, 0) for m in zip_ref.infolist()
+                 if not m.filename.endswith('/')]
+
+        def georeferenced(path):
+            with zip_ref.open(path) as f:
+                return isGeoTiff(f)
+        return buildManifest(filename, files, georeferenced)
+
+
+def buildManifest(folder, files, isGeoreferenced=None):
+    """
+    Typed manifest (see scanDataset) of a list of (relative path, size, mtime).
+    isGeoreferenced (function): relative path of a TIFF without world file -->
+        True when it carries GeoTIFF tags
+    """
+    files = sorted(files, key=lambda f: _sortkey(f[0]))
+    groups = {}
+    for path, size, mtime in files:
+        stem, ext = os.path.splitext(path)
+        groups.setdefault(stem.lower(), []).append((path, ext.lower(), size, mtime))
+    manifest = {"folder": folder, "shapefiles": [], "rasters": [], "xml": [], "other": [],
+                "size": sum(f[1] for f in files)}
+    claimed = set()
+    for kind, extensions in [("shapefiles", shapefile_extensions), ("rasters", raster_extensions)]:
+        for ext in extensions:
+            for path, size, mtime in files:
+                stem, fext = os.path.splitext(path)
+                if fext.lower() != ext or path in claimed:
+                    continue
+                members = [m for m in groups[stem.lower()] if m[1] not in xml_extensions
+                           and m[0] not in claimed]
+                claimed.update(m[0] for m in members)
+                item = {"name": os.path.basename(stem), "file": path,
+                        "sidecars": [m[0] for m in members if m[0] != path],
+                        "size": sum(m[2] for m in members)}
+                if kind == "rasters":
+                    item["georeferenced"] = ext in layer_raster_extensions and (
+                        any(m[1] in world_file_extensions for m in members) or
+                        bool(isGeoreferenced and isGeoreferenced(path)))
+                manifest[kind].append(item)
+        manifest[kind].sort(key=lambda itm: _sortkey(itm["file"]))
+    for path, size, mtime in files:
+        if path in claimed:
+            continue
+        if os.path.splitext(path)[1].lower() in xml_extensions:
+            manifest["xml"].append({"path": path, "size": size, "mtime": mtime,
+                                    "aux": path.lower().endswith('.aux.xml')})
+        else:
+            manifest["other"].append({"path": path, "size": size, "mtime": mtime})
+    return manifest
+
+
+def layerRasters(manifest):
+    """
+    Rasters of a manifest that are published as layers (georeferenced TIFFs).
+    """
+    return [itm for itm in manifest["rasters"] if itm.get("georeferenced")]
+
+
+def layerCount(manifest):
+    return len(manifest["shapefiles"]) + len(layerRasters(manifest))
+
+
+def matchMetadata(layers, xmlfiles):
+    """
+    Assign xml metadata to layers by basename: roads.xml and roads.shp.xml
+    belong to layer roads (same folder preferred). xml matching no layer is
+    shared by the layers without metadata of their own.
+    Args:
+        layers (list): layer file paths
+        xmlfiles (list): xml paths
+    Returns:
+        list: xml paths per layer, in layer order
+    """
+    by_path = {}
+    by_name = {}
+    for idx, path in enumerate(layers):
+        stem = os.path.splitext(path)[0].lower()
+        by_path.setdefault(stem, []).append(idx)
+        by_name.setdefault(os.path.basename(stem), []).append(idx)
+    matched = [[] for _ in layers]
+    shared = []
+    for path in xmlfiles:
+        stem = os.path.splitext(path)[0].lower()
+        keys = [stem, os.path.splitext(stem)[0]]
+        found = [by_path[key] for key in keys if key in by_path] or \
+            [by_name[os.path.basename(key)] for key in keys if os.path.basename(key) in by_name]
+        if found:
+            for idx in found[0]:
+                matched[idx].append(path)
+        else:
+            shared.append(path)
+    return [files or list(shared) for files in matched]
@@ -0,0 +1,426 @@
+from celery.signals import task_prerun, task_postrun, worker_process_init
+from celery.signals import worker_process_shutdown, worker_ready, celeryd_init
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Each worker process writes its metrics to METRICS_DIR/<nodename>/<pid>.json. The
+# main worker process merges those of its node and serves Prometheus text on
+# METRICS_PORT (0 disables; workers sharing a host need a port each).
+metrics_dir = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'geoblacklightq_metrics'))
+metrics_port = int(os.getenv('METRICS_PORT', 9540))
+metrics_flush_interval = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# Workflow result directories (geo_tasks/<root task id>) receive timeline.json
+timeline_root = os.getenv('TIMELINE_DIR', "/data/static/geo_tasks")
+
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+size_buckets = [1024, 10240, 102400, 1048576, 10485760, 104857600, 1073741824]
+help_text = {
+    "geoblacklightq_task_duration_seconds": "Celery task run time",
+    "geoblacklightq_http_request_duration_seconds": "Outbound HTTP request time by upstream and stage",
+    "geoblacklightq_http_request_bytes": "Outbound HTTP request body size",
+    "geoblacklightq_http_response_bytes": "Outbound HTTP response body size",
+    "geoblacklightq_geoserver_call_duration_seconds": "GeoServer catalog (gsconfig) call time",
+    "geoblacklightq_geoserver_slot_wait_seconds": "Wait for a shared GeoServer request slot",
+}
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+class Registry(object):
+    """
+    Histograms of one process. Keys are JSON encoded [name, sorted labels].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = _key(name, dict((k, str(v)) for k, v in labels.items()))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                self.histograms[key] = hist
+            for idx, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][idx] = hist["counts"][idx] + 1
+            hist["sum"] = hist["sum"] + value
+            hist["count"] = hist["count"] + 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.histograms))
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+
+
+registry = Registry()
+# Task running in this context (thread, or greenlet with gevent/eventlet); HTTP
+# calls are attributed to its stage. outer: task it was called from when
+# executed eagerly (nested). Helper threads get the context through inContext.
+_current = contextvars.ContextVar('geoblacklightq_task', default=None)
+# helper threads add calls to the task of the thread that started them
+_calls_lock = threading.Lock()
+_last_flush = [0.0]
+# flush of observations skipped by the METRICS_FLUSH_INTERVAL throttle
+_flush_timer = [None]
+_flush_lock = threading.Lock()
+# worker nodename (celeryd_init), inherited by the pool processes
+_node = [None]
+
+
+def _idle():
+    return {"stage": None, "task_id": None, "root_id": None, "start": None, "calls": {},
+            "outer": None}
+
+
+def _task():
+    current = _current.get()
+    return current if current is not None else _idle()
+
+
+def currentStage():
+    return _task()["stage"] or "none"
+
+
+def inContext(func):
+    """
+    Wrap func to run in a copy of the caller's context, e.g.
+    executor.map(inContext(lookup), items): calls made from the pool threads
+    are attributed to the calling task.
+    """
+    ctx = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        return ctx.copy().run(func, *args, **kwargs)
+    return _run
+
+
+def _addCall(group, name, seconds, request_bytes=0, response_bytes=0, error=False):
+    task = _task()
+    with _calls_lock:
+        calls = task["calls"].setdefault(group, {}).setdefault(
+            name, {"calls": 0, "seconds": 0.0, "request_bytes": 0, "response_bytes": 0,
+                   "errors": 0})
+        calls["calls"] = calls["calls"] + 1
+        calls["seconds"] = calls["seconds"] + seconds
+        calls["request_bytes"] = calls["request_bytes"] + request_bytes
+        calls["response_bytes"] = calls["response_bytes"] + response_bytes
+        calls["errors"] = calls["errors"] + (1 if error else 0)
+
+
+def recordHttp(upstream, method, status, seconds, request_bytes=0, response_bytes=0):
+    """
+    Record one outbound HTTP call. status is the HTTP status code or 'error'.
+    """
+    stage = currentStage()
+    registry.observe("geoblacklightq_http_request_duration_seconds", seconds,
+                     upstream=upstream, method=method, status=status, stage=stage)
+    registry.observe("geoblacklightq_http_request_bytes", request_bytes, buckets=size_buckets,
+                     upstream=upstream, method=method, stage=stage)
+    registry.observe("geoblacklightq_http_response_bytes", response_bytes, buckets=size_buckets,
+                     upstream=upstream, method=method, stage=stage)
+    error = status == 'error' or (isinstance(status, int) and status >= 400)
+    _addCall("http", upstream, seconds, request_bytes, response_bytes, error)
+
+
+def bodySize(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+def responseHook(upstream):
+    """
+    requests response hook recording calls of sessions we do not create (gsconfig Catalog).
+    Duration is the time until the response headers arrived.
+    """
+    def _hook(response, *args, **kwargs):
+        recordHttp(upstream, response.request.method, response.status_code,
+                   response.elapsed.total_seconds(), bodySize(response.request.body),
+                   int(response.headers.get('Content-Length') or 0))
+        return response
+    return _hook
+
+
+@contextmanager
+def timed(call):
+    """
+    Time a GeoServer catalog call, e.g. with timed('create_featurestore'): ...
+    """
+    start = time.time()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        seconds = time.time() - start
+        registry.observe("geoblacklightq_geoserver_call_duration_seconds", seconds,
+                         call=call, stage=currentStage(), error=error)
+        _addCall("geoserver", call, seconds, error=error)
+
+
+def timedCall(call, func, *args, **kwargs):
+    with timed(call):
+        return func(*args, **kwargs)
+
+
+def nodeDir():
+    """
+    Snapshot folder of this worker: METRICS_DIR/<nodename>.
+    """
+    return os.path.join(metrics_dir, _node[0] or 'celery')
+
+
+def flushMetrics(force=False):
+    """
+    Write this process' histograms to METRICS_DIR/<nodename>/<pid>.json at most
+    every METRICS_FLUSH_INTERVAL seconds. A skipped flush is done by a timer
+    once the interval has passed.
+    """
+    now = time.time()
+    if not force and now - _last_flush[0] < metrics_flush_interval:
+        scheduleFlush(metrics_flush_interval - (now - _last_flush[0]))
+        return
+    with _flush_lock:
+        _last_flush[0] = now
+        os.makedirs(nodeDir(), exist_ok=True)
+        path = os.path.join(nodeDir(), "{0}.json".format(os.getpid()))
+        tmp = "{0}.tmp".format(path)
+        with open(tmp, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp, path)
+
+
+def scheduleFlush(delay):
+    with _flush_lock:
+        if _flush_timer[0] is not None:
+            return
+        timer = threading.Timer(delay, timedFlush)
+        timer.daemon = True
+        _flush_timer[0] = timer
+    timer.start()
+
+
+def timedFlush():
+    with _flush_lock:
+        _flush_timer[0] = None
+    try:
+        flushMetrics(force=True)
+    except (OSError, ValueError):
+        pass
+
+
+def processAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def mergedSnapshot():
+    """
+    Histograms of every running process of this worker summed up.
+    Snapshots of processes that are gone (killed before removing theirs) are skipped.
+    """
+    merged = registry.snapshot()
+    for path in glob.glob(os.path.join(nodeDir(), '*.json')):
+        pid = os.path.basename(path)[:-len('.json')]
+        if not pid.isdigit() or int(pid) == os.getpid() or not processAlive(int(pid)):
+            continue
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for key, hist in snapshot.items():
+            if key not in merged:
+                merged[key] = hist
+                continue
+            total = merged[key]
+            total["counts"] = [a + b for a, b in zip(total["counts"], hist["counts"])]
+            total["sum"] = total["sum"] + hist["sum"]
+            total["count"] = total["count"] + hist["count"]
+    return merged
+
+
+def _labels(pairs):
+    return ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in pairs)
+
+
+def renderPrometheus(snapshot=None):
+    """
+    Prometheus text exposition format of the merged histograms.
+    """
+    snapshot = mergedSnapshot() if snapshot is None else snapshot
+    series = {}
+    for key, hist in snapshot.items():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append((labels, hist))
+    lines = []
+    for name in sorted(series):
+        lines.append("# HELP {0} {1}".format(name, help_text.get(name, name)))
+        lines.append("# TYPE {0} histogram".format(name))
+        for labels, hist in sorted(series[name], key=lambda itm: itm[0]):
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                lines.append("{0}_bucket{{{1}}} {2}".format(
+                    name, _labels(labels + [["le", repr(float(bound))]]), count))
+            lines.append("{0}_bucket{{{1}}} {2}".format(
+                name, _labels(labels + [["le", "+Inf"]]), hist["count"]))
+            lines.append("{0}_sum{{{1}}} {2}".format(name, _labels(labels), hist["sum"]))
+            lines.append("{0}_count{{{1}}} {2}".format(name, _labels(labels), hist["count"]))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = renderPrometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def startMetricsServer(port=metrics_port):
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def timelinePath(root_id):
+    return os.path.join(timeline_root, str(root_id), 'timeline.json')
+
+
+def appendTimeline(root_id, event):
+    """
+    Append a task event to geo_tasks/<root_id>/timeline.json when the workflow
+    result directory exists. Tasks of a chord may finish in several processes at once.
+    """
+    path = timelinePath(root_id)
+    if not root_id or not os.path.isdir(os.path.dirname(path)):
+        return
+    with open("{0}.lock".format(path), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            timeline = {"root_id": str(root_id), "tasks": []}
+            if os.path.exists(path):
+                with open(path) as f:
+                    timeline = json.load(f)
+            timeline["tasks"].append(event)
+            timeline["elapsed"] = max(itm["end"] for itm in timeline["tasks"]) - \
+                min(itm["start"] for itm in timeline["tasks"])
+            tmp = "{0}.{1}.tmp".format(path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(timeline, f, indent=2)
+            os.replace(tmp, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@task_prerun.connect
+def taskStarted(task_id=None, task=None, **kwargs):
+    _current.set({"stage": task.name.split('.')[-1], "task_id": task_id,
+                  "root_id": getattr(task.request, 'root_id', None) or task_id,
+                  "start": time.time(), "calls": {}, "outer": _current.get()})
+
+
+@task_postrun.connect
+def taskFinished(task_id=None, task=None, state=None, **kwargs):
+    current = _current.get()
+    if current is None or current["task_id"] != task_id:
+        return
+    end = time.time()
+    duration = end - current["start"]
+    registry.observe("geoblacklightq_task_duration_seconds", duration,
+                     task=current["stage"], state=state or "UNKNOWN")
+    event = {"task": current["stage"], "task_id": task_id, "state": state,
+             "start": current["start"], "end": end, "duration": duration,
+             "pid": os.getpid(), "calls": current["calls"]}
+    root_id = current["root_id"]
+    _current.set(current["outer"])
+    try:
+        appendTimeline(root_id, event)
+        flushMetrics()
+    except (OSError, ValueError):
+        # metrics never fail a task
+        pass
+
+
+@worker_process_init.connect
+def resetMetrics(**kwargs):
+    registry.clear()
+    _current.set(None)
+    _last_flush[0] = 0.0
+    # timer threads are not inherited by forked pool processes
+    _flush_timer[0] = None
+
+
+@worker_process_shutdown.connect
+def removeMetrics(**kwargs):
+    """
+    Histograms of a process that exits leave the merged series (Prometheus
+    treats the drop as a counter reset).
+    """
+    try:
+        os.remove(os.path.join(nodeDir(), "{0}.json".format(os.getpid())))
+    except OSError:
+        pass
+
+
+@celeryd_init.connect
+def workerNode(sender=None, **kwargs):
+    _node[0] = sender
+
+
+@worker_ready.connect
+def serveMetrics(**kwargs):
+    """
+    Start the scrape endpoint in the main worker process.
+    Snapshots of processes of this worker that are gone are removed first.
+    Metrics are not served when METRICS_PORT is taken (another worker on this host).
+    """
+    if not metrics_port:
+        return
+    for path in glob.glob(os.path.join(nodeDir(), '*.json')):
+        pid = os.path.basename(path)[:-len('.json')]
+        if not pid.isdigit() or not processAlive(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    try:
+        startMetricsServer(metrics_port)
+    except OSError as inst:
+        print("Metrics not served on port {0}: {1}. Set METRICS_PORT per worker.".format(
+            metrics_port, inst))
@@ -0,0 +1,168 @@
+from subprocess import run, PIPE, STDOUT
+from .geoheaders import readTiffProfile
+import glob
+import os
+import shutil
+import struct
+import time
+
+raster_optimize = os.getenv('RASTER_OPTIMIZE', 'true').lower() in ['true', '1', 'yes']
+# Rasters with fewer pixels are published as uploaded
+raster_optimize_min_pixels = int(os.getenv('RASTER_OPTIMIZE_MIN_PIXELS', 4096 * 4096))
+# Rasters larger than this (bytes) are published as an ImagePyramid store
+raster_pyramid_min_bytes = int(os.getenv('RASTER_PYRAMID_MIN_BYTES', 4 * 1024 ** 3))
+raster_compression = os.getenv('RASTER_COMPRESSION', 'DEFLATE')
+raster_tile_size = int(os.getenv('RASTER_TILE_SIZE', 512))
+# Overviews are added until the smallest level fits in this many pixels
+raster_overview_min_size = int(os.getenv('RASTER_OVERVIEW_MIN_SIZE', 256))
+raster_extensions = ['.tif', '.tiff']
+
+
+def rasterIssues(profile):
+    """
+    Storage choices that slow down GeoServer rendering of a raster.
+    """
+    issues = []
+    if not profile["tiled"]:
+        issues.append("untiled")
+    if profile["compression"] == 'none':
+        issues.append("uncompressed")
+    if not profile["overviews"]:
+        issues.append("no_overviews")
+    if profile["planar"] == 'separate':
+        issues.append("planar_separate")
+    return issues
+
+
+def rasterGrade(issues):
+    return "ABCD"[min(len(issues), 3)]
+
+
+def overviewLevels(width, height, min_size=raster_overview_min_size):
+    levels = []
+    factor = 2
+    while max(width, height) / factor >= min_size:
+        levels.append(factor)
+        factor = factor * 2
+    return levels or [2]
+
+
+def gdalTool(name):
+    return shutil.which(name) or shutil.which(name + '.py')
+
+
+def rasterPreflight(filename):
+    """
+    Read the TIFF layout and decide how the raster is published.
+    Returns:
+        dict: profile, issues, grade (A best - D), route (direct, tiled or pyramid), reason
+    """
+    result = {"file": filename, "profile": None, "issues": [], "grade": None,
+              "route": "direct", "reason": None}
+    if os.path.splitext(filename)[1].lower() not in raster_extensions:
+        result["reason"] = "Not a TIFF"
+        return result
+    try:
+        profile = readTiffProfile(filename)
+    except (OSError, ValueError, KeyError, IndexError, struct.error) as inst:
+        result["reason"] = "Unreadable TIFF header: {0}".format(inst)
+        return result
+    issues = rasterIssues(profile)
+    result.update({"profile": profile, "issues": issues, "grade": rasterGrade(issues)})
+    if not issues:
+        result["reason"] = "Raster layout is fine for publishing"
+    elif profile["width"] * profile["height"] < raster_optimize_min_pixels:
+        result["reason"] = "Small raster: published as uploaded"
+    elif not raster_optimize:
+        result["reason"] = "Raster optimization disabled (RASTER_OPTIMIZE)"
+    elif profile["size"] >= raster_pyramid_min_bytes and gdalTool('gdal_retile'):
+        result["route"] = "pyramid"
+        result["reason"] = "Large raster: ImagePyramid store"
+    elif gdalTool('gdal_translate') and gdalTool('gdaladdo'):
+        result["route"] = "tiled"
+        result["reason"] = "Rewrite as internally tiled GeoTIFF with overviews"
+    else:
+        result["reason"] = "GDAL command line tools not available"
+    return result
+
+
+def runCommand(args):
+    proc = run(args, stdout=PIPE, stderr=STDOUT)
+    if proc.returncode:
+        raise Exception("{0} failed: {1}".format(
+            os.path.basename(args[0]), proc.stdout.decode('utf-8', 'replace')[-1000:]))
+    return args
+
+
+def optimizeGeoTiff(filename, destination):
+    """
+    Internally tiled, compressed copy of filename with internal overviews.
+    """
+    profile = readTiffProfile(filename)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp = "{0}.tmp.tif".format(destination)
+    commands = [runCommand([gdalTool('gdal_translate'), '-q', '-of', 'GTiff',
+                            '-co', 'TILED=YES',
+                            '-co', 'BLOCKXSIZE={0}'.format(raster_tile_size),
+                            '-co', 'BLOCKYSIZE={0}'.format(raster_tile_size),
+                            '-co', 'COMPRESS={0}'.format(raster_compression),
+                            '-co', 'BIGTIFF=IF_SAFER', filename, tmp])]
+    levels = overviewLevels(profile["width"], profile["height"])
+    commands.append(runCommand([gdalTool('gdaladdo'), '-q', '-r', 'average',
+                                '--config', 'COMPRESS_OVERVIEW', raster_compression, tmp] +
+                               [str(level) for level in levels]))
+    os.replace(tmp, destination)
+    return commands
+
+
+def buildPyramid(filename, destination):
+    """
+    ImagePyramid layout for GeoServer: destination/0 holds full resolution
+    tiles, destination/1..n the reduced levels.
+    """
+    profile = readTiffProfile(filename)
+    levels = len(overviewLevels(profile["width"], profile["height"],
+                                min_size=raster_tile_size * 4))
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.makedirs(destination)
+    commands = [runCommand([gdalTool('gdal_retile'), '-q', '-r', 'bilinear',
+                            '-levels', str(levels),
+                            '-ps', str(raster_tile_size * 4), str(raster_tile_size * 4),
+                            '-co', 'TILED=YES', '-co', 'COMPRESS={0}'.format(raster_compression),
+                            '-targetDir', destination, filename])]
+    base = os.path.join(destination, '0')
+    os.makedirs(base)
+    for tile in glob.glob(os.path.join(destination, '*.tif')):
+        shutil.move(tile, base)
+    return commands
+
+
+def optimizeRaster(filename, preflight):
+    """
+    Apply the preflight route before publishing.
+    Output keeps the file stem so the coverage name does not change:
+        tiled: <folder>/_optimized/<name>.tif, pyramid: <folder>/_pyramid/<stem>/
+    Returns:
+        dict: preflight with publish (path to publish), store_type, commands,
+            elapsed and error. Errors fall back to publishing the original file.
+    """
+    result = dict(preflight)
+    result.update({"publish": filename, "store_type": "GeoTIFF", "commands": [], "error": None})
+    folder, name = os.path.split(filename)
+    start = time.time()
+    try:
+        if preflight["route"] == "tiled":
+            destination = os.path.join(folder, '_optimized', name)
+            result["commands"] = optimizeGeoTiff(filename, destination)
+            result["publish"] = destination
+        elif preflight["route"] == "pyramid":
+            destination = os.path.join(folder, '_pyramid', os.path.splitext(name)[0])
+            result["commands"] = buildPyramid(filename, destination)
+            result["publish"] = destination
+            result["store_type"] = "ImagePyramid"
+    except Exception as inst:
+        result["error"] = str(inst)
+        result["route"] = "direct"
+    result["elapsed"] = time.time() - start
+    return result
@@ -0,0 +1,72 @@
+from celery import current_task
+import os
+
+# Workflow stages are sent to a queue by the kind of work they do. CPU_QUEUE is
+# meant for a small prefork pool, IO_QUEUE for a high concurrency gevent/eventlet
+# or threads pool. A class without a queue stays on the caller's queue.
+queues = {"cpu": os.getenv('CPU_QUEUE', ''), "io": os.getenv('IO_QUEUE', '')}
+# Disk and CPU bound: extraction, header reads, raster preflight/optimization and XML
+# parsing, and the batch lane stages doing them.
+cpu_stages = ['unzip', 'determineTypeBounds', 'optimizeRasters', 'configureGeoData',
+              'crossWalkChunk', 'batchUnzip', 'batchMetadata']
+# Waiting on GeoServer, Solr, ARK or catalog requests
+io_stages = ['dataLoadGeoserver', 'reuseGeoserverStore', 'crossWalkGeoBlacklight',
+             'recordIngest', 'reuseIngest', 'publishLayers', 'loadLayer', 'layersLoaded',
+             'batchPublish', 'batchCrosswalk', 'batchIngestSummary', 'batchCrossWalkResults',
+             'solrDeleteIndex', 'solrIndexItems', 'solrStreamIndexItems',
+             'solrCreateRebuildIndex', 'solrCheckRebuild', 'solrWarmIndex', 'solrSwapIndex',
+             'refillArkPool', 'finalizeArks']
+
+
+def parseStages(value):
+    """
+    Stage class overrides: STAGE_QUEUES="loadLayer=cpu,unzip=io"
+    """
+    stages = {}
+    for itm in value.split(','):
+        if '=' in itm:
+            stage, kind = itm.split('=', 1)
+            stages[stage.strip()] = kind.strip()
+    return stages
+
+
+stage_classes = dict([(stage, 'cpu') for stage in cpu_stages] +
+                     [(stage, 'io') for stage in io_stages])
+stage_classes.update(parseStages(os.getenv('STAGE_QUEUES', '')))
+
+
+def stageName(task):
+    name = task if isinstance(task, str) else task.name
+    return name.split('.')[-1]
+
+
+def stageQueue(task, default=None):
+    """
+    Queue of a workflow stage (task or task name). Returns default, the
+    caller's routing key, when the stage class has no queue configured.
+    """
+    return queues.get(stage_classes.get(stageName(task))) or default
+
+
+def routed(signature, default):
+    """
+    Set the queue of a workflow signature by its stage class.
+    """
+    return signature.set(queue=stageQueue(signature.task, default))
+
+
+def callerQueue():
+    """
+    Routing key of the task running in this worker, None outside a task.
+    """
+    request = getattr(current_task, 'request', None)
+    return (getattr(request, 'delivery_info', None) or {}).get('routing_key')
+
+
+def queueOptions(task):
+    """
+    apply_async options of a task sent outside a workflow: its stage queue,
+    otherwise the queue of the task sending it.
+    """
+    queue = stageQueue(task) or callerQueue()
+    return {"queue": queue} if queue else {}
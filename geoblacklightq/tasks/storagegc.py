@@ -0,0 +1,263 @@
+from celery import Celery
+import celeryconfig
+from contextlib import contextmanager
+from .clients import getCatalog
+from .tasks import solrIterate, solr_index
+from .workflow import catalogPages, wwwdir
+from .geotransmeta import tmpdir, datasetsdir
+from .geoservertasks import deleteGeoserverStore, getWorkspace, layerStoreName, workspace
+from .ingestindex import ingestEntries
+from .metrics import timed
+import fcntl
+import json
+import os
+import shutil
+import time
+
+app = Celery()
+app.config_from_object(celeryconfig)
+
+# Storage garbage collector: orphans younger than GC_MIN_AGE seconds are kept
+# (ingests in progress publish to GeoServer before the record reaches Solr)
+gc_min_age = int(os.getenv('GC_MIN_AGE', 7 * 86400))
+# Orphans are reclaimed GC_BATCH_SIZE at a time with GC_BATCH_DELAY seconds between batches
+gc_batch_size = int(os.getenv('GC_BATCH_SIZE', 10))
+gc_batch_delay = float(os.getenv('GC_BATCH_DELAY', 5))
+# When GeoServer stores were first seen orphaned (stores carry no creation date)
+gc_state_file = os.getenv('GC_STATE_FILE', "/data/static/geo_tasks/storage_gc.json")
+results_dir = os.path.join(wwwdir, 'geo_tasks')
+# Record fields that reference stores
+reference_fields = ['layer_id_s']
+
+
+@contextmanager
+def gcState():
+    """
+    Exclusive access to the GC state file. Yields {"seen": {store: timestamp}}.
+    """
+    os.makedirs(os.path.dirname(gc_state_file), exist_ok=True)
+    with open("{0}.lock".format(gc_state_file), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = {"seen": {}}
+            if os.path.exists(gc_state_file):
+                with open(gc_state_file) as f:
+                    state.update(json.load(f))
+            yield state
+            tmp = "{0}.{1}.tmp".format(gc_state_file, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, gc_state_file)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def treeUsage(path):
+    """
+    Bytes used by path and the newest modification time within it.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path), os.path.getmtime(path)
+    size, newest = 0, os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            newest = max(newest, stat.st_mtime)
+            if name in files:
+                size = size + stat.st_size
+    return size, newest
+
+
+def storeDataPath(url):
+    """
+    Local path of a store url (file:...) written by dataLoadGeoserver, or None.
+    """
+    if not url or not url.startswith('file:'):
+        return None
+    path = '/' + url[len('file:'):].lstrip('/')
+    for candidate in [path, path.replace('geoportal_data', 'geoserver-data', 1)]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def recordReferences(record, stores):
+    """
+    Add the store (layer_id_s) a Solr or catalog record points at.
+    """
+    if record.get('layer_id_s'):
+        stores.add(str(record['layer_id_s']).split(':')[-1])
+
+
+def referencedStorage():
+    """
+    Stores referenced by the Solr index, the catalog API and the ingest index,
+    and result directories referenced by the ingest index. Records do not link
+    result directories: the ingest index is their only reference. Errors are
+    raised: nothing is reclaimed on incomplete information.
+    """
+    stores, results = set(), set()
+    for doc in solrIterate(fl=reference_fields, solr_index=solr_index):
+        recordReferences(doc, stores)
+    for page in catalogPages(query={"projection": {"_id": 0, "style": 0}}):
+        for record in page:
+            recordReferences(record, stores)
+    ingested = {}
+    for entry in ingestEntries():
+        if entry.get('resultDir'):
+            # geo_tasks/<task_id> or geo_tasks/<batch_id>/<name>
+            path = os.path.relpath(os.path.abspath(entry['resultDir']), results_dir)
+            if not path.startswith(os.pardir):
+                results.add(path.split(os.sep)[0])
+        for store in [entry.get('store')] + entry.get('stores', []):
+            if store:
+                ingested[store] = entry.get('ingested') or 0
+    return {"stores": stores, "results": results, "ingested": ingested}
+
+
+def orphanStores(referenced, now, ws_name=workspace):
+    """
+    GeoServer stores of ws_name whose layers are not in Solr or the catalog.
+    Age comes from the ingest index or from when the store was first seen orphaned.
+    Returns:
+        (list, list): orphans {kind, name, type, path, size, age}, names of referenced stores
+    """
+    cat = getCatalog()
+    ws = getWorkspace(cat, ws_name)
+    with timed('get_stores'):
+        stores = cat.get_stores(workspace=ws)
+    orphans, kept = [], []
+    with gcState() as state:
+        seen = {}
+        for store in stores:
+            if store.name in referenced["stores"]:
+                kept.append(store.name)
+                continue
+            seen[store.name] = state["seen"].get(store.name, now)
+            try:
+                path = storeDataPath(getattr(store, 'url', None))
+            except Exception:
+                path = None
+            size = treeUsage(path)[0] if path else None
+            created = min(seen[store.name], referenced["ingested"].get(store.name, now))
+            orphans.append({"kind": "store", "name": store.name,
+                            "type": getattr(store, 'resource_type', None),
+                            "path": path, "size": size, "age": now - created})
+        # stores that were referenced again or deleted are forgotten
+        state["seen"] = seen
+    return orphans, kept
+
+
+def datasetFolders():
+    """
+    Folders extracted by unzip: a TMPDIR folder with an archive of the same name in DATASETS_DIR.
+    """
+    if not os.path.isdir(tmpdir):
+        return []
+    return [name for name in sorted(os.listdir(tmpdir))
+            if os.path.isdir(os.path.join(tmpdir, name)) and
+            os.path.isfile(os.path.join(datasetsdir, "{0}.zip".format(name)))]
+
+
+def folderInUse(name, stores):
+    """
+    True when a GeoServer store was published from the extracted folder
+    (store <folder> or <folder>_<layer> of a multi-layer dataset).
+    """
+    store_name = layerStoreName(name)
+    return any(store == store_name or store.startswith(store_name + '_') for store in stores)
+
+
+def orphanDirectories(referenced, kept, now):
+    """
+    Extracted dataset folders without a remaining store and result
+    directories no record or ingest index entry points at.
+    """
+    orphans = []
+    for name in datasetFolders():
+        if folderInUse(name, kept):
+            continue
+        path = os.path.join(tmpdir, name)
+        size, newest = treeUsage(path)
+        orphans.append({"kind": "folder", "name": name, "path": path,
+                        "size": size, "age": now - newest})
+    if os.path.isdir(results_dir):
+        for name in sorted(os.listdir(results_dir)):
+            path = os.path.join(results_dir, name)
+            if not os.path.isdir(path) or name in referenced["results"]:
+                continue
+            size, newest = treeUsage(path)
+            orphans.append({"kind": "result", "name": name, "path": path,
+                            "size": size, "age": now - newest})
+    return orphans
+
+
+def reclaim(item, ws_name=workspace):
+    try:
+        if item["kind"] == "store":
+            item["msg"] = deleteGeoserverStore(item["name"], workspace=ws_name, purge='all')
+        else:
+            shutil.rmtree(item["path"])
+            item["msg"] = "Removed {0}".format(item["path"])
+        item["status"] = "RECLAIMED"
+    except Exception as inst:
+        item["status"] = "FAILURE"
+        item["msg"] = "{0}: {1}".format(type(inst).__name__, inst)
+    return item
+
+
+@app.task()
+def reclaimStorage(dry_run=True, min_age=gc_min_age, batch_size=gc_batch_size,
+                   batch_delay=gc_batch_delay, workspace=workspace):
+    """
+    Find and remove orphaned storage: GeoServer stores whose layers never reached
+    Solr or the catalog, extracted dataset folders under TMPDIR and workflow
+    result directories under geo_tasks.
+    Stores are removed first (deleteGeoserverStore, data purged) so the folders
+    of rasters published from TMPDIR are reclaimed in the same run.
+    kwargs:
+        dry_run (boolean): report orphans without removing anything
+        min_age (int): seconds an orphan has to be unused before it is removed
+        batch_size (int): orphans removed per batch
+        batch_delay (float): seconds between batches
+        workspace (string): GeoServer workspace
+    Returns:
+        dict: orphans (kind, name, path, size, age, status, msg), counts by
+            status and the bytes reclaimed (or reclaimable with dry_run)
+            status: RECLAIMED, FAILURE, RECENT (younger than min_age) or DRY_RUN
+    """
+    now = time.time()
+    referenced = referencedStorage()
+    stores, kept = orphanStores(referenced, now, workspace)
+    recent = [itm["name"] for itm in stores if itm["age"] < min_age]
+    # raster folders of stores that stay are still in use
+    directories = orphanDirectories(referenced, kept + recent, now)
+    orphans = stores + directories
+    pending = []
+    for itm in orphans:
+        if itm["age"] < min_age:
+            itm.update({"status": "RECENT", "msg": "Younger than {0} seconds".format(min_age)})
+        elif dry_run:
+            itm.update({"status": "DRY_RUN", "msg": ""})
+        else:
+            pending.append(itm)
+    failed = []
+    for start in range(0, len(pending), max(batch_size, 1)):
+        if start:
+            time.sleep(batch_delay)
+        for itm in pending[start:start + max(batch_size, 1)]:
+            if itm["kind"] == "folder" and folderInUse(itm["name"], failed):
+                itm.update({"status": "FAILURE", "msg": "GeoServer store was not removed"})
+                continue
+            if reclaim(itm, workspace)["status"] == "FAILURE" and itm["kind"] == "store":
+                failed.append(itm["name"])
+    counts = {}
+    for itm in orphans:
+        counts[itm["status"]] = counts.get(itm["status"], 0) + 1
+    status = "DRY_RUN" if dry_run else "RECLAIMED"
+    return {"dry_run": dry_run, "min_age": min_age, "counts": counts,
+            "bytes": sum(itm["size"] or 0 for itm in orphans if itm["status"] == status),
+            "orphans": orphans}
@@ -1,9 +1,12 @@
 from celery import Celery
 import celeryconfig
 from subprocess import call, STDOUT
-import requests
+from .clients import getSession
+from .cache import TTLCache
 import json
 import os
+import time
+import hashlib
 from requests import exceptions
 
 app = Celery()
@@ -16,6 +19,18 @@ solr_index = os.getenv('SOLR_INDEX', 'geoblacklight')
 solr_connection = os.getenv(
     'GEO_SOLR_URL', "http://geoblacklight_solr:8983/solr")
 #solr_connection = "http://geoblacklight_solr:8983/solr"
+# Rebuild mode: 'core' (standalone CoreAdmin SWAP) or 'cloud' (collection alias)
+solr_mode = os.getenv('SOLR_MODE', 'core')
+# Config set of a rebuild core/collection (standalone: $SOLR_HOME/configsets/<name>)
+solr_configset = os.getenv('SOLR_CONFIGSET', solr_index)
+# Solr uniqueKey of the GeoBlacklight schema and field holding the document fingerprint
+solr_unique_key = os.getenv('SOLR_UNIQUE_KEY', 'layer_slug_s')
+solr_fingerprint_field = os.getenv('SOLR_FINGERPRINT_FIELD', 'geoblacklightq_fingerprint_s')
+# Per worker process cache of solrSearch responses keyed on the normalized query
+search_cache = TTLCache(maxsize=int(os.getenv('SOLR_SEARCH_CACHE_SIZE', 256)),
+                        ttl=int(os.getenv('SOLR_SEARCH_CACHE_TTL', 60)))
+# Characters with a meaning in the Solr standard query parser
+solr_special_chars = '\\+-!():^[]"{}~*?|&/ '
 
 # Example task
 @app.task()
@@ -39,7 +54,7 @@ def solrIndexSampleData(catalog_collection='geoblacklight', solr_index=solr_inde
     #data = r.json()
     headers = {'Content-Type': 'application/json'}
     url = "{0}/{1}/update?commit=true".format(solr_connection, solr_index)
-    sr = requests.post(url, data=data, headers=headers)
+    sr = getSession('solr').post(url, data=data, headers=headers)
     return {"status": sr.status_code, "url": url, "response": sr.json()}
     #solr = pysolr.Solr(solr_connection, timeout=10)
 
@@ -53,7 +68,8 @@ def solrDeleteIndex(solr_index=solr_index):
     headers = {'Content-Type': 'text/xml'}
     url = "{0}/{1}/update?commit=true".format(solr_connection, solr_index)
     data = '<delete><query>*:*</query></delete>'
-    sr = requests.post(url, data, headers=headers)
+    sr = getSession('solr').post(url, data, headers=headers)
+    search_cache.invalidate('search', solr_index)
     return {"status": sr.status_code, "url": url, "response": sr.text}
 
 
@@ -64,16 +80,333 @@ def solrIndexItems(items, solr_index=solr_index):
     """
     headers = {'Content-Type': 'application/json'}
     url = "{0}/{1}/update?commit=true".format(solr_connection, solr_index)
+    items = [fingerprintedDocument(itm) for itm in items]
     #results =[]
     # for itm in items:
-    sr = requests.post(url, json=items, headers=headers)
+    sr = getSession('solr').post(url, json=items, headers=headers)
+    search_cache.invalidate('search', solr_index)
     #results.append({"status":sr.status_code,"url":url,"response": sr.json()})
     return {"status": sr.status_code, "url": url, "response": sr.json()}
 
 
+def solrPostBatch(items, solr_index=solr_index, commitWithin=None):
+    """
+    Post a single batch of items to the Solr update handler.
+    No hard commit is issued. Documents become visible through
+    commitWithin (milliseconds) or a later call to solrCommit.
+    Returns:
+        dict with status, number of docs, elapsed seconds and Solr response
+    """
+    headers = {'Content-Type': 'application/json'}
+    url = "{0}/{1}/update".format(solr_connection, solr_index)
+    params = {}
+    if commitWithin:
+        params['commitWithin'] = commitWithin
+    start = time.time()
+    try:
+        sr = getSession('solr').post(url, json=items, params=params, headers=headers)
+        response = sr.json()
+        status = sr.status_code
+    except (exceptions.RequestException, ValueError) as inst:
+        response = str(inst)
+        status = None
+    return {"status": status, "docs": len(items), "elapsed": time.time() - start,
+            "success": status == 200, "response": response}
+
+
+def fingerprintDocument(doc):
+    """
+    Stable hash of the fields sent to Solr (fingerprint field excluded).
+    """
+    fields = dict((key, value) for key, value in doc.items()
+                  if key != solr_fingerprint_field)
+    body = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def fingerprintedDocument(doc):
+    """
+    Copy of doc with its fingerprint field set. Every indexing path stores it
+    so syncSolrIndex only rewrites documents that changed.
+    """
+    doc = dict((key, value) for key, value in doc.items() if key != solr_fingerprint_field)
+    doc[solr_fingerprint_field] = fingerprintDocument(doc)
+    return doc
+
+
+def solrIterate(q='*:*', fl=None, fq=None, sort=None, rows=1000, solr_index=solr_index):
+    """
+    Generator over every matching Solr document using cursorMark deep paging.
+    Holds one page in memory. The uniqueKey is added to sort as tie breaker.
+    """
+    url = "{0}/{1}/select".format(solr_connection, solr_index)
+    params = searchParams(q, rows=rows, fl=fl, sort=sort, fq=fq, cursorMark='*')
+    while True:
+        sr = getSession('solr').get(url, params=params)
+        sr.raise_for_status()
+        data = sr.json()
+        for doc in data['response']['docs']:
+            yield doc
+        if data['nextCursorMark'] == params['cursorMark']:
+            break
+        params['cursorMark'] = data['nextCursorMark']
+
+
+def solrDeleteIds(ids, solr_index=solr_index, commitWithin=None):
+    """
+    Delete documents by uniqueKey without a hard commit.
+    """
+    headers = {'Content-Type': 'application/json'}
+    url = "{0}/{1}/update".format(solr_connection, solr_index)
+    params = {'commitWithin': commitWithin} if commitWithin else {}
+    sr = getSession('solr').post(url, json={"delete": ids}, params=params, headers=headers)
+    return {"status": sr.status_code, "docs": len(ids), "success": sr.status_code == 200}
+
+
 @app.task()
-def solrSearch(query, solr_index=solr_index):
+def solrCommit(solr_index=solr_index, softCommit=False):
+    """
+    Issue a commit to the Solr index.
+    kwargs:
+        solr_index='geoblacklight'
+        softCommit(boolean): soft commit opens a new searcher without fsync
+    """
     headers = {'Content-Type': 'application/json'}
-    url = "{0}/{1}/select?q={2}".format(solr_connection, solr_index, query)
-    sr = requests.get(url, headers=headers)
-    return sr.json()
+    url = "{0}/{1}/update".format(solr_connection, solr_index)
+    params = {'softCommit': 'true'} if softCommit else {'commit': 'true'}
+    sr = getSession('solr').post(url, json={}, params=params, headers=headers)
+    search_cache.invalidate('search', solr_index)
+    return {"status": sr.status_code, "url": url, "response": sr.json()}
+
+
+def solrAdmin(api, params):
+    """
+    Call the Solr CoreAdmin ('cores') or Collections ('collections') API.
+    Raises exception if Solr reports a failure.
+    """
+    url = "{0}/admin/{1}".format(solr_connection, api)
+    params = dict(params, wt='json')
+    sr = getSession('solr').get(url, params=params)
+    data = sr.json()
+    if sr.status_code >= 400 or data.get('responseHeader', {}).get('status', 0) != 0:
+        raise Exception("Solr {0} {1} failed: {2}".format(
+            api, params.get('action'), sr.text))
+    return data
+
+
+@app.task()
+def solrCreateRebuildIndex(name, solr_index=solr_index):
+    """
+    Create an empty core (standalone) or collection (SolrCloud) from
+    SOLR_CONFIGSET to build a new index without touching the live index.
+    Standalone cores get their own instanceDir: Solr refuses to create a
+    core in the instanceDir of the live core.
+    args:
+        name (string): name of the rebuild core/collection
+    kwargs:
+        solr_index (string): live core or alias the rebuild replaces
+    """
+    if solr_mode == 'cloud':
+        solrAlias(solr_index)
+        solrAdmin('collections', {'action': 'CREATE', 'name': name, 'numShards': 1,
+                                  'collection.configName': solr_configset})
+    else:
+        solrAdmin('cores', {'action': 'CREATE', 'name': name, 'instanceDir': name,
+                            'configSet': solr_configset})
+    return {"mode": solr_mode, "name": name, "configset": solr_configset,
+            "solr_index": solr_index}
+
+
+def solrAlias(solr_index):
+    """
+    Collection behind the alias solr_index (None before the first rebuild).
+    A collection named solr_index cannot become an alias: it has to be moved
+    behind one first (see README).
+    """
+    aliases = solrAdmin('collections', {'action': 'LISTALIASES'}).get('aliases', {})
+    if solr_index in aliases:
+        return aliases[solr_index]
+    collections = solrAdmin('collections', {'action': 'LIST'}).get('collections', [])
+    if solr_index in collections:
+        raise Exception("{0} is a collection, not an alias. Move it behind an "
+                        "alias before a rebuild (see README).".format(solr_index))
+    return None
+
+
+@app.task()
+def solrCheckRebuild(load, name, expected=None):
+    """
+    Stop a rebuild before its swap when a batch failed or the rebuilt index
+    holds fewer documents than the source.
+    args:
+        load (dict): result of solrStreamIndexItems or solrIndexItems
+        name (string): rebuild core/collection
+    kwargs:
+        expected (int): source document count (default load["expected"])
+    """
+    if load.get("failed_batches"):
+        raise Exception("Rebuild {0}: batches {1} failed. Swap aborted.".format(
+            name, load["failed_batches"]))
+    if (load.get("status") or 200) >= 400:
+        raise Exception("Rebuild {0}: indexing failed with status {1}. Swap aborted.".format(
+            name, load["status"]))
+    if expected is None:
+        expected = load.get("expected") or 0
+    url = "{0}/{1}/select".format(solr_connection, name)
+    numFound = getSession('solr').get(url, params={'q': '*:*', 'rows': 0, 'wt': 'json'}).json()[
+        'response']['numFound']
+    if numFound < expected:
+        raise Exception("Rebuild {0} has {1} of {2} documents. Swap aborted.".format(
+            name, numFound, expected))
+    return {"name": name, "numFound": numFound, "expected": expected}
+
+
+@app.task()
+def solrWarmIndex(name, queries=None):
+    """
+    Warm a rebuilt index with typical portal queries before it goes live.
+    Returns number of documents and the time of each warming query.
+    """
+    if not queries:
+        queries = [{'q': '*:*', 'rows': 10},
+                   {'q': '*:*', 'rows': 10, 'sort': 'dc_title_s asc'},
+                   {'q': '*:*', 'rows': 0, 'facet': 'true',
+                    'facet.field': ['dct_provenance_s', 'dc_format_s', 'layer_geom_type_s',
+                                    'dc_subject_sm', 'dct_spatial_sm', 'dc_publisher_s']}]
+    url = "{0}/{1}/select".format(solr_connection, name)
+    timings = []
+    numFound = 0
+    for query in queries:
+        sr = getSession('solr').get(url, params=dict(query, wt='json'))
+        data = sr.json()
+        numFound = data.get('response', {}).get('numFound', numFound)
+        timings.append({"status": sr.status_code,
+                        "QTime": data.get('responseHeader', {}).get('QTime')})
+    return {"name": name, "numFound": numFound, "queries": timings}
+
+
+@app.task()
+def solrSwapIndex(name, solr_index=solr_index, drop_old=True, min_docs=1):
+    """
+    Atomically point solr_index at the rebuilt core/collection.
+    Standalone: CoreAdmin SWAP then UNLOAD the old index.
+    SolrCloud: CREATEALIAS solr_index then DELETE the collection
+        previously behind the alias (solr_index must be an alias or unused).
+    kwargs:
+        drop_old (boolean): remove the previous index after the swap
+        min_docs (int): refuse to swap if rebuilt index holds fewer documents
+    """
+    url = "{0}/{1}/select".format(solr_connection, name)
+    numFound = getSession('solr').get(url, params={'q': '*:*', 'rows': 0, 'wt': 'json'}).json()[
+        'response']['numFound']
+    if numFound < min_docs:
+        raise Exception("Rebuilt index {0} has {1} documents. Swap aborted.".format(
+            name, numFound))
+    old = None
+    if solr_mode == 'cloud':
+        old = solrAlias(solr_index)
+        solrAdmin('collections', {'action': 'CREATEALIAS', 'name': solr_index,
+                                  'collections': name})
+        if drop_old and old and old != name:
+            solrAdmin('collections', {'action': 'DELETE', 'name': old})
+    else:
+        solrAdmin('cores', {'action': 'SWAP', 'core': solr_index, 'other': name})
+        # After SWAP the rebuild name points to the previous index data
+        old = name
+        if drop_old:
+            solrAdmin('cores', {'action': 'UNLOAD', 'core': name, 'deleteIndex': 'true',
+                                'deleteDataDir': 'true'})
+    search_cache.invalidate('search', solr_index)
+    return {"mode": solr_mode, "solr_index": solr_index, "live": name if solr_mode == 'cloud' else solr_index,
+            "numFound": numFound, "previous": old, "dropped": bool(drop_old and old)}
+
+
+def solrEscape(value):
+    """
+    Escape query syntax in value (e.g. user input) so Solr matches it literally:
+        'dc_title_s:{0}'.format(solrEscape('Roads (2010)'))
+    """
+    return ''.join('\\' + char if char in solr_special_chars else char for char in str(value))
+
+
+def cursorSort(sort=None):
+    """
+    Sort of a cursorMark request. cursorMark requires the uniqueKey as tie breaker.
+    """
+    if not sort:
+        return "{0} asc".format(solr_unique_key)
+    fields = [part.split()[0] for part in sort.split(',') if part.strip()]
+    if solr_unique_key not in fields:
+        sort = "{0},{1} asc".format(sort, solr_unique_key)
+    return sort
+
+
+def searchParams(q='*:*', rows=None, start=None, fl=None, sort=None, fq=None, facets=None,
+                 facet_limit=None, cursorMark=None):
+    """
+    Solr select parameters. Field, filter and facet lists are sorted so the same
+    query always gives the same parameters (result cache key).
+    """
+    params = {'q': str(q).strip() or '*:*', 'wt': 'json'}
+    if rows is not None:
+        params['rows'] = int(rows)
+    if cursorMark:
+        params['cursorMark'] = cursorMark
+        params['sort'] = cursorSort(sort)
+    else:
+        if start:
+            params['start'] = int(start)
+        if sort:
+            params['sort'] = sort
+    if fl:
+        params['fl'] = ','.join(sorted(fl)) if isinstance(fl, (list, tuple)) else fl
+    if fq:
+        params['fq'] = sorted(fq) if isinstance(fq, (list, tuple)) else fq
+    if facets:
+        params.update({'facet': 'true', 'facet.mincount': 1,
+                       'facet.field': sorted(facets) if isinstance(facets, (list, tuple)) else facets})
+        if facet_limit is not None:
+            params['facet.limit'] = int(facet_limit)
+    return params
+
+
+@app.task()
+def solrSearch(query='*:*', solr_index=solr_index, rows=None, start=None, fl=None, sort=None,
+               fq=None, facets=None, facet_limit=None, cursorMark=None, cache=True):
+    """
+    Search the Solr index. Parameters are URL encoded; use solrEscape for
+    values inside query.
+    kwargs:
+        rows, start, sort: paging (Solr default is 10 rows)
+        fl (list): fields returned
+        fq (string or list): filter queries
+        facets (list): facet fields (facet.mincount 1, facet_limit values each)
+        cursorMark (string): deep paging, '*' for the first page. Pass the
+            nextCursorMark of the response to get the next page.
+        cache (boolean): use the per worker result cache (SOLR_SEARCH_CACHE_TTL)
+    returns:
+        Solr response
+    """
+    params = searchParams(query, rows=rows, start=start, fl=fl, sort=sort, fq=fq, facets=facets,
+                          facet_limit=facet_limit, cursorMark=cursorMark)
+    key = ('search', solr_index, json.dumps(params, sort_keys=True))
+    data = search_cache.get(key) if cache else None
+    if data is None:
+        url = "{0}/{1}/select".format(solr_connection, solr_index)
+        sr = getSession('solr').get(url, params=params)
+        data = sr.json()
+        # errors are returned, never cached
+        if cache and sr.status_code == 200:
+            search_cache.set(key, data)
+    return data
+
+
+@app.task()
+def solrSearchCacheStats(clear=False):
+    """
+    Hit and miss counts of the solrSearch result cache for this worker process.
+    """
+    stats = search_cache.stats()
+    if clear:
+        search_cache.invalidate()
+    return stats
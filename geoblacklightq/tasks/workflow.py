@@ -1,14 +1,26 @@
-from celery import Celery
+from celery import Celery, chain, chord, group
 import celeryconfig
 from subprocess import call, STDOUT
-import requests
+from .clients import getSession
 import os
 from requests import exceptions
 from .tasks import solrDeleteIndex, solrIndexSampleData, solrIndexItems
+from .tasks import solrPostBatch, solrCommit, solr_index
+from .tasks import solrIterate, solrDeleteIds, fingerprintedDocument
+from .tasks import solr_unique_key, solr_fingerprint_field
+from .tasks import solrCreateRebuildIndex, solrWarmIndex, solrSwapIndex, solrCheckRebuild
 from .geotransmeta import unzip, geoBoundsMetadata, determineTypeBounds
-from .geotransmeta import configureGeoData, crossWalkGeoBlacklight
-from .geoservertasks import dataLoadGeoserver
+from .geotransmeta import configureGeoData, crossWalkGeoBlacklight, crossWalkChunk
+from .geotransmeta import optimizeRasters, crossWalkRecord
+from .geotransmeta import resultDirUrl
+from .geoservertasks import dataLoadGeoserver, storeExists
+from .ingestindex import planIngest, recordIngest, reuseIngest, reuseGeoserverStore
+from .ingestindex import ingest_dedup
+from .manifest import archiveManifest, layerCount
+from .artifacts import lazyArtifacts, saveArtifact, loadArtifact
+from .routing import routed
 import json
+import time
 
 app = Celery()
 app.config_from_object(celeryconfig)
@@ -17,34 +29,325 @@ wwwdir = "/data/static"
 # No slash at end of API URL
 cybercom_api_url = os.getenv(
     "CYBERCOM_API_URL", "https://geo.colorado.edu/api")
+# Streaming index defaults
+solr_batch_size = int(os.getenv('SOLR_BATCH_SIZE', 500))
+solr_commit_within = int(os.getenv('SOLR_COMMIT_WITHIN', 60000))
+catalog_query = {"filter": {"status": "indexed"},
+                 "projection": {"_id": 0, "style": 0, "status": 0}}
+# Catalog fields never sent to Solr
+solr_excluded_fields = [key for key, value in catalog_query["projection"].items() if not value]
+# Batch ingest: maximum number of zips in flight at once (lanes)
+batch_max_inflight = int(os.getenv('BATCH_MAX_INFLIGHT', 4))
+# Batch crosswalk: records and xml bytes per crossWalkChunk task (parsing runs in parallel
+# across chunks on the CPU workers)
+crosswalk_chunk_size = int(os.getenv('CROSSWALK_CHUNK_SIZE', 50))
+crosswalk_chunk_bytes = int(os.getenv('CROSSWALK_CHUNK_BYTES', 20 * 1024 * 1024))
+
+
+def catalogPages(query=catalog_query, page_size=solr_batch_size):
+    """
+    Generator that pages through the catalog API.
+    Yields one list of records per page so the full catalog
+    never has to be held in memory.
+    """
+    headers = {'Content-Type': 'application/json'}
+    url = '{0}/catalog/data/catalog/geoportal.json'.format(cybercom_api_url)
+    page = 1
+    params = {"query": json.dumps(query), "page_size": page_size, "page": page}
+    following = False
+    while url:
+        sr = getSession('catalog').get(url, params=params, headers=headers)
+        sr.raise_for_status()
+        data = sr.json()
+        results = data.get('results', [])
+        if not results:
+            break
+        yield results
+        # Follow next link if provided by the API, otherwise increment page.
+        # Once next links are followed, a page without one is the last page.
+        if data.get('next'):
+            url, params, following = data['next'], None, True
+        elif following or len(results) < page_size:
+            break
+        else:
+            page = page + 1
+            params["page"] = page
+
+
+def catalogCount(query=catalog_query):
+    """
+    Number of catalog records matching query as reported by the catalog API.
+    """
+    headers = {'Content-Type': 'application/json'}
+    url = '{0}/catalog/data/catalog/geoportal.json'.format(cybercom_api_url)
+    params = {"query": json.dumps(query), "page_size": 1, "page": 1}
+    sr = getSession('catalog').get(url, params=params, headers=headers)
+    sr.raise_for_status()
+    return sr.json().get('count')
+
+
+def catalogSaveRecord(gblight, status="indexed"):
+    """
+    Create or update the catalog record of a GeoBlacklight record, matched on
+    the Solr uniqueKey, so reindex and sync keep what a loader indexed.
+    """
+    headers = {'Content-Type': 'application/json'}
+    url = '{0}/catalog/data/catalog/geoportal'.format(cybercom_api_url)
+    record = dict(gblight, status=status)
+    query = {"filter": {solr_unique_key: gblight[solr_unique_key]}}
+    sr = getSession('catalog').get("{0}.json".format(url), headers=headers,
+                                   params={"query": json.dumps(query), "page_size": 1})
+    sr.raise_for_status()
+    found = sr.json().get('results', [])
+    if found and found[0].get('_id'):
+        sr = getSession('catalog').put("{0}/{1}/".format(url, found[0]['_id']),
+                                       data=json.dumps(record), headers=headers)
+    else:
+        sr = getSession('catalog').post("{0}/".format(url), data=json.dumps(record),
+                                        headers=headers)
+    sr.raise_for_status()
+    return sr.status_code
+
+
+def catalogSaveRecords(records):
+    """
+    catalogSaveRecord for each record. Returns saved count and failures.
+    """
+    saved, failed = 0, []
+    for gblight in records:
+        try:
+            catalogSaveRecord(gblight)
+            saved = saved + 1
+        except Exception as inst:
+            failed.append({solr_unique_key: gblight.get(solr_unique_key),
+                           "error": "{0}: {1}".format(type(inst).__name__, inst)})
+    return {"saved": saved, "failed": failed}
+
+
+@app.task()
+def solrStreamIndexItems(batch_size=solr_batch_size, commitWithin=solr_commit_within,
+                         solr_index=solr_index, query=catalog_query):
+    """
+    Stream catalog records into Solr in fixed size batches.
+    Pages through the catalog API, posts each page with commitWithin
+    and issues one final hard commit.
+    kwargs:
+        batch_size (int): records per catalog page and Solr post
+        commitWithin (int): milliseconds before Solr makes the batch visible
+        solr_index (string): target Solr core/collection
+    returns:
+        summary with per batch status, throughput (docs/sec) and the
+        catalog record count before the walk (expected)
+    """
+    start = time.time()
+    expected = catalogCount(query)
+    batches = []
+    indexed = 0
+    for idx, items in enumerate(catalogPages(query, page_size=batch_size)):
+        items = [solrDocument(itm) for itm in items]
+        result = solrPostBatch(items, solr_index=solr_index,
+                               commitWithin=commitWithin)
+        result["batch"] = idx
+        if result["success"]:
+            indexed = indexed + result["docs"]
+            del result["response"]
+        else:
+            # keep a truncated response of failed batches for troubleshooting
+            result["response"] = str(result["response"])[:1000]
+        batches.append(result)
+    commit = solrCommit(solr_index=solr_index)
+    elapsed = time.time() - start
+    failed = [b["batch"] for b in batches if not b["success"]]
+    return {"solr_index": solr_index, "indexed": indexed, "expected": expected,
+            "batches": batches, "failed_batches": failed, "commit_status": commit["status"],
+            "elapsed": elapsed, "docs_per_sec": indexed / elapsed if elapsed else 0}
 
 
 @app.task()
-def resetSolrIndex(items=None):
+def syncSolrIndex(solr_index=solr_index, batch_size=solr_batch_size,
+                  commitWithin=solr_commit_within, dry_run=False):
+    """
+    Incremental Solr synchronization with the catalog.
+    Compares the fingerprint of every catalog record with the fingerprint stored
+    in Solr. Only added and changed documents are posted and only removed
+    documents are deleted (by uniqueKey), followed by one commit.
+    Nothing is deleted when the catalog walk returned fewer records than the
+    catalog reported (e.g. a transient empty page ended the walk early).
+    kwargs:
+        dry_run (boolean): report differences without changing Solr
+    """
+    start = time.time()
+    expected = catalogCount()
+    existing = dict((doc[solr_unique_key], doc.get(solr_fingerprint_field))
+                    for doc in solrIterate(fl=[solr_unique_key, solr_fingerprint_field],
+                                           solr_index=solr_index))
+    seen = set()
+    counts = {"added": 0, "changed": 0, "unchanged": 0, "deleted": 0, "missing_id": 0,
+              "catalog_records": 0, "catalog_count": expected, "deletes_skipped": None}
+    failed = []
+    buffer = []
+
+    def flush():
+        if buffer and not dry_run:
+            result = solrPostBatch(buffer, solr_index=solr_index, commitWithin=commitWithin)
+            if not result["success"]:
+                failed.append({"status": result["status"], "docs": result["docs"],
+                               "response": str(result["response"])[:1000]})
+        del buffer[:]
+
+    for items in catalogPages(page_size=batch_size):
+        counts["catalog_records"] = counts["catalog_records"] + len(items)
+        for itm in items:
+            doc = solrDocument(itm)
+            key = doc.get(solr_unique_key)
+            if not key:
+                counts["missing_id"] = counts["missing_id"] + 1
+                continue
+            seen.add(key)
+            if key not in existing:
+                counts["added"] = counts["added"] + 1
+            elif existing[key] != doc[solr_fingerprint_field]:
+                counts["changed"] = counts["changed"] + 1
+            else:
+                counts["unchanged"] = counts["unchanged"] + 1
+                continue
+            buffer.append(doc)
+            if len(buffer) >= batch_size:
+                flush()
+    flush()
+    removed = [key for key in existing if key not in seen]
+    if removed and (expected is None or counts["catalog_records"] < expected):
+        counts["deletes_skipped"] = "Catalog walk returned {0} of {1} records.".format(
+            counts["catalog_records"], expected)
+        removed = []
+    counts["deleted"] = len(removed)
+    if not dry_run:
+        for idx in range(0, len(removed), batch_size):
+            result = solrDeleteIds(removed[idx:idx + batch_size], solr_index=solr_index,
+                                   commitWithin=commitWithin)
+            if not result["success"]:
+                failed.append(result)
+        if counts["added"] or counts["changed"] or removed:
+            solrCommit(solr_index=solr_index)
+    counts.update({"solr_index": solr_index, "dry_run": dry_run, "failed": failed,
+                   "elapsed": time.time() - start})
+    return counts
+
+
+@app.task()
+def solrExport(q='*:*', fl=None, fq=None, sort=None, rows=1000, solr_index=solr_index):
+    """
+    Export every document matching q to geo_tasks/<task_id>/export.jsonl
+    (one JSON document per line). Pages through Solr with cursorMark, so
+    memory use does not grow with the result set.
+    kwargs:
+        fl (list): fields exported (default all stored fields)
+        fq (string or list): filter queries
+        sort (string): export order; the uniqueKey is added as tie breaker
+        rows (int): documents per Solr request
+    returns:
+        count, file, url and elapsed seconds
+    """
+    task_id = str(solrExport.request.id)
+    resultDir = os.path.join(wwwdir, 'geo_tasks', task_id)
+    os.makedirs(resultDir, exist_ok=True)
+    filename = os.path.join(resultDir, 'export.jsonl')
+    start = time.time()
+    count = 0
+    with open(filename, 'w') as f:
+        for doc in solrIterate(q=q, fl=fl, fq=fq, sort=sort, rows=rows, solr_index=solr_index):
+            f.write(json.dumps(doc))
+            f.write('\n')
+            count = count + 1
+    return {"count": count, "file": filename,
+            "url": "{0}/export.jsonl".format(resultDirUrl(resultDir)),
+            "elapsed": time.time() - start}
+
+
+@app.task()
+def resetSolrIndex(items=None, stream=False, batch_size=solr_batch_size, swap=False):
     """
     Delete current solr index and indexs items sent in Args
     Args:
         items (list of objects) defaults to index all  if items not provided.
+    kwargs:
+        stream (boolean): page through the catalog API and index in batches
+            of batch_size with commitWithin and a single final commit.
+        swap (boolean): zero downtime rebuild. Index into a fresh core/collection,
+            warm it and swap it onto solr_index. The live index is never emptied.
     returns:
         acknowledgement of workflow submitted.
         Children chain: solrDeleteIndex --> solrIndexItems
+            or solrDeleteIndex --> solrStreamIndexItems
+            or solrCreateRebuildIndex --> solrStreamIndexItems --> solrWarmIndex --> solrSwapIndex
     """
+    queuename = resetSolrIndex.request.delivery_info['routing_key']
+    if swap:
+        rebuild = "{0}_rebuild_{1}".format(solr_index, int(time.time()))
+        if items:
+            load = solrIndexItems.si(items, solr_index=rebuild)
+            check = solrCheckRebuild.s(rebuild, expected=len(items))
+        else:
+            load = solrStreamIndexItems.si(
+                batch_size=batch_size, solr_index=rebuild)
+            check = solrCheckRebuild.s(rebuild)
+        # solrCheckRebuild raises on failed batches or missing documents: no swap
+        workflow = (routed(solrCreateRebuildIndex.si(rebuild), queuename) |
+                    routed(load, queuename) |
+                    routed(check, queuename) |
+                    routed(solrWarmIndex.si(rebuild), queuename) |
+                    routed(solrSwapIndex.si(rebuild), queuename))()
+        return "Successfully Workflow Submitted: children workflow chain: solrCreateRebuildIndex --> solrIndexItems/solrStreamIndexItems --> solrCheckRebuild --> solrWarmIndex --> solrSwapIndex"
+    if stream and not items:
+        workflow = (routed(solrDeleteIndex.si(), queuename) |
+                    routed(solrStreamIndexItems.si(batch_size=batch_size), queuename))()
+        return "Successfully Workflow Submitted: children workflow chain: solrDeleteIndex --> solrStreamIndexItems"
     if not items:
         headers = {'Content-Type': 'application/json'}
         query = 'query={"filter":{"status":"indexed"},"projection":{"_id":0,"style":0,"status":0}}'
         url = '{0}/catalog/data/catalog/geoportal.json?{1}'.format(
             cybercom_api_url, query)
-        sr = requests.get(url, headers=headers)
+        sr = getSession('catalog').get(url, headers=headers)
         data = sr.json()
         items = data['results']
-    queuename = resetSolrIndex.request.delivery_info['routing_key']
-    workflow = (solrDeleteIndex.si().set(queue=queuename) |
-                solrIndexItems.si(items).set(queue=queuename))()
+    workflow = (routed(solrDeleteIndex.si(), queuename) |
+                routed(solrIndexItems.si(items), queuename))()
     return "Successfully Workflow Submitted: children workflow chain: solrDeleteIndex --> solrIndexItems"
 
 
+def requestFlag(request_data, key, default=False):
+    """
+    Boolean request value. Form posts send strings ('false', '0').
+    """
+    value = request_data.get(key, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ['true', '1', 'yes', 'on']
+    return bool(value)
+
+
+def ingestAvailable(entry):
+    """
+    True while the GeoServer stores and result directory of a previous ingest exist.
+    """
+    if entry.get('resultDir') and not os.path.isdir(entry['resultDir']):
+        return False
+    stores = [store for store in [entry.get('store')] + entry.get('stores', []) if store]
+    return all(storeExists(store) for store in stores)
+
+
+def reusablePlan(plan, replace=False):
+    """
+    An identical upload reuses the previous ingest unless replace (explicit
+    force) is set or its store or result directory is gone. It is then
+    published again and keeps its ARKs.
+    """
+    if plan["action"] != "identical" or (not replace and ingestAvailable(plan["entry"])):
+        return plan
+    return dict(plan, action="data")
+
+
 @app.task()
-def geoLibraryLoader(local_file, request_data, force=True):
+def geoLibraryLoader(local_file, request_data, force=True, dedup=ingest_dedup):
     """
     Workflow to handle initial import of zipfile:
     --> Unzip
@@ -56,17 +359,571 @@ def geoLibraryLoader(local_file, request_data, force=True):
 
     Workflow is called from /upload with form that has taskname
 
+    Zip files holding several shapefiles/rasters publish every layer in
+    parallel: unzip --> determineTypeBounds --> optimizeRasters --> publishLayers, a chord of
+    loadLayer per layer --> layersLoaded (one Solr batch, request_data index).
+
     force (boolean): If data already uploaded will delete and replace.
+        An explicit force in request_data also publishes an identical re-upload again.
+    dedup (boolean): Compare the zip with the ingest index. An identical
+        re-upload reuses the previous result (while its store and result
+        directory exist), a metadata only change skips the GeoServer publish
+        and any re-upload keeps its ARK.
     """
     task_id = str(geoLibraryLoader.request.id)
     resultDir = os.path.join(wwwdir, 'geo_tasks', task_id)
     os.makedirs(resultDir)
     if 'force' in request_data:
-        force = request_data['force']
+        force = requestFlag(request_data, 'force')
+    dedup = requestFlag(request_data, 'dedup', dedup)
     queuename = geoLibraryLoader.request.delivery_info['routing_key']
-    workflow = (unzip.s(local_file).set(queue=queuename) |
-                determineTypeBounds.s().set(queue=queuename) |
-                dataLoadGeoserver.s().set(queue=queuename) |
-                configureGeoData.s(resultDir).set(queue=queuename) |
-                crossWalkGeoBlacklight.s().set(queue=queuename))()
+    plan = planIngest(local_file) if dedup else {"action": "new", "entry": None}
+    plan = reusablePlan(plan, replace='force' in request_data and force)
+    entry = plan["entry"] or {}
+    if plan["action"] == "identical":
+        routed(reuseIngest.s(local_file, entry), queuename)()
+        return "Identical archive ingested previously. Existing store and record reused."
+    if layerCount(archiveManifest(local_file)) > 1:
+        reuse = layerEntries(entry) if plan["action"] == "metadata" else None
+        workflow = (routed(unzip.s(local_file, selective=True), queuename) |
+                    routed(determineTypeBounds.s(resultDir), queuename))
+        if not reuse:
+            workflow = workflow | routed(optimizeRasters.s(resultDir), queuename)
+        workflow = (workflow |
+                    routed(publishLayers.s(resultDir, arks=entry.get("arks"), digest=plan.get("digest"),
+                                           index=requestFlag(request_data, 'index', True),
+                                           reuse=reuse), queuename))
+        workflow()
+        return "Successfully submitted geoLibrary multi-layer workflow"
+    if plan["action"] == "metadata":
+        publish = routed(reuseGeoserverStore.s(entry), queuename)
+    else:
+        publish = (routed(optimizeRasters.s(resultDir), queuename) |
+                   routed(dataLoadGeoserver.s(), queuename))
+    workflow = (routed(unzip.s(local_file, selective=True), queuename) |
+                routed(determineTypeBounds.s(resultDir), queuename) |
+                publish |
+                routed(configureGeoData.s(resultDir), queuename) |
+                routed(crossWalkGeoBlacklight.s(ark=entry.get("ark")), queuename))
+    if dedup:
+        workflow = workflow | routed(recordIngest.s(plan["digest"], resultDir), queuename)
+    workflow()
     return "Successfully submitted geoLibrary initial workflow"
+
+
+def layerData(data, layer):
+    """
+    Loader data of one layer of a multi-layer dataset.
+    """
+    item = dict((key, value) for key, value in data.items() if key != 'layers')
+    item.update(layer)
+    return item
+
+
+def layerEntries(entry):
+    """
+    Previous GeoServer store, resource type and bounds of each layer of a
+    multi-layer ingest index entry, by store name (see reuseGeoserverStore).
+    """
+    layers = ((entry or {}).get("result") or {}).get("layers") or []
+    return dict((itm["geoserverStoreName"], {"store": itm["geoserverStoreName"],
+                                            "resource_type": itm.get("resource_type"),
+                                            "bounds": itm.get("bounds")})
+                for itm in layers if itm.get("status") == "SUCCESS" and itm.get("resource_type"))
+
+
+def loadLayerItem(data, resultDir, ark=None, reuse=None):
+    """
+    Publish and crosswalk one layer within the current task.
+    reuse (dict): previous store of the layer when only metadata changed (layerEntries)
+    Returns summary of the layer. Errors are reported, never raised.
+    """
+    summary = {"layer": data["layer"], "file": data["file"], "type": data["type"],
+               "geoserverStoreName": data["geoserverStoreName"]}
+    start = time.time()
+    try:
+        data = reuseGeoserverStore(data, reuse) if reuse else dataLoadGeoserver(data)
+        data = configureGeoData(data, resultDir)
+        data = crossWalkGeoBlacklight(data, ark=ark)
+        summary.update({"status": "SUCCESS", "msg": data["msg"], "bounds": data["bounds"],
+                        "resource_type": data["resource_type"], "xmlurls": data["xmlurls"],
+                        "geoblacklightschema": data["geoblacklightschema"]})
+    except Exception as inst:
+        summary["status"] = "FAILURE"
+        summary["error"] = "{0}: {1}".format(type(inst).__name__, inst)
+    summary["elapsed"] = time.time() - start
+    return summary
+
+
+@app.task()
+def loadLayer(data, resultDir, ark=None, reuse=None):
+    """
+    dataLoadGeoserver (or reuseGeoserverStore) --> configureGeoData --> crossWalkGeoBlacklight of one layer.
+    """
+    return loadLayerItem(data, resultDir, ark=ark, reuse=reuse)
+
+
+def indexRecords(records, batch_size=solr_batch_size):
+    """
+    Post GeoBlacklight records to Solr in batches followed by a single commit.
+    Returns list of {status, docs, success} per batch.
+    """
+    docs = [solrDocument(gblight) for gblight in records]
+    batches = []
+    for idx in range(0, len(docs), batch_size):
+        result = solrPostBatch(docs[idx:idx + batch_size])
+        batches.append({"status": result["status"], "docs": result["docs"],
+                        "success": result["success"]})
+    if docs:
+        solrCommit()
+    return batches
+
+
+@app.task()
+def layersLoaded(layers, data, resultDir, digest=None, index=True):
+    """
+    Chord callback of publishLayers. Indexes the records of all layers in one
+    Solr batch and saves their catalog records, writes layers.json to the
+    result directory and records the ingest when every layer succeeded.
+    """
+    data = dict(data)
+    data['layers'] = layers
+    failed = [itm["layer"] for itm in layers if itm["status"] != "SUCCESS"]
+    batches = []
+    if index:
+        records = [itm["geoblacklightschema"] for itm in layers if itm.get("geoblacklightschema")]
+        batches = indexRecords(records)
+        data['catalog'] = catalogSaveRecords(records)
+    data['indexed'] = sum(b["docs"] for b in batches if b["success"])
+    data['msg'] = "{0} {1} of {2} layers published.".format(
+        data.get('msg', ''), len(layers) - len(failed), len(layers)).strip()
+    with open(os.path.join(resultDir, 'layers.json'), 'w') as f:
+        json.dump(data, f, indent=2)
+    if digest and not failed:
+        recordIngest(data, digest, resultDir)
+    return data
+
+
+@app.task()
+def publishLayers(data, resultDir, arks=None, digest=None, index=True, reuse=None):
+    """
+    Fan out a multi-layer dataset (determineTypeBounds layers) to one loadLayer
+    task per layer. GeoServer store names are unique per layer.
+    kwargs:
+        arks (dict): GeoServer store name --> ARK of a previous ingest
+        reuse (dict): GeoServer store name --> previous store of a metadata only
+            change (layerEntries); these layers are not published again
+        digest (dict): archive digest recorded by layersLoaded (dedup)
+        index (boolean): index all layers in Solr with a single commit
+    returns:
+        acknowledgement of workflow submitted.
+        Chord: loadLayer (x layers) --> layersLoaded
+    """
+    queuename = publishLayers.request.delivery_info['routing_key']
+    arks = arks or {}
+    reuse = reuse or {}
+    layers = lazyArtifacts(data)['layers']
+    header = [routed(loadLayer.si(layerData(data, layer), resultDir,
+                                  ark=arks.get(layer["geoserverStoreName"]),
+                                  reuse=reuse.get(layer["geoserverStoreName"])), queuename)
+              for layer in layers]
+    base = dict((key, value) for key, value in data.items() if key != 'layers')
+    chord(group(header), routed(layersLoaded.s(base, resultDir, digest=digest, index=index), queuename))()
+    return "Successfully submitted {0} layers: {1}".format(
+        len(layers), ', '.join(layer["geoserverStoreName"] for layer in layers))
+
+
+def batchFiles(source):
+    """
+    Zip files of a batch ingest.
+    source: directory of zip files, manifest file (JSON list or one path per line)
+        or list of paths
+    """
+    if isinstance(source, list):
+        return source
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if name.lower().endswith('.zip'))
+    with open(source) as f:
+        text = f.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def solrDocument(gblight):
+    """
+    Solr document of a catalog record with its fingerprint field set.
+    """
+    return fingerprintedDocument(dict((key, value) for key, value in gblight.items()
+                                      if key not in solr_excluded_fields))
+
+
+def batchDestinations(files):
+    """
+    unzip destination (TMPDIR folder, archive and store name) of each file of a
+    batch. Zip files sharing a basename get a numeric suffix.
+    """
+    stems = [os.path.splitext(os.path.basename(local_file))[0] for local_file in files]
+    used = set(stems)
+    destinations = {}
+    for local_file, stem in zip(files, stems):
+        name = stem
+        count = 1
+        while name in destinations.values() or (name != stem and name in used):
+            count = count + 1
+            name = "{0}_{1}".format(stem, count)
+        destinations[local_file] = name
+    return destinations
+
+
+def batchStep(lane, step):
+    """
+    Apply step(current) to the zip file in flight of a batch lane unless it
+    finished or failed. Errors are reported in its summary, never raised.
+    """
+    current = lane.get("current")
+    if current and not current["summary"].get("status"):
+        try:
+            step(current)
+        except Exception as inst:
+            current["summary"]["status"] = "FAILURE"
+            current["summary"]["error"] = "{0}: {1}".format(type(inst).__name__, inst)
+    return lane
+
+
+def layerStep(layer, step):
+    """
+    Apply step(data) to one layer of a multi-layer zip file unless it failed.
+    """
+    summary = layer["summary"]
+    if summary.get("status"):
+        return
+    start = time.time()
+    try:
+        layer["data"] = step(layer["data"])
+    except Exception as inst:
+        summary["status"] = "FAILURE"
+        summary["error"] = "{0}: {1}".format(type(inst).__name__, inst)
+    summary["elapsed"] = summary.get("elapsed", 0) + time.time() - start
+
+
+@app.task()
+def batchUnzip(lane, local_file, resultDir, dedup=ingest_dedup, destination=None):
+    """
+    First stage of a zip file of a batch lane: compare it with the ingest
+    index, unzip, determineTypeBounds and optimizeRasters.
+    Args:
+        lane (dict): items (summaries of the finished zip files), current (zip file in flight)
+    kwargs:
+        destination (string): unzip destination, default the zip file name
+    """
+    name = os.path.splitext(os.path.basename(local_file))[0]
+    if destination and destination != name:
+        # renamed duplicate: the ingest index is keyed on the zip file name
+        name, dedup = destination, False
+    itemDir = os.path.join(resultDir, name)
+    os.makedirs(itemDir, exist_ok=True)
+    lane = dict(lane, current={"summary": {"file": local_file, "name": name, "resultDir": itemDir},
+                               "start": time.time(), "dedup": dedup})
+
+    def step(current):
+        summary = current["summary"]
+        plan = planIngest(local_file) if dedup else {"action": "new", "entry": None}
+        plan = reusablePlan(plan)
+        entry = plan["entry"] or {}
+        summary["dedup"] = plan["action"]
+        if plan["action"] == "identical":
+            data = reuseIngest(local_file, entry)
+            summary.update({"status": "SUCCESS", "type": data.get("type"), "msg": data["msg"],
+                            "geoserverStoreName": data.get("geoserverStoreName"),
+                            "geoblacklightschema": data.get("geoblacklightschema")})
+            if data.get("layers"):
+                summary["layers"] = data["layers"]
+            return
+        current.update({"digest": plan.get("digest"), "ark": entry.get("ark"),
+                        "arks": entry.get("arks") or {}})
+        data = unzip(local_file, destination=name, selective=True)
+        data = determineTypeBounds(data, itemDir)
+        if "layers" in data:
+            reuse = layerEntries(entry) if plan["action"] == "metadata" else {}
+            if not reuse:
+                data = optimizeRasters(data, itemDir)
+            current["layers"] = [{"summary": {"layer": layer["layer"], "file": layer["file"],
+                                              "type": layer["type"],
+                                              "geoserverStoreName": layer["geoserverStoreName"]},
+                                  "data": layerData(data, layer),
+                                  "reuse": reuse.get(layer["geoserverStoreName"])}
+                                 for layer in lazyArtifacts(data)["layers"]]
+            data = dict((key, value) for key, value in data.items() if key != 'layers')
+        elif plan["action"] == "metadata":
+            current["reuse"] = entry
+        else:
+            data = optimizeRasters(data, itemDir)
+        summary["type"] = data["type"]
+        current["data"] = data
+    return batchStep(lane, step)
+
+
+@app.task()
+def batchPublish(lane):
+    """
+    Publish the zip file in flight of a batch lane (every layer of a multi-layer
+    zip file): dataLoadGeoserver, or reuseGeoserverStore when only metadata changed.
+    Concurrent GeoServer requests are bounded by the shared GeoServer limiter.
+    """
+    def step(current):
+        summary = current["summary"]
+        if "layers" in current:
+            for layer in current["layers"]:
+                layerStep(layer, lambda data: reuseGeoserverStore(data, layer["reuse"])
+                          if layer["reuse"] else dataLoadGeoserver(data))
+            return
+        if current.get("reuse"):
+            data = reuseGeoserverStore(current["data"], current["reuse"])
+        else:
+            data = dataLoadGeoserver(current["data"])
+        summary["geoserverStoreName"] = data["geoserverStoreName"]
+        if data["type"] == "iiif":
+            summary["status"] = "SKIPPED"
+            summary["msg"] = data["msg"]
+        current["data"] = data
+    return batchStep(lane, step)
+
+
+@app.task()
+def batchMetadata(lane):
+    """
+    configureGeoData of the zip file in flight of a batch lane (or of each layer).
+    """
+    def step(current):
+        itemDir = current["summary"]["resultDir"]
+        if "layers" in current:
+            for layer in current["layers"]:
+                layerStep(layer, lambda data: configureGeoData(data, itemDir))
+            return
+        current["data"] = configureGeoData(current["data"], itemDir)
+    return batchStep(lane, step)
+
+
+def crossWalkLayers(current):
+    """
+    Crosswalk every published layer of a multi-layer zip file and record the
+    ingest when all layers succeeded.
+    """
+    summary = current["summary"]
+    layers = []
+    for layer in current["layers"]:
+        layerStep(layer, lambda data: crossWalkGeoBlacklight(
+            data, ark=current["arks"].get(layer["summary"]["geoserverStoreName"])))
+        if not layer["summary"].get("status"):
+            data = layer["data"]
+            layer["summary"].update({"status": "SUCCESS", "msg": data["msg"],
+                                     "bounds": data["bounds"],
+                                     "resource_type": data["resource_type"],
+                                     "xmlurls": data["xmlurls"],
+                                     "geoblacklightschema": data["geoblacklightschema"]})
+        layers.append(layer["summary"])
+    failed = [itm["layer"] for itm in layers if itm["status"] != "SUCCESS"]
+    summary.update({"geoserverStoreName": None, "layers": layers,
+                    "msg": "{0} of {1} layers published.".format(
+                        len(layers) - len(failed), len(layers))})
+    if failed:
+        summary["status"] = "FAILURE"
+        summary["error"] = "Layers failed: {0}".format(', '.join(failed))
+        return
+    if current["dedup"]:
+        record = dict(current["data"])
+        record["layers"] = layers
+        recordIngest(record, current["digest"], summary["resultDir"])
+    summary["status"] = "SUCCESS"
+
+
+@app.task()
+def batchCrosswalk(lane):
+    """
+    Last stage of a zip file of a batch lane: crossWalkGeoBlacklight (keeping
+    the ARK of a previous ingest) and recordIngest. The summary of the zip file
+    is saved to its result directory and added to the lane items.
+    """
+    def step(current):
+        if "layers" in current:
+            return crossWalkLayers(current)
+        summary = current["summary"]
+        data = crossWalkGeoBlacklight(current["data"], ark=current.get("ark"))
+        if current["dedup"]:
+            recordIngest(data, current["digest"], summary["resultDir"])
+        summary.update({"status": "SUCCESS", "msg": data["msg"],
+                        "geoblacklightschema": data["geoblacklightschema"]})
+    lane = batchStep(lane, step)
+    current = lane.pop("current")
+    summary = current["summary"]
+    summary["elapsed"] = time.time() - current["start"]
+    # finished items leave the lane message
+    lane["items"] = lane["items"] + [saveArtifact(summary["resultDir"], summary)]
+    return lane
+
+
+def batchLane(files, resultDir, queuename, dedup=ingest_dedup, destinations=None):
+    """
+    Chain of stage tasks ingesting files one after another, each stage routed
+    by its class: batchUnzip --> batchPublish --> batchMetadata --> batchCrosswalk.
+    kwargs:
+        destinations (dict): zip file --> unzip destination (batchDestinations)
+    """
+    destinations = destinations or {}
+    stages = []
+    for local_file in files:
+        unzipping = batchUnzip.s(local_file, resultDir, dedup=dedup,
+                                 destination=destinations.get(local_file))
+        if not stages:
+            unzipping = batchUnzip.si({"items": []}, local_file, resultDir, dedup=dedup,
+                                      destination=destinations.get(local_file))
+        stages.extend([unzipping, batchPublish.s(), batchMetadata.s(), batchCrosswalk.s()])
+    return chain(*[routed(stage, queuename) for stage in stages])
+
+
+@app.task()
+def batchIngestSummary(lanes, resultDir, index=True, batch_size=solr_batch_size):
+    """
+    Chord callback of geoLibraryBatchLoader. Collects per item results of the lanes,
+    indexes all crosswalked items in Solr with a single commit, saves their
+    catalog records and writes summary.json to the batch result directory.
+    """
+    items = [loadArtifact(itm) for lane in lanes for itm in lane["items"]]
+    records = [itm["geoblacklightschema"] for item in items
+               for itm in [item] + item.get("layers", []) if itm.get("geoblacklightschema")]
+    batches = []
+    catalog = None
+    if index:
+        batches = indexRecords(records, batch_size=batch_size)
+        catalog = catalogSaveRecords(records)
+    summary = {"total": len(items), "indexed": sum(b["docs"] for b in batches if b["success"]),
+               "solr_batches": batches, "catalog": catalog, "items": []}
+    for status in ["SUCCESS", "SKIPPED", "FAILURE"]:
+        summary[status.lower()] = len([itm for itm in items if itm["status"] == status])
+    for itm in items:
+        for layer in [itm] + itm.get("layers", []):
+            gblight = layer.pop("geoblacklightschema", {})
+            layer["layer_slug_s"] = gblight.get("layer_slug_s")
+        summary["items"].append(itm)
+    with open(os.path.join(resultDir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+@app.task()
+def geoLibraryBatchLoader(source, request_data=None, max_inflight=batch_max_inflight, index=True):
+    """
+    Workflow to import many zip files at once.
+    Zip files are split into max_inflight lanes run as a Celery chord.
+    Each lane is a chain of the loader stages of its files in turn (batchLane),
+    so at most max_inflight zips are in flight. Unzip and metadata stages go to
+    the CPU queue, publish and crosswalk stages to the IO queue, where the shared
+    GeoServer limiter bounds concurrent GeoServer requests.
+    Args:
+        source (string or list): directory of zip files, manifest file
+            (JSON list or one path per line) or list of zip files
+    kwargs:
+        max_inflight (int): zip files ingested at once
+        index (boolean): index all crosswalked items in Solr in one bulk request at
+            the end and save their catalog records
+        dedup (request_data): compare each zip with the ingest index (see geoLibraryLoader)
+    returns:
+        acknowledgement of workflow submitted.
+        Chord: batchLane (x max_inflight) --> batchIngestSummary
+        Per item results are written to geo_tasks/<task_id>/summary.json
+    """
+    request_data = request_data or {}
+    max_inflight = int(request_data.get('max_inflight', max_inflight))
+    index = requestFlag(request_data, 'index', index)
+    dedup = requestFlag(request_data, 'dedup', ingest_dedup)
+    task_id = str(geoLibraryBatchLoader.request.id)
+    resultDir = os.path.join(wwwdir, 'geo_tasks', task_id)
+    os.makedirs(resultDir)
+    files = batchFiles(source)
+    lanes = [files[idx::max_inflight] for idx in range(max_inflight) if files[idx::max_inflight]]
+    if not lanes:
+        return "No zip files found in {0}".format(source)
+    destinations = batchDestinations(files)
+    queuename = geoLibraryBatchLoader.request.delivery_info['routing_key']
+    workflow = chord(group(batchLane(lane, resultDir, queuename, dedup=dedup, destinations=dict(
+        (local_file, destinations[local_file]) for local_file in lane)) for lane in lanes),
+                     routed(batchIngestSummary.s(resultDir, index=index), queuename))()
+    return "Successfully submitted geoLibrary batch workflow: {0} zip files in {1} lanes".format(
+        len(files), len(lanes))
+
+
+@app.task()
+def batchCrossWalkResults(chunks, index=False, batch_size=solr_batch_size):
+    """
+    Chord callback of batchCrossWalkGeoBlacklight.
+    Returns:
+        dict: results (GeoBlacklight record or None, in record order),
+            errors (index, record, error), indexed (documents posted to Solr)
+    """
+    items = sorted((itm for chunk in chunks for itm in chunk), key=lambda itm: itm["index"])
+    results = [itm.get("gblight") for itm in items]
+    errors = [itm for itm in items if "error" in itm]
+    docs = [solrDocument(gblight) for gblight in results if gblight]
+    indexed = 0
+    if index and docs:
+        for idx in range(0, len(docs), batch_size):
+            result = solrPostBatch(docs[idx:idx + batch_size])
+            if result["success"]:
+                indexed = indexed + result["docs"]
+        solrCommit()
+    return {"results": results, "errors": errors, "indexed": indexed}
+
+
+def crossWalkChunks(records, chunk_size=crosswalk_chunk_size, chunk_bytes=crosswalk_chunk_bytes):
+    """
+    Split records into (offset, records) chunks of at most chunk_size records
+    and about chunk_bytes of xml, so large metadata files spread over more tasks.
+    """
+    chunks = []
+    start, size = 0, 0
+    for idx, record in enumerate(records):
+        try:
+            size = size + os.path.getsize(crossWalkRecord(record)['filename'])
+        except (OSError, TypeError):
+            pass
+        if idx + 1 - start >= chunk_size or size >= chunk_bytes:
+            chunks.append((start, records[start:idx + 1]))
+            start, size = idx + 1, 0
+    if start < len(records):
+        chunks.append((start, records[start:]))
+    return chunks
+
+
+@app.task()
+def batchCrossWalkGeoBlacklight(records, chunk_size=crosswalk_chunk_size, index=False,
+                                chunk_bytes=crosswalk_chunk_bytes):
+    """
+    Crosswalk many XML files to GeoBlacklight schema in one workflow.
+    Records are split into chunks run as a Celery chord so XML parsing runs in
+    parallel over the worker processes. Each chunk parses its XML files and
+    prefetches the GeoServer lookups concurrently.
+    Args:
+        records (list): singleCrossWalkGeoBlacklight arguments per item as a dict
+            or list (filename, layername, geoserver_layername, resource_type,
+            zipurl, mod_url, ark)
+    kwargs:
+        chunk_size (int): records per crossWalkChunk task
+        chunk_bytes (int): xml bytes after which a chunk is closed early
+        index (boolean): index crosswalked records in Solr with a single commit
+    returns:
+        acknowledgement of workflow submitted with the task id of the results.
+        Chord: crossWalkChunk (x chunks) --> batchCrossWalkResults
+    """
+    if not records:
+        return "No records to crosswalk"
+    queuename = batchCrossWalkGeoBlacklight.request.delivery_info['routing_key']
+    chunks = [routed(crossWalkChunk.si(chunk, offset=offset), queuename)
+              for offset, chunk in crossWalkChunks(records, max(int(chunk_size), 1),
+                                                   max(int(chunk_bytes), 1))]
+    result = chord(group(chunks),
+                   routed(batchCrossWalkResults.s(index=index), queuename))()
+    return "Successfully submitted batch crosswalk: {0} records in {1} chunks. Results task: {2}".format(
+        len(records), len(chunks), result.id)
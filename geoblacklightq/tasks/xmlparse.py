@@ -0,0 +1,161 @@
+from xml.etree.ElementTree import iterparse, ParseError
+from .crosswalk import ruleSubtrees
+import os
+
+# Full documents are only kept for files up to this size (bytes)
+xml_full_max_bytes = int(os.getenv('XML_FULL_MAX_BYTES', 5 * 1024 * 1024))
+
+# Root elements (local name) of metadata documents
+metadata_roots = {'metadata': 'fgdc', 'MI_Metadata': 'iso19139',
+                  'MD_Metadata': 'iso19139', 'mods': 'mods'}
+# metadata root children that identify ESRI-ISO rather than FGDC
+esri_children = ['dataIdInfo']
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class _Namespaces(object):
+    """
+    Map '{uri}name' back to the 'prefix:name' used in the document,
+    which is what xmltodict returns without namespace processing.
+    """
+
+    def __init__(self):
+        # xml prefix is bound by definition and never declared
+        self.prefixes = {'http://www.w3.org/XML/1998/namespace': 'xml'}
+        self.pending = []
+
+    def declare(self, prefix, uri):
+        self.prefixes.setdefault(uri, prefix)
+        self.pending.append((prefix, uri))
+
+    def qname(self, tag):
+        if tag[0] != '{':
+            return tag
+        uri, name = tag[1:].split('}', 1)
+        prefix = self.prefixes.get(uri)
+        return "{0}:{1}".format(prefix, name) if prefix else name
+
+    def attributes(self, elem):
+        attrs = {}
+        for prefix, uri in self.pending:
+            attrs["xmlns:{0}".format(prefix) if prefix else "xmlns"] = uri
+        self.pending = []
+        for key, value in elem.attrib.items():
+            attrs[self.qname(key)] = value
+        return attrs
+
+
+def _todict(elem, ns, attrs):
+    """
+    Convert an element to the structure returned by
+    xmltodict.parse(cdata_key='text', attr_prefix='', dict_constructor=dict)
+    """
+    result = dict(attrs.get(elem, {}))
+    for child in elem:
+        name = ns.qname(child.tag)
+        value = _todict(child, ns, attrs)
+        if name in result:
+            if not isinstance(result[name], list):
+                result[name] = [result[name]]
+            result[name].append(value)
+        else:
+            result[name] = value
+    text = ''.join([elem.text or ''] + [child.tail or '' for child in elem]).strip()
+    if not result:
+        return text or None
+    if text:
+        result['text'] = text
+    return result
+
+
+def parseMetadataFile(filename, full=False, max_full_bytes=xml_full_max_bytes):
+    """
+    Incrementally parse an xml file and keep only what the crosswalk uses.
+    Non metadata xml (e.g. .aux.xml sidecars) stops parsing at the root element.
+    Args:
+        filename (string): xml file
+    kwargs:
+        full (boolean): keep the complete document when the file is not larger
+            than max_full_bytes
+    Returns:
+        dict: file, standard (fgdc, esri, iso19139, mods or None), full (boolean),
+            data (xmltodict style dict, None if not metadata), error
+    """
+    result = {"file": filename, "standard": None, "full": False, "data": None, "error": None}
+    keep_all = full and os.path.getsize(filename) <= max_full_bytes
+    subtrees = ruleSubtrees()
+    ns = _Namespaces()
+    attrs = {}
+    root = None
+    root_name = None
+    keep = None
+    depth = 0
+    skipping = 0
+    doc = {}
+    try:
+        for event, elem in iterparse(filename, events=('start-ns', 'start', 'end')):
+            if event == 'start-ns':
+                ns.declare(*elem)
+            elif event == 'start':
+                depth = depth + 1
+                if depth == 1:
+                    root = elem
+                    root_name = ns.qname(elem.tag)
+                    standard = metadata_roots.get(_localname(elem.tag))
+                    if not standard:
+                        result["error"] = "Not a metadata document (root element {0})".format(
+                            root_name)
+                        return result
+                    result["standard"] = standard
+                    keep = None if keep_all else subtrees.get(root_name)
+                    doc = ns.attributes(elem)
+                    continue
+                if depth == 2 and _localname(elem.tag) in esri_children and result["standard"] == 'fgdc':
+                    result["standard"] = 'esri'
+                if skipping or (depth == 2 and keep is not None and ns.qname(elem.tag) not in keep):
+                    skipping = skipping + 1
+                    ns.pending = []
+                    continue
+                node_attrs = ns.attributes(elem)
+                if node_attrs:
+                    attrs[elem] = node_attrs
+            else:
+                depth = depth - 1
+                if skipping:
+                    skipping = skipping - 1
+                    elem.clear()
+                    if depth == 1:
+                        root.clear()
+                elif depth == 1:
+                    # finished a child of the root element
+                    name = ns.qname(elem.tag)
+                    value = _todict(elem, ns, attrs)
+                    if name in doc:
+                        if not isinstance(doc[name], list):
+                            doc[name] = [doc[name]]
+                        doc[name].append(value)
+                    else:
+                        doc[name] = value
+                    root.clear()
+                    attrs = {}
+    except ParseError as inst:
+        result["error"] = str(inst)
+        result["standard"] = None
+        return result
+    result["data"] = {root_name: doc or None}
+    result["full"] = keep_all
+    return result
+
+
+def parseMetadataFiles(filenames, full=False):
+    """
+    Parse several xml files in order. Parsing is CPU bound: threads would only
+    add overhead under the GIL and prefork workers cannot start process pools.
+    Parallelism comes from Celery: batchCrossWalkGeoBlacklight fans files out
+    to crossWalkChunk tasks sized by CROSSWALK_CHUNK_BYTES, and the layers of a
+    multi-layer dataset are parsed in their own loadLayer tasks.
+    """
+    return [parseMetadataFile(f, full=full) for f in filenames]